@@ -0,0 +1,70 @@
+"""
+Cold import time of the GUI and of the modules loaded by the process pool workers.
+
+Every module is imported in a fresh interpreter (best of --repeat runs), the script fails if an import
+takes longer than its budget or loads a module that should only be loaded on first use.
+
+    python benchmarks/import_time.py [--repeat 5] [--scale 1.0]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module: (budget in seconds, modules it must not load)
+TARGETS = {
+    'furret.mainwindow': (1.0, ('furret.query', 'furret.protein', 'pandas', 'requests', 'xmltodict', 'Bio')),
+    'furret.meme': (0.05, ('numpy', 'pandas', 'requests', 'PyQt5')),
+    'furret.prepare': (0.3, ('pandas', 'requests', 'xmltodict', 'PyQt5')),
+    'furret.motifs': (1.0, ('requests', 'xmltodict', 'PyQt5')),
+}
+
+PROBE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(sys.modules)}}))
+'''
+
+
+def measure(module: str, repeat: int):
+    best, modules = None, []
+    for _ in range(repeat):
+        completed = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], cwd=ROOT,
+                                   stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if completed.returncode != 0:
+            return None, completed.stderr.strip().splitlines()[-1:]
+        result = json.loads(completed.stdout.strip().splitlines()[-1])
+        if best is None or result['elapsed'] < best:
+            best = result['elapsed']
+        modules = result['modules']
+    return best, modules
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies all the budgets (slow machines)')
+    args = parser.parse_args()
+    failed = False
+    for module, (budget, forbidden) in TARGETS.items():
+        elapsed, modules = measure(module, args.repeat)
+        if elapsed is None:
+            print(f'{module:20} cannot be imported: {" ".join(modules)}')
+            failed = True
+            continue
+        loaded = [f for f in forbidden if f in modules]
+        over = elapsed > budget * args.scale
+        status = 'FAIL' if loaded or over else 'ok'
+        print(f'{module:20} {1000 * elapsed:8.1f} ms (budget {1000 * budget * args.scale:.0f} ms) {status}'
+              + (f' loads {", ".join(loaded)}' if loaded else ''))
+        failed = failed or bool(loaded) or over
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
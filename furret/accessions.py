@@ -0,0 +1,142 @@
+import functools
+import os
+import sqlite3
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy
+import pandas
+
+import furret.config as config
+
+SPACE_FILE = 'accessions.sqlite'
+WHOLE_QUERY = ('', '')  # (database, family) key of the set of all the proteins of a query
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accessions (id INTEGER PRIMARY KEY, accession TEXT UNIQUE);
+CREATE TABLE IF NOT EXISTS members (query TEXT, database TEXT, family TEXT, size INTEGER, ids BLOB,
+                                    PRIMARY KEY (query, database, family));
+'''
+
+Family = Tuple[str, str]  # (database, family)
+
+
+def _sorted(ids: Iterable[int]) -> numpy.ndarray:
+    return numpy.unique(numpy.fromiter(ids, dtype=numpy.uint32))
+
+
+def _to_blob(ids: numpy.ndarray) -> bytes:
+    return ids.astype('<u4').tobytes()
+
+
+def _from_blob(blob: bytes) -> numpy.ndarray:
+    return numpy.frombuffer(blob, dtype='<u4').astype(numpy.uint32)
+
+
+class AccessionSpace:
+    """
+    integer ids of UniProt accessions in <working directory>/accessions.sqlite, with the members of every query
+    and of its families as sorted id arrays (queries go by directory name: the working directory can be moved)
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path if path else os.path.join(config.working_directory, SPACE_FILE)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def id_map(self, accessions: Iterable[str]) -> Dict[str, int]:
+        """{accession: id}, new accessions get new ids"""
+        rows = [(a,) for a in set(accessions)]
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted (accession TEXT)')
+            self.connection.execute('DELETE FROM wanted')
+            self.connection.executemany('INSERT INTO wanted VALUES (?)', rows)
+            self.connection.execute('INSERT OR IGNORE INTO accessions (accession) SELECT accession FROM wanted')
+            return dict(self.connection.execute('SELECT a.accession, a.id FROM wanted w JOIN accessions a '
+                                                'ON a.accession = w.accession'))
+
+    def ids(self, accessions: Iterable[str]) -> numpy.ndarray:
+        """sorted unique ids of the accessions"""
+        return _sorted(self.id_map(accessions).values())
+
+    def accessions(self, ids: numpy.ndarray) -> List[str]:
+        """the accessions of the ids, in id order"""
+        with self.connection:
+            self.connection.execute('CREATE TEMP TABLE IF NOT EXISTS wanted_ids (id INTEGER)')
+            self.connection.execute('DELETE FROM wanted_ids')
+            self.connection.executemany('INSERT INTO wanted_ids VALUES (?)', [(int(i),) for i in ids])
+            rows = self.connection.execute('SELECT a.accession FROM wanted_ids w JOIN accessions a ON a.id = w.id '
+                                           'ORDER BY a.id')
+            return [accession for accession, in rows]
+
+    def index_query(self, querydir: str, accessions: Iterable[str],
+                    families: Optional[Dict[Family, Iterable[str]]] = None) -> int:
+        """stores (replacing the old ones) the members of a query and of its families, returns the number of sets"""
+        query = os.path.basename(os.path.normpath(querydir))
+        families = families or {}
+        accessions = list(accessions)
+        # one id lookup for everything
+        space = self.id_map(accessions + [a for members in families.values() for a in members])
+        sets = {WHOLE_QUERY: _sorted(space[a] for a in accessions)}
+        for key, members in families.items():
+            sets[key] = _sorted(space[a] for a in members)
+        with self.connection:
+            self.connection.execute('DELETE FROM members WHERE query = ?', (query,))
+            self.connection.executemany('INSERT INTO members VALUES (?, ?, ?, ?, ?)',
+                                        [(query, database, family, len(ids), _to_blob(ids))
+                                         for (database, family), ids in sets.items()])
+        return len(sets)
+
+    def is_indexed(self, querydir: str) -> bool:
+        query = os.path.basename(os.path.normpath(querydir))
+        return self.connection.execute('SELECT 1 FROM members WHERE query = ? LIMIT 1', (query,)).fetchone() is not None
+
+    def members(self, querydir: str, family: Family = WHOLE_QUERY) -> numpy.ndarray:
+        query = os.path.basename(os.path.normpath(querydir))
+        row = self.connection.execute('SELECT ids FROM members WHERE query = ? AND database = ? AND family = ?',
+                                      (query,) + tuple(family)).fetchone()
+        if row is None:
+            raise KeyError(f'''{family[0]} {family[1]} not indexed in {query}''')
+        return _from_blob(row[0])
+
+    def families(self, querydir: str) -> List[Tuple[str, str, int]]:
+        """(database, family, size) of the families of a query"""
+        query = os.path.basename(os.path.normpath(querydir))
+        return list(self.connection.execute("SELECT database, family, size FROM members WHERE query = ? "
+                                            "AND database != '' ORDER BY database, family", (query,)))
+
+
+def link_families(links: pandas.DataFrame) -> Dict[Family, List[str]]:
+    """{(database, family): accessions} from the links table (Uniprot, Database, Value...)"""
+    if links is None or len(links) == 0:
+        return {}
+    grouped = links.groupby(['Database', 'Value'])['Uniprot'].unique()
+    return {(str(database), str(value)): list(members) for (database, value), members in grouped.items()}
+
+
+def union(*sets: numpy.ndarray) -> numpy.ndarray:
+    if not sets:
+        return numpy.zeros(0, dtype=numpy.uint32)
+    return numpy.unique(numpy.concatenate(sets))
+
+
+def intersection(*sets: numpy.ndarray) -> numpy.ndarray:
+    if not sets:
+        return numpy.zeros(0, dtype=numpy.uint32)
+    return functools.reduce(lambda a, b: numpy.intersect1d(a, b, assume_unique=True), sets)
+
+
+def difference(first: numpy.ndarray, *others: numpy.ndarray) -> numpy.ndarray:
+    """members of the first set in none of the others"""
+    return numpy.setdiff1d(first, union(*others), assume_unique=True) if others else first
+
+
+OPERATIONS = {'Union': union, 'Intersection': intersection, 'Difference': difference}
+SYMBOLS = {'Union': 'OR', 'Intersection': 'AND', 'Difference': 'NOT'}
+
+
+def combine(operation: str, sets: Sequence[numpy.ndarray]) -> numpy.ndarray:
+    """Union, Intersection or Difference (the first set minus the others) of sorted id arrays"""
+    return OPERATIONS[operation](*sets)
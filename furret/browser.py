@@ -0,0 +1,423 @@
+import json
+import os
+import pickle
+from collections import OrderedDict
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+from PyQt5.QtCore import QAbstractTableModel, QModelIndex, Qt, QVariant
+from PyQt5.QtWidgets import (QAbstractItemView, QApplication, QComboBox, QCompleter, QDialog, QHBoxLayout,
+                             QHeaderView, QInputDialog, QLabel, QLineEdit, QListWidget, QPushButton, QStatusBar,
+                             QTableView, QVBoxLayout, QWidget)
+
+import furret.config as config
+
+if TYPE_CHECKING:
+    import pandas
+    from furret.table_store import TableStore
+    from furret.accessions import Family
+
+PAGE_SIZE = 256  # rows read from the store at once
+MAX_PAGES = 64  # pages kept in memory per model, whatever the size of the table
+
+
+def query_status(directory: str) -> str:
+    """'' for complete queries, else the state of the first stage not done (from stages.json)"""
+    path = os.path.join(directory, 'stages.json')
+    if not os.path.isfile(path):
+        return ''
+    with open(path, 'rt') as stages_file:
+        states = json.load(stages_file)
+    # furret.query.STAGES, not imported here to keep the startup light
+    for name in ('fetch', 'proteins', 'sequences', 'tables'):
+        state = states.get(name, {}).get('state', 'pending')
+        if state != 'done':
+            return f'{name} {state}'
+    return ''
+
+
+def find_queries() -> Tuple[List[Tuple[str, str, str, str]], List[str]]:
+    """
+    (query, date, status, directory) of the queries in the working directory
+    and the directories with a bad query.txt
+    """
+    queries, broken = [], []
+    if not os.path.isdir(config.working_directory):
+        return queries, broken
+    for entry in os.scandir(config.working_directory):
+        if not entry.is_dir() or not os.path.isfile(os.path.join(entry.path, 'query.pickle')):
+            continue
+        query_file = os.path.join(entry.path, 'query.txt')
+        if not os.path.isfile(query_file):
+            broken.append(entry.path)
+            continue
+        with open(query_file) as text:
+            lines = text.readlines()
+        if len(lines) < 2 or len(lines[1]) < 19:
+            broken.append(entry.path)
+            continue
+        queries.append((lines[0].strip(), lines[1][:19], query_status(entry.path), entry.path))
+    return queries, broken
+
+
+class QueryListModel(QAbstractTableModel):
+    """the queries of the working directory: Query, Date, Status (the directory is kept as user data)"""
+
+    HEADERS = ('Query', 'Date', 'Status')
+
+    def __init__(self, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        self.queries: List[Tuple[str, str, str, str]] = []
+        self.broken: List[str] = []
+        self.sort_column, self.sort_order = 1, Qt.AscendingOrder
+
+    def refresh(self) -> None:
+        self.beginResetModel()
+        self.queries, self.broken = find_queries()
+        self._sort()
+        self.endResetModel()
+
+    def _sort(self) -> None:
+        self.queries.sort(key=lambda q: q[self.sort_column].lower(), reverse=self.sort_order == Qt.DescendingOrder)
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.queries)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        if role == Qt.DisplayRole:
+            return self.queries[index.row()][index.column()]
+        if role in (Qt.ToolTipRole, Qt.UserRole):
+            return self.queries[index.row()][3]
+        return QVariant()
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        if role == Qt.TextAlignmentRole and orientation == Qt.Horizontal:
+            return Qt.AlignHCenter
+        return QVariant()
+
+    def sort(self, column: int, order: int = Qt.AscendingOrder) -> None:
+        self.layoutAboutToBeChanged.emit()
+        self.sort_column, self.sort_order = column, order
+        self._sort()
+        self.layoutChanged.emit()
+
+    def directory(self, row: int) -> str:
+        return self.queries[row][3] if 0 <= row < len(self.queries) else ''
+
+
+class StoreTableModel(QAbstractTableModel):
+    """
+    One table of a query TableStore. Only the (sorted, filtered) row ids are held, the rows are read
+    PAGE_SIZE at a time when the view asks for them and at most MAX_PAGES pages are cached.
+    """
+
+    def __init__(self, store: 'TableStore', name: str, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        self.store = store
+        self.name = name
+        self.headers = store.columns(name)
+        self.text = ''
+        self.order_by: Optional[int] = None
+        self.descending = False
+        self.ids = store.row_ids(name)
+        self.pages: 'OrderedDict[int, list]' = OrderedDict()
+
+    def _reload(self) -> None:
+        self.beginResetModel()
+        self.ids = self.store.row_ids(self.name, self.text, self.order_by, self.descending)
+        self.pages.clear()
+        self.endResetModel()
+
+    def set_filter(self, text: str) -> None:
+        self.text = text.strip()
+        self._reload()
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.ids)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def _row(self, row: int) -> tuple:
+        number = row // PAGE_SIZE
+        page = self.pages.get(number)
+        if page is None:
+            page = self.store.rows(self.name, self.ids[number * PAGE_SIZE:(number + 1) * PAGE_SIZE])
+            self.pages[number] = page
+            if len(self.pages) > MAX_PAGES:
+                self.pages.popitem(last=False)
+        else:
+            self.pages.move_to_end(number)
+        return page[row % PAGE_SIZE]
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole, Qt.TextAlignmentRole):
+            return QVariant()
+        value = self._row(index.row())[index.column()]
+        if role == Qt.TextAlignmentRole:
+            return Qt.AlignRight | Qt.AlignVCenter if isinstance(value, (int, float)) else QVariant()
+        if value is None:
+            return ''
+        if role == Qt.ToolTipRole:
+            return str(value) if isinstance(value, str) and len(value) > 60 else QVariant()
+        return str(value) if isinstance(value, str) else value
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return section + 1
+
+    def sort(self, column: int, order: int = Qt.AscendingOrder) -> None:
+        self.order_by, self.descending = column, order == Qt.DescendingOrder
+        self._reload()
+
+
+class FrameTableModel(QAbstractTableModel):
+    """a DataFrame already in memory (e.g. search hits), sortable by column: the view asks only for visible cells"""
+
+    def __init__(self, df: 'pandas.DataFrame', parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        self.df = df.reset_index(drop=True)
+        self.headers = [str(c) for c in df.columns]
+
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.df)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.headers)
+
+    def data(self, index: QModelIndex, role: int = Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.ToolTipRole):
+            return QVariant()
+        value = self.df.iat[index.row(), index.column()]
+        if role == Qt.ToolTipRole:
+            return str(value) if isinstance(value, str) and len(value) > 60 else QVariant()
+        return str(value)
+
+    def headerData(self, section: int, orientation: int, role: int = Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            return self.headers[section]
+        return section + 1
+
+    def sort(self, column: int, order: int = Qt.AscendingOrder) -> None:
+        self.layoutAboutToBeChanged.emit()
+        self.df = self.df.sort_values(self.df.columns[column], ascending=order == Qt.AscendingOrder,
+                                      kind='mergesort').reset_index(drop=True)
+        self.layoutChanged.emit()
+
+
+class TableBrowser(QDialog):
+    """browses all the tables of a query from its TableStore"""
+
+    def __init__(self, querydir: str, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        from furret.table_store import TableStore
+        self.store = TableStore(querydir)
+        self.model: Optional[StoreTableModel] = None
+        self.table_box = QComboBox()
+        self.table_box.addItems(self.store.names())
+        self.table_box.currentTextChanged.connect(self.show_table)
+        self.filter_box = QLineEdit()
+        self.filter_box.setPlaceholderText('Filter rows')
+        self.filter_box.returnPressed.connect(self.apply_filter)
+        self.count_label = QLabel()
+        self.view = QTableView()
+        self.view.setSortingEnabled(True)
+        self.view.setAlternatingRowColors(True)
+        self.view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.view.setWordWrap(False)
+        # fixed row heights: the view never measures the rows it does not show
+        self.view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.view.verticalHeader().setDefaultSectionSize(self.view.fontMetrics().height() + 6)
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+
+        top = QHBoxLayout()
+        top.addWidget(QLabel('Table:'))
+        top.addWidget(self.table_box)
+        top.addWidget(self.filter_box, 1)
+        top.addWidget(self.count_label)
+        layout = QVBoxLayout()
+        layout.addLayout(top)
+        layout.addWidget(self.view)
+        self.setLayout(layout)
+        self.setWindowTitle(f'Tables: {os.path.basename(querydir)}')
+        self.resize(1000, 600)
+        if self.table_box.count():
+            self.show_table(self.table_box.currentText())
+
+    def show_table(self, name: str) -> None:
+        self.model = StoreTableModel(self.store, name, self)
+        self.view.setModel(self.model)
+        self.view.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        if self.filter_box.text().strip():
+            self.model.set_filter(self.filter_box.text())
+        self._fit_columns()
+        self._count()
+
+    def apply_filter(self) -> None:
+        if self.model is not None:
+            self.model.set_filter(self.filter_box.text())
+            self._count()
+
+    def _fit_columns(self) -> None:
+        # resizeColumnsToContents would read every row: size on the first page only
+        header = self.view.horizontalHeader()
+        metrics = self.view.fontMetrics()
+        rows = min(self.model.rowCount(), PAGE_SIZE)
+        for column in range(self.model.columnCount()):
+            texts = [str(self.model.headerData(column, Qt.Horizontal))]
+            texts += [str(self.model.data(self.model.index(row, column))) for row in range(rows)]
+            header.resizeSection(column, min(max(metrics.width(t) for t in texts) + 16, 400))
+
+    def _count(self) -> None:
+        self.count_label.setText(f'{self.model.rowCount()} of {self.store.size(self.model.name)} rows')
+
+    def done(self, result: int) -> None:
+        self.store.close()
+        super().done(result)
+
+
+class SetAlgebraDialog(QDialog):
+    """
+    union, intersection and difference (the first operand minus the others) of queries and families of queries,
+    from the working directory AccessionSpace. The result can be saved as a new query, made without fetching.
+    """
+
+    def __init__(self, status: QStatusBar, parent: Optional[QWidget] = None) -> None:
+        super().__init__(parent)
+        from furret.accessions import AccessionSpace, OPERATIONS
+        self.space = AccessionSpace()
+        self.status = status
+        self.queries = find_queries()[0]
+        self.operands: List[Tuple[str, str, 'Family']] = []  # (label, query directory, family)
+        self.result = None
+        self.query_box = QComboBox()
+        self.query_box.addItems([f'{query} ({date})' for query, date, _, _ in self.queries])
+        self.query_box.currentIndexChanged.connect(self.list_families)
+        self.family_box = QComboBox()
+        self.family_box.setEditable(True)
+        self.family_box.setInsertPolicy(QComboBox.NoInsert)
+        self.family_box.completer().setFilterMode(Qt.MatchContains)
+        self.family_box.completer().setCompletionMode(QCompleter.PopupCompletion)
+        add_button = QPushButton('Add')
+        add_button.clicked.connect(self.add_operand)
+        self.operand_list = QListWidget()
+        remove_button = QPushButton('Remove')
+        remove_button.clicked.connect(self.remove_operand)
+        self.operation_box = QComboBox()
+        self.operation_box.addItems(list(OPERATIONS))
+        self.operation_box.currentTextChanged.connect(self.evaluate)
+        self.count_label = QLabel()
+        create_button = QPushButton('Create Query...')
+        create_button.clicked.connect(self.create_query)
+        close_button = QPushButton('Close')
+        close_button.clicked.connect(self.reject)
+
+        top = QHBoxLayout()
+        top.addWidget(self.query_box, 1)
+        top.addWidget(self.family_box, 1)
+        top.addWidget(add_button)
+        bottom = QHBoxLayout()
+        bottom.addWidget(QLabel('Operation:'))
+        bottom.addWidget(self.operation_box)
+        bottom.addWidget(self.count_label, 1)
+        bottom.addWidget(remove_button)
+        bottom.addWidget(create_button)
+        bottom.addWidget(close_button)
+        layout = QVBoxLayout()
+        layout.addLayout(top)
+        layout.addWidget(self.operand_list)
+        layout.addLayout(bottom)
+        self.setLayout(layout)
+        self.setWindowTitle('Combine Queries')
+        self.resize(800, 400)
+        if self.queries:
+            self.list_families(0)
+        self.evaluate()
+
+    def _ensure_indexed(self, directory: str) -> None:
+        if self.space.is_indexed(directory):
+            return
+        # queries made before the accession space: indexed once from the pickle
+        self.status.showMessage(f'Indexing {os.path.basename(directory)}, please be patient')
+        QApplication.processEvents()
+        with open(os.path.join(directory, 'query.pickle'), 'rb') as query_pickle:
+            the_query = pickle.load(query_pickle)
+        the_query.index_accessions(the_query.tables.db if the_query.tables is not None else None)
+        self.status.showMessage('Done.')
+
+    def list_families(self, row: int) -> None:
+        from furret.accessions import WHOLE_QUERY
+        self.family_box.clear()
+        if not 0 <= row < len(self.queries):
+            return
+        directory = self.queries[row][3]
+        self._ensure_indexed(directory)
+        self.family_box.addItem('All proteins', WHOLE_QUERY)
+        for database, family, size in self.space.families(directory):
+            self.family_box.addItem(f'{database}: {family} ({size})', (database, family))
+
+    def add_operand(self) -> None:
+        row = self.query_box.currentIndex()
+        index = self.family_box.findText(self.family_box.currentText())
+        if row < 0 or index < 0:
+            self.status.showMessage('Choose a query and one of its families')
+            return
+        family = tuple(self.family_box.itemData(index))
+        query = self.queries[row][0]
+        label = query if not family[0] else f'{query} {family[0]}:{family[1]}'
+        self.operands.append((label, self.queries[row][3], family))
+        self.operand_list.addItem(label)
+        self.evaluate()
+
+    def remove_operand(self) -> None:
+        row = self.operand_list.currentRow()
+        if row >= 0:
+            del self.operands[row]
+            self.operand_list.takeItem(row)
+            self.evaluate()
+
+    def evaluate(self) -> None:
+        from furret.accessions import combine
+        if not self.operands:
+            self.result = None
+            self.count_label.setText('Add queries or families')
+            return
+        sets = [self.space.members(directory, family) for _, directory, family in self.operands]
+        self.result = combine(self.operation_box.currentText(), sets)
+        self.count_label.setText(f'{len(self.result)} proteins')
+
+    def create_query(self) -> None:
+        from furret.accessions import SYMBOLS
+        if self.result is None or len(self.result) == 0:
+            self.status.showMessage('No proteins to make a query of')
+            return
+        symbol = SYMBOLS[self.operation_box.currentText()]
+        description = f' {symbol} '.join(f'({label})' for label, _, _ in self.operands)
+        description, ok = QInputDialog.getText(self, 'Derived Query', 'Query:', text=description)
+        if not ok or not description.strip():
+            return
+        accessions = self.space.accessions(self.result)
+        sources = list(dict.fromkeys(directory for _, directory, _ in self.operands))
+        from furret.query import Query
+        try:
+            Query.derive(description.strip(), accessions, sources, self.status)
+        except OSError as e:
+            self.status.showMessage(f"Can't create the query: {e}")
+            return
+        self.accept()
+
+    def done(self, result: int) -> None:
+        self.space.close()
+        super().done(result)
@@ -9,3 +9,15 @@ meme_executable = ''
 meme_options = '-protein -oc . -nostatus -time 18000 -mod zoops -nmotifs 100 -minw 6' +\
                ' -maxw 50 -objfun classic -markov_order 0'
 entrez_email = 'my.name@my.domain'
+# family members above this identity are folded into one representative before MEME, 0 disables
+meme_identity = 0.0
+# local GO ontology (go-basic.obo) used to propagate annotations to ancestor terms, '' disables
+go_obo_file = ''
+# days after which proteins in the working directory protein store are rebuilt (Swiss Model metadata changes), 0 never
+protein_store_days = 30
+# local MEME worker processes started by Generate Motives (0 = one per core), other hosts can run furret.worker
+meme_workers = 0
+# UniProt download: 'xml' full entries, 'json' only the fields Furret reads (smaller download, faster parsing)
+uniprot_format = 'xml'
+# RCSB GraphQL endpoint of the PDB entry metadata (release date, R-free, ligands...), a local server can stand in
+rcsb_graphql_url = 'https://data.rcsb.org/graphql'
@@ -0,0 +1,28 @@
+from typing import Sequence, Tuple
+
+import numpy
+
+AMINO_ACIDS = 'ACDEFGHIKLMNPQRSTVWY'
+UNKNOWN = len(AMINO_ACIDS)  # code for X, B, Z, U, O and anything else
+
+_table = numpy.full(256, UNKNOWN, dtype=numpy.uint8)
+for _code, _letter in enumerate(AMINO_ACIDS):
+    _table[ord(_letter)] = _code
+    _table[ord(_letter.lower())] = _code
+
+
+def encode(sequences: Sequence[str]) -> Tuple[numpy.ndarray, numpy.ndarray]:
+    """
+    Encodes all sequences in one uint8 array of residue codes (0-19, UNKNOWN otherwise).
+    Sequence i is codes[offsets[i]:offsets[i + 1]].
+    """
+    raw = numpy.frombuffer(''.join(sequences).encode('ascii', 'replace'), dtype=numpy.uint8)
+    codes = _table[raw]
+    offsets = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+    numpy.cumsum([len(s) for s in sequences], out=offsets[1:])
+    return codes, offsets
+
+
+def sequence_ids(offsets: numpy.ndarray) -> numpy.ndarray:
+    """index of the sequence each position of the concatenated codes belongs to"""
+    return numpy.repeat(numpy.arange(len(offsets) - 1), numpy.diff(offsets))
@@ -0,0 +1,91 @@
+import numpy
+import pandas
+
+from furret.matrices import Incidence
+
+TOLERANCE = 1e-16  # relative size at which tail terms are no longer summed
+
+
+def log_factorials(n: int) -> numpy.ndarray:
+    """log(i!) for i in 0..n"""
+    result = numpy.zeros(n + 1)
+    numpy.cumsum(numpy.log(numpy.arange(1, n + 1)), out=result[1:])
+    return result
+
+
+def _tail(start: numpy.ndarray, step: int, bound: numpy.ndarray, population: numpy.ndarray,
+          successes: numpy.ndarray, draws: numpy.ndarray, lf: numpy.ndarray) -> numpy.ndarray:
+    # sums the pmf from start towards bound (included) for all elements at once: the terms only decrease
+    # moving away from the mode, so an element leaves as soon as its terms are negligible
+    result = numpy.zeros(start.shape)
+    active = numpy.flatnonzero((bound - start) * step >= 0)
+    offset = 0
+    while active.size:
+        i = start[active] + step * offset
+        big_n, big_k, n = population[active], successes[active], draws[active]
+        term = numpy.exp(lf[big_k] - lf[i] - lf[big_k - i] + lf[big_n - big_k] - lf[n - i]
+                         - lf[big_n - big_k - n + i] - lf[big_n] + lf[n] + lf[big_n - n])
+        result[active] += term
+        done = (i == bound[active]) | (term < TOLERANCE * result[active])
+        active = active[~done]
+        offset += 1
+    return result
+
+
+def hypergeometric_sf(k: numpy.ndarray, population: numpy.ndarray, successes: numpy.ndarray,
+                      draws: numpy.ndarray) -> numpy.ndarray:
+    """
+    P(X >= k) for X ~ Hypergeometric(population, successes, draws), element-wise and vectorized.
+    Above the mode the upper tail is summed, below it one minus the lower tail, so every sum starts
+    from its largest term and stops after a few standard deviations.
+    """
+    k, population, successes, draws = (numpy.asarray(a, dtype=numpy.int64) for a in
+                                       (k, population, successes, draws))
+    lf = log_factorials(int(population.max()) if population.size else 0)
+    lower = numpy.maximum(0, draws + successes - population)
+    upper = numpy.minimum(successes, draws)
+    mode = (draws + 1) * (successes + 1) // (population + 2)
+    result = numpy.ones(k.shape)
+    above = k > mode
+    if above.any():
+        result[above] = _tail(k[above], 1, upper[above], population[above], successes[above], draws[above], lf)
+    below = ~above
+    if below.any():
+        result[below] = 1.0 - _tail(k[below] - 1, -1, lower[below], population[below], successes[below],
+                                    draws[below], lf)
+    return numpy.clip(result, 0.0, 1.0)
+
+
+def benjamini_hochberg(pvalues: numpy.ndarray) -> numpy.ndarray:
+    m = len(pvalues)
+    if m == 0:
+        return pvalues
+    order = numpy.argsort(pvalues)
+    scaled = pvalues[order] * m / numpy.arange(1, m + 1)
+    scaled = numpy.minimum.accumulate(scaled[::-1])[::-1]
+    qvalues = numpy.empty(m)
+    qvalues[order] = numpy.minimum(scaled, 1.0)
+    return qvalues
+
+
+def enrichment(families: Incidence, terms: Incidence) -> pandas.DataFrame:
+    """
+    Over-representation of every term in every family, against the query proteins annotated in terms.
+    Only (family, term) pairs sharing at least one protein are tested; q-values are Benjamini-Hochberg.
+    """
+    annotated = terms.row_lengths() > 0
+    population = int(annotated.sum())
+    cols = ('Family', 'Term', 'Count', 'Family Size', 'Term Count', 'Background', 'Expected', 'Fold',
+            'P-value', 'Q-value')
+    if population == 0:
+        return pandas.DataFrame([], columns=cols)
+    family_sizes = numpy.bincount(families.indices[annotated[families.row_ids()]], minlength=len(families.columns))
+    term_counts = terms.column_counts()
+    f, t, k = families.product(terms)
+    draws, successes = family_sizes[f], term_counts[t]
+    pvalues = hypergeometric_sf(k, numpy.full(len(k), population), successes, draws)
+    expected = draws * successes / population
+    return pandas.DataFrame({'Family': families.columns[f], 'Term': terms.columns[t], 'Count': k,
+                             'Family Size': draws, 'Term Count': successes, 'Background': population,
+                             'Expected': expected, 'Fold': k / expected, 'P-value': pvalues,
+                             'Q-value': benjamini_hochberg(pvalues)}, columns=cols)
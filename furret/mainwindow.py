@@ -6,8 +6,8 @@ from PyQt5.QtWidgets import *
 from PyQt5.QtCore import *
 import furret.config as config
 from furret.preferences import load_settings
-from furret.query import Query
 from furret.preferences import PreferencesDialog
+from furret.browser import FrameTableModel, QueryListModel, SetAlgebraDialog, TableBrowser
 
 
 class MainWindow(QMainWindow):
@@ -15,52 +15,27 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         load_settings()
-        self.table_widget = QTableWidget()
+        self.query_model = QueryListModel(self)
+        self.table_view = QTableView()
+        self.search_box = QLineEdit()
         self.init_ui()
 
     def update_table(self):
-        self.table_widget.clearContents()
-
-        candidates = [f.path for f in os.scandir(config.working_directory) if f.is_dir()]
-        queries = []
-        for c in candidates:
-            if not os.path.isdir(c):
-                continue
-            if not os.path.isfile(os.path.join(c, 'query.pickle')):
-                continue
-            query_file = os.path.join(c, 'query.txt')
-            if not os.path.isfile(query_file):
-                self.statusBar().showMessage('query.txt file missing')
-                continue
-            with open(query_file) as text:
-                lines = text.readlines()
-            if not lines or len(lines) < 2 or len(lines[1]) < 19:
-                self.statusBar().showMessage('query.txt file missing')
-                continue
-            queries.append((lines[0], lines[1][:19], c))
-        content = sorted(queries, key=lambda xx: xx[1])
-
-        self.table_widget.setRowCount(len(content))
-
-        for i, line in enumerate(content):
-            self.table_widget.setItem(i, 0, QTableWidgetItem(line[0]))
-            self.table_widget.setItem(i, 1, QTableWidgetItem(line[1]))
-            self.table_widget.setItem(i, 2, QTableWidgetItem(line[2]))
-            self.table_widget.move(0, 0)
-
-        self.table_widget.resizeColumnsToContents()
-        x = self.table_widget.verticalHeader().size().width()
-        for i in range(self.table_widget.columnCount()):
-            x += self.table_widget.columnWidth(i)
-
-        y = self.table_widget.horizontalHeader().size().height()
-        for i in range(self.table_widget.rowCount()):
-            y += self.table_widget.rowHeight(i)
-
+        self.query_model.refresh()
+        if self.query_model.broken:
+            self.statusBar().showMessage('query.txt file missing')
+
+        self.table_view.resizeColumnsToContents()
+        x = self.table_view.verticalHeader().width()
+        for i in range(self.query_model.columnCount()):
+            x += self.table_view.columnWidth(i)
+        rows = min(self.query_model.rowCount(), 30)
+        y = self.table_view.horizontalHeader().height() + rows * self.table_view.verticalHeader().defaultSectionSize()
         y += self.menuBar().height()
         y += self.statusBar().height()
+        y += self.search_bar.height()
 
-        self.setFixedSize(max(x + 2, 200), y + 2)
+        self.resize(max(x + 24, 200), y + 24)
 
     # noinspection PyUnresolvedReferences
     def init_ui(self):
@@ -87,24 +62,47 @@ class MainWindow(QMainWindow):
         # Make tables
         make_tables_action = QAction("&Make Tables", self)
         make_tables_action.triggered.connect(self.make_tables)
+        # Browse tables
+        browse_tables_action = QAction("&Browse Tables...", self)
+        browse_tables_action.setShortcut("Ctrl+B")
+        browse_tables_action.triggered.connect(self.browse_tables)
+        # Combine queries
+        combine_queries_action = QAction("&Combine Queries...", self)
+        combine_queries_action.triggered.connect(self.combine_queries)
+        # Resume query
+        resume_query_action = QAction("&Resume", self)
+        resume_query_action.triggered.connect(self.resume_query)
         # Download structures
         download_structures_action = QAction("&Download PDB", self)
         download_structures_action.triggered.connect(self.download_structures)
+        # Prepare structures
+        prepare_structures_action = QAction("&Prepare Structures", self)
+        prepare_structures_action.triggered.connect(self.prepare_structures)
         # Families Sequences Action
         families_sequences_action = QAction("&Generate Sequences", self)
         families_sequences_action.triggered.connect(self.families_sequences)
         # Families Structures Action
         families_structures_action = QAction("&Generate Structures", self)
         families_structures_action.triggered.connect(self.families_structures)
+        families_structures_uncompressed_action = QAction("Generate Structures (&Uncompressed)", self)
+        families_structures_uncompressed_action.triggered.connect(self.families_structures_uncompressed)
         # Families Motives Action
         families_motives_action = QAction("&Generate Motives", self)
         families_motives_action.triggered.connect(self.families_motives)
+        # Scan Motives Action
+        scan_motives_action = QAction("S&can Motives", self)
+        scan_motives_action.triggered.connect(self.scan_motives)
         summary_report_action = QAction("&Summary", self)
         summary_report_action.triggered.connect(self.report_summary)
 
         self.statusBar()
 
         # self.toolbar = self.addToolBar('Bar')
+        self.search_bar = self.addToolBar('Search')
+        self.search_bar.setMovable(False)
+        self.search_box.setPlaceholderText('Search comments, citations, names (toxin* -sodium OR ...)')
+        self.search_box.returnPressed.connect(self.search)
+        self.search_bar.addWidget(self.search_box)
 
         menubar = self.menuBar()
         menubar.setNativeMenuBar(False)
@@ -115,34 +113,37 @@ class MainWindow(QMainWindow):
         fam_menu = QMenu("Families", self)
         fam_menu.addAction(families_sequences_action)
         fam_menu.addAction(families_structures_action)
+        fam_menu.addAction(families_structures_uncompressed_action)
         fam_menu.addAction(families_motives_action)
+        fam_menu.addAction(scan_motives_action)
         query_menu = menubar.addMenu('&Query')
         query_menu.addAction(new_query_action)
         query_menu.addAction(delete_query_action)
+        query_menu.addAction(browse_tables_action)
+        query_menu.addAction(combine_queries_action)
+        query_menu.addAction(resume_query_action)
+        query_menu.addAction(make_tables_action)
         query_menu.addAction(download_structures_action)
+        query_menu.addAction(prepare_structures_action)
         query_menu.addMenu(fam_menu)
         query_menu.addAction(summary_report_action)
 
-        self.table_widget.setColumnCount(3)
-        self.table_widget.setColumnHidden(2, True)
-        self.table_widget.setRowCount(0)
-        self.table_widget.setHorizontalHeaderLabels(['Query', 'Date'])
-        self.table_widget.horizontalHeaderItem(0).setTextAlignment(Qt.AlignHCenter)
-        self.table_widget.horizontalHeaderItem(1).setTextAlignment(Qt.AlignHCenter)
-        self.table_widget.setSizeAdjustPolicy(QAbstractScrollArea.AdjustToContents)
-        self.table_widget.setAlternatingRowColors(True)
-        self.table_widget.setEditTriggers(QAbstractItemView.NoEditTriggers)
-        self.table_widget.setSelectionBehavior(QAbstractItemView.SelectRows)
-        # self.table_widget.cellDoubleClicked.connect(self.got_double_click)
-        self.table_widget.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_view.setModel(self.query_model)
+        self.table_view.setSortingEnabled(True)
+        self.table_view.horizontalHeader().setSortIndicator(1, Qt.AscendingOrder)
+        self.table_view.setAlternatingRowColors(True)
+        self.table_view.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        self.table_view.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table_view.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table_view.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        self.table_view.doubleClicked.connect(self.browse_tables)
         self.update_table()
 
         self.setWindowTitle(f'{config.APPLICATION_NAME} Main Window')
 
-        self.setCentralWidget(self.table_widget)
+        self.setCentralWidget(self.table_view)
 
         self.show()
-        self.update_table()
 
     def new_query(self):
         dlg = QInputDialog(self)
@@ -153,28 +154,78 @@ class MainWindow(QMainWindow):
         query_text = dlg.textValue()
 
         if ok:
-            _ = Query(query_text, self.statusBar())
+            # furret.query brings in pandas, requests and xmltodict: loaded when first needed, not at startup
+            from furret.query import Query
+            try:
+                _ = Query(query_text, self.statusBar())
+            except OSError as e:
+                self.statusBar().showMessage(f"Can't create the query: {e}")
             self.update_table()
 
     def delete_query(self):
-        a = self.table_widget.selectedIndexes()
-        if len(a) > 0:
-            row = a[0].row()
+        the_dir = self.get_selection_directory()
+        if the_dir:
             should_delete = QMessageBox.question(self,
                                                  "Deleting Query",
                                                  "Are You sure you want to delete the selected query?",
                                                  QMessageBox.Yes, QMessageBox.No)
             if should_delete == QMessageBox.Yes:
-                the_dir = self.table_widget.item(row, 2).text()
                 shutil.rmtree(the_dir)
-                self.table_widget.removeRow(row)
                 self.update_table()
 
         else:
             self.statusBar().showMessage('Select a query to be removed!')
 
+    def browse_tables(self):
+        the_dir = self.get_selection_directory()
+        if not the_dir:
+            self.statusBar().showMessage('Select a query to browse')
+            return
+        from furret.table_store import TableStore, store_tables
+        if not TableStore.exists(the_dir):
+            # queries made before the table store: stored once from the pickle
+            self.statusBar().showMessage('Storing tables, please be patient')
+            QApplication.processEvents()
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+            if the_query.tables is None:
+                self.statusBar().showMessage('No tables, make the tables again')
+                return
+            store_tables(the_query.tables, the_dir).close()
+            self.statusBar().showMessage('Done.')
+        browser = TableBrowser(the_dir, self)
+        browser.exec_()
+
+    def combine_queries(self):
+        dialog = SetAlgebraDialog(self.statusBar(), self)
+        if dialog.exec_() == QDialog.Accepted:
+            self.update_table()
+
     def make_tables(self):
-        self.statusBar().showMessage('Make Tables Action triggered!')
+        the_dir = self.get_selection_directory()
+        if the_dir:
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+            pending = the_query.pending_stages()
+            if pending and pending[0] != 'tables':
+                self.statusBar().showMessage(f'The query stopped before the tables ({pending[0]}), resume it')
+                return
+            the_query.run(self.statusBar(), stages=('tables',), action='tables')
+        else:
+            self.statusBar().showMessage('Select a query')
+
+    def resume_query(self):
+        the_dir = self.get_selection_directory()
+        if the_dir:
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+            pending = the_query.pending_stages()
+            if not pending:
+                self.statusBar().showMessage('The query is complete')
+                return
+            the_query.run(self.statusBar())
+        else:
+            self.statusBar().showMessage('Select a query')
 
     def download_structures(self):
         self.statusBar().showMessage('Download Structures Action triggered!')
@@ -186,6 +237,15 @@ class MainWindow(QMainWindow):
         else:
             self.statusBar().showMessage('Select a query to download structures!')
 
+    def prepare_structures(self):
+        the_dir = self.get_selection_directory()
+        if the_dir:
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+                the_query.prepare_structures(self.statusBar())
+        else:
+            self.statusBar().showMessage('Select a query')
+
     def families_sequences(self):
         the_dir = self.get_selection_directory()
         if the_dir:
@@ -204,6 +264,15 @@ class MainWindow(QMainWindow):
         else:
             self.statusBar().showMessage('Select a query')
 
+    def families_structures_uncompressed(self):
+        the_dir = self.get_selection_directory()
+        if the_dir:
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+                the_query.gen_fam_struct(self.statusBar(), decompress=True)
+        else:
+            self.statusBar().showMessage('Select a query')
+
     def families_motives(self):
         the_dir = self.get_selection_directory()
         if the_dir:
@@ -213,6 +282,15 @@ class MainWindow(QMainWindow):
         else:
             self.statusBar().showMessage('Select a query')
 
+    def scan_motives(self):
+        the_dir = self.get_selection_directory()
+        if the_dir:
+            with open(os.path.join(the_dir, 'query.pickle'), 'rb') as query_pickle:
+                the_query = pickle.load(query_pickle)
+                the_query.scan_motifs(self.statusBar())
+        else:
+            self.statusBar().showMessage('Select a query')
+
     def report_summary(self):
         the_dir = self.get_selection_directory()
         if the_dir:
@@ -222,6 +300,42 @@ class MainWindow(QMainWindow):
         else:
             self.statusBar().showMessage('Select a query')
 
+    def search(self):
+        the_dir = self.get_selection_directory()
+        text = self.search_box.text().strip()
+        if not the_dir:
+            self.statusBar().showMessage('Select a query to search')
+            return
+        if not text:
+            return
+        from furret.search import SearchIndex
+        index = SearchIndex.load(the_dir)
+        if index is None:
+            self.statusBar().showMessage('No search index, make the tables again')
+            return
+        hits = index.search(text)
+        self.statusBar().showMessage(f'{len(hits)} hits for {text}')
+        dialog = QDialog(self)
+        dialog.setWindowTitle(f'Search: {text}')
+        table = QTableView(dialog)
+        table.setModel(FrameTableModel(hits, table))
+        table.setSortingEnabled(True)
+        table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        table.setWordWrap(False)
+        # fixed row heights and widths: nothing is measured over all the hits
+        table.verticalHeader().setSectionResizeMode(QHeaderView.Fixed)
+        table.verticalHeader().setDefaultSectionSize(table.fontMetrics().height() + 6)
+        table.horizontalHeader().setSortIndicator(-1, Qt.AscendingOrder)
+        table.horizontalHeader().setStretchLastSection(True)
+        for column, width in enumerate((100, 100, 60)):
+            table.setColumnWidth(column, width)
+        layout = QVBoxLayout()
+        layout.addWidget(table)
+        dialog.setLayout(layout)
+        dialog.resize(900, 500)
+        dialog.exec_()
+
     def renew_query(self):
         self.statusBar().showMessage(f"To do: renew_query")
         return
@@ -245,10 +359,9 @@ class MainWindow(QMainWindow):
 
     def get_selection_directory(self):
         result = ''
-        a = self.table_widget.selectedIndexes()
+        a = self.table_view.selectionModel().selectedRows()
         if len(a) > 0:
-            n = a[0].row()
-            result = self.table_widget.item(n, 2).text()
+            result = self.query_model.directory(a[0].row())
         return result
 
     @staticmethod
@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+from typing import Dict
+
+import pandas
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def fingerprint(*parts) -> str:
+    """sha256 of the given inputs: DataFrames and Series by content (labels included), anything else by repr"""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (pandas.DataFrame, pandas.Series)):
+            labels = list(part.columns) if isinstance(part, pandas.DataFrame) else [part.name]
+            digest.update(repr((type(part).__name__, labels, part.index.names, len(part))).encode())
+            try:
+                hashes = pandas.util.hash_pandas_object(part, index=True)
+            except TypeError:
+                # cells with lists or other unhashable values
+                hashes = pandas.util.hash_pandas_object(part.astype(str), index=True)
+            digest.update(hashes.values.tobytes())
+        elif isinstance(part, bytes):
+            digest.update(part)
+        else:
+            digest.update(repr(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+
+def replace_path(path: str) -> str:
+    """temporary name next to path, with the same extension (writers like pandas.ExcelWriter check it)"""
+    root, extension = os.path.splitext(path)
+    return f'{root}.part{extension}'
+
+
+class Manifest:
+    """
+    Per query record (<query>/manifest.json) of the input fingerprint of every generated file or directory.
+    Generators skip the outputs whose inputs did not change, so unchanged files keep their timestamps.
+    """
+
+    def __init__(self, querydir: str) -> None:
+        self.querydir = querydir
+        self.path = os.path.join(querydir, MANIFEST_FILE)
+        self.entries: Dict[str, str] = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'rt') as manifest_file:
+                self.entries = json.load(manifest_file)
+        self._loaded = dict(self.entries)
+
+    def _relative(self, path: str) -> str:
+        return os.path.relpath(path, self.querydir)
+
+    def is_current(self, path: str, key: str) -> bool:
+        """path exists and was generated from inputs with this fingerprint"""
+        return self.entries.get(self._relative(path)) == key and os.path.exists(path)
+
+    def was_recorded(self, path: str) -> bool:
+        """path had an entry when the manifest was read, i.e. it was generated by an earlier run"""
+        return self._relative(path) in self._loaded
+
+    def record(self, path: str, key: str) -> None:
+        self.entries[self._relative(path)] = key
+
+    def write_text(self, path: str, text: str, *inputs) -> bool:
+        """
+        writes text in path unless it is current, atomically; inputs default to the text itself.
+        Returns True if the file was written.
+        """
+        key = fingerprint(*inputs) if inputs else fingerprint(text.encode())
+        if self.is_current(path, key):
+            return False
+        partial = replace_path(path)
+        with open(partial, 'wt') as the_file:
+            the_file.write(text)
+        os.replace(partial, path)
+        self.record(path, key)
+        return True
+
+    def save(self) -> None:
+        partial = replace_path(self.path)
+        with open(partial, 'wt') as manifest_file:
+            json.dump(self.entries, manifest_file, indent=1, sort_keys=True)
+        os.replace(partial, self.path)
@@ -0,0 +1,167 @@
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy
+import pandas
+
+from furret.utilities import Obj
+
+CHUNK_PAIRS = 10_000_000  # row pairs expanded at once by the pairwise products
+
+
+class Incidence:
+    """
+    Sparse binary accession x term matrix in CSR form: the terms of row i are columns[indices[indptr[i]:indptr[i + 1]]].
+    rows and columns are the stable id -> label maps (accession and term labels as numpy arrays).
+    """
+
+    def __init__(self, rows: numpy.ndarray, columns: numpy.ndarray,
+                 indptr: numpy.ndarray, indices: numpy.ndarray) -> None:
+        self.rows = rows
+        self.columns = columns
+        self.indptr = indptr
+        self.indices = indices
+        self._row_index: Optional[Dict[str, int]] = None
+        self._column_index: Optional[Dict[str, int]] = None
+
+    @staticmethod
+    def from_pairs(rows: Sequence[str], row_labels: Sequence[str], column_labels: Sequence[str]) -> 'Incidence':
+        """builds the matrix from (row label, column label) pairs, rows gives the row space (and order)"""
+        rows = numpy.asarray(rows, dtype=object)
+        row_index = {label: i for i, label in enumerate(rows)}
+        columns, column_ids = numpy.unique(numpy.asarray(column_labels, dtype=str), return_inverse=True)
+        row_ids = numpy.array([row_index[label] for label in row_labels], dtype=numpy.int64)
+        # duplicated pairs count once
+        codes = numpy.unique(row_ids * max(len(columns), 1) + column_ids)
+        row_ids, column_ids = numpy.divmod(codes, max(len(columns), 1))
+        indptr = numpy.zeros(len(rows) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.bincount(row_ids, minlength=len(rows)), out=indptr[1:])
+        return Incidence(rows, columns.astype(object), indptr, column_ids.astype(numpy.int32))
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return len(self.rows), len(self.columns)
+
+    def row_index(self, label: str) -> int:
+        if self._row_index is None:
+            self._row_index = {r: i for i, r in enumerate(self.rows)}
+        return self._row_index[label]
+
+    def column_index(self, label: str) -> int:
+        if self._column_index is None:
+            self._column_index = {c: i for i, c in enumerate(self.columns)}
+        return self._column_index[label]
+
+    def row_lengths(self) -> numpy.ndarray:
+        return numpy.diff(self.indptr)
+
+    def row_ids(self) -> numpy.ndarray:
+        return numpy.repeat(numpy.arange(len(self.rows)), self.row_lengths())
+
+    def column_counts(self) -> numpy.ndarray:
+        """number of rows annotated with each term"""
+        return numpy.bincount(self.indices, minlength=len(self.columns))
+
+    def transpose(self) -> 'Incidence':
+        order = numpy.argsort(self.indices, kind='stable')
+        indptr = numpy.zeros(len(self.columns) + 1, dtype=numpy.int64)
+        numpy.cumsum(self.column_counts(), out=indptr[1:])
+        return Incidence(self.columns, self.rows, indptr, self.row_ids()[order].astype(numpy.int32))
+
+    def terms(self, label: str) -> numpy.ndarray:
+        i = self.row_index(label)
+        return self.columns[self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def to_frame(self) -> pandas.DataFrame:
+        return pandas.DataFrame({'Uniprot': self.rows[self.row_ids()], 'Term': self.columns[self.indices]})
+
+    def product(self, other: 'Incidence') -> Tuple[numpy.ndarray, numpy.ndarray, numpy.ndarray]:
+        """
+        self.T @ other for two matrices sharing the row space, as (self column, other column, count) triplets:
+        how many rows carry both terms.
+        """
+        assert len(self.rows) == len(other.rows), 'matrices must share the accession space'
+        la, lb = self.row_lengths(), other.row_lengths()
+        per_row = la * lb
+        n_b = max(len(other.columns), 1)
+        codes, counts = [], []
+        start = 0
+        cumulative = numpy.cumsum(per_row)
+        while start < len(self.rows):
+            # rows [start, stop) expand to at most CHUNK_PAIRS pairs (or a single larger row)
+            base = cumulative[start - 1] if start else 0
+            stop = max(start + 1, int(numpy.searchsorted(cumulative, base + CHUNK_PAIRS, side='right')))
+            rows = numpy.arange(start, stop)
+            pairs = per_row[start:stop]
+            row_of_pair = numpy.repeat(rows, pairs)
+            within = numpy.arange(pairs.sum()) - numpy.repeat(numpy.cumsum(pairs) - pairs, pairs)
+            ia = within // numpy.maximum(lb[row_of_pair], 1)
+            ib = within % numpy.maximum(lb[row_of_pair], 1)
+            a = self.indices[self.indptr[row_of_pair] + ia].astype(numpy.int64)
+            b = other.indices[other.indptr[row_of_pair] + ib].astype(numpy.int64)
+            chunk_codes, chunk_counts = numpy.unique(a * n_b + b, return_counts=True)
+            codes.append(chunk_codes)
+            counts.append(chunk_counts)
+            start = stop
+        if not codes:
+            empty = numpy.zeros(0, dtype=numpy.int64)
+            return empty, empty, empty
+        all_codes, inverse = numpy.unique(numpy.concatenate(codes), return_inverse=True)
+        total = numpy.bincount(inverse, weights=numpy.concatenate(counts)).astype(numpy.int64)
+        a, b = numpy.divmod(all_codes, n_b)
+        return a, b, total
+
+    def cooccurrence(self) -> pandas.DataFrame:
+        """number of accessions annotated with both terms, for every pair of distinct co-occurring terms"""
+        a, b, counts = self.product(self)
+        keep = a < b
+        return pandas.DataFrame({'Term A': self.columns[a[keep]], 'Term B': self.columns[b[keep]],
+                                 'Count': counts[keep]})
+
+    def profiles(self, groups: 'Incidence') -> pandas.DataFrame:
+        """per group (e.g. family) term counts: how many members of each group carry each term"""
+        g, t, counts = groups.product(self)
+        return pandas.DataFrame({'Group': groups.columns[g], 'Term': self.columns[t], 'Count': counts})
+
+    def intersections(self, i: int, transposed: Optional['Incidence'] = None) -> numpy.ndarray:
+        """
+        number of terms row i shares with every row (row i of self @ self.T), from the rows of its terms in
+        transposed (self.transpose(), pass it when calling this repeatedly)
+        """
+        if transposed is None:
+            transposed = self.transpose()
+        terms = self.indices[self.indptr[i]:self.indptr[i + 1]]
+        starts = transposed.indptr[terms]
+        lengths = transposed.indptr[terms + 1] - starts
+        # positions of the rows of every term in transposed.indices, without a python loop over the terms
+        positions = numpy.arange(lengths.sum()) + numpy.repeat(starts - (numpy.cumsum(lengths) - lengths), lengths)
+        return numpy.bincount(transposed.indices[positions], minlength=len(self.rows))
+
+    def similarity(self, label: str) -> numpy.ndarray:
+        """Jaccard similarity of the terms of accession label with those of every accession"""
+        i = self.row_index(label)
+        intersection = self.intersections(i)
+        union = self.row_lengths()[i] + self.row_lengths() - intersection
+        return numpy.where(union > 0, intersection / numpy.maximum(union, 1), 0.0)
+
+    def most_similar(self, label: str, top: int = 10) -> pandas.Series:
+        similarity = self.similarity(label)
+        order = numpy.argsort(-similarity, kind='stable')[:top + 1]
+        order = order[self.rows[order] != label][:top]
+        return pandas.Series(similarity[order], index=self.rows[order])
+
+
+def build_matrices(proteins, tables) -> Obj:
+    """accession x term incidence matrices for GO (per aspect), keywords and database families"""
+    accessions = sorted(proteins)
+    matrices = Obj()
+    matrices.accessions = numpy.asarray(accessions, dtype=object)
+    matrices.go_mf = Incidence.from_pairs(accessions, tables.go.molecular_function['Uniprot'],
+                                          tables.go.molecular_function['ID'])
+    matrices.go_bp = Incidence.from_pairs(accessions, tables.go.biological_process['Uniprot'],
+                                          tables.go.biological_process['ID'])
+    matrices.go_cc = Incidence.from_pairs(accessions, tables.go.cellular_component['Uniprot'],
+                                          tables.go.cellular_component['ID'])
+    matrices.keywords = Incidence.from_pairs(accessions, tables.keywords['Uniprot'], tables.keywords['ID'])
+    matrices.families = Incidence.from_pairs(accessions, tables.db['Uniprot'],
+                                             tables.db['Database'] + ':' + tables.db['ID'])
+    return matrices
@@ -3,6 +3,11 @@ import subprocess
 from dataclasses import dataclass
 
 
+# the outputs of a family are made again when these change (see Query.gen_meme)
+MEME_OPTIONS = '-protein -oc . -nostatus -time 18000 -mod zoops -nmotifs 100 -minw 6 -maxw 50 -objfun classic ' \
+               '-markov_order 0'
+
+
 @dataclass
 class MemeJob:
     fasta_file: str
@@ -11,11 +16,12 @@ class MemeJob:
 
 
 def process_meme(job: MemeJob) -> bool:
+    """runs MEME in the destination directory, returns True if it exited normally"""
     cwd = os.getcwd()
     os.chdir(job.destination_directory)
-    cmd = f'{job.meme_executable} "{job.fasta_file}" -protein -oc . -nostatus -time 18000 -mod zoops -nmotifs 100 ' \
-          f'-minw 6 -maxw 50 -objfun classic -markov_order 0 '
+    cmd = f'{job.meme_executable} "{job.fasta_file}" {MEME_OPTIONS} '
     print(f'Processing Meme for {os.path.basename(job.fasta_file)}')
-    subprocess.call(cmd, shell=True)
-    os.chdir(cwd)
-    return True
+    try:
+        return subprocess.call(cmd, shell=True) == 0
+    finally:
+        os.chdir(cwd)
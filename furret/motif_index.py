@@ -0,0 +1,145 @@
+import hashlib
+import os
+import sqlite3
+from multiprocessing import Pool
+from typing import List, Optional, Tuple
+
+import pandas
+
+from furret.motifs import parse_meme
+
+INDEX_FILE = 'motifs.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, mtime REAL, sha256 TEXT);
+CREATE TABLE IF NOT EXISTS motifs (path TEXT, database TEXT, family TEXT, motif TEXT, consensus TEXT,
+                                   width INTEGER, sites INTEGER, evalue REAL);
+CREATE TABLE IF NOT EXISTS sites (path TEXT, database TEXT, family TEXT, motif TEXT, uniprot TEXT,
+                                  start INTEGER, pvalue REAL, site TEXT);
+CREATE INDEX IF NOT EXISTS motifs_path ON motifs (path);
+CREATE INDEX IF NOT EXISTS motifs_family ON motifs (database, family);
+CREATE INDEX IF NOT EXISTS motifs_consensus ON motifs (consensus);
+CREATE INDEX IF NOT EXISTS sites_path ON sites (path);
+CREATE INDEX IF NOT EXISTS sites_uniprot ON sites (uniprot);
+CREATE INDEX IF NOT EXISTS sites_motif ON sites (database, family, motif);
+'''
+
+
+def file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _ingest(args: Tuple[str, str, str, str]):
+    # runs in the pool: hashes and parses one meme.txt
+    path, full_path, database, family = args
+    motifs = parse_meme(full_path, database, family)
+    motif_rows = [(path, database, family, m.id, m.consensus, m.width, m.sites, m.evalue) for m in motifs]
+    site_rows = [(path, database, family, m.id, uniprot, start, pvalue, site)
+                 for m in motifs for uniprot, start, pvalue, site in m.sites_list]
+    return path, os.path.getmtime(full_path), file_hash(full_path), motif_rows, site_rows
+
+
+class MotifIndex:
+    """
+    Per query index of the MEME results in Motives/<database>/<family>/meme.txt, kept in Motives/motifs.sqlite.
+    update() re-reads only the files whose mtime and content hash changed.
+    """
+
+    def __init__(self, motivedir: str) -> None:
+        self.motivedir = motivedir
+        os.makedirs(motivedir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(motivedir, INDEX_FILE))
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def _meme_files(self) -> List[Tuple[str, str, str, str]]:
+        found = []
+        for database in sorted(os.listdir(self.motivedir)):
+            database_dir = os.path.join(self.motivedir, database)
+            if not os.path.isdir(database_dir):
+                continue
+            for family in sorted(os.listdir(database_dir)):
+                full_path = os.path.join(database_dir, family, 'meme.txt')
+                if os.path.isfile(full_path):
+                    found.append((os.path.relpath(full_path, self.motivedir), full_path, database, family))
+        return found
+
+    def _store(self, path: str, mtime: float, sha: str, motif_rows, site_rows) -> None:
+        with self.connection:
+            self.connection.execute('DELETE FROM motifs WHERE path = ?', (path,))
+            self.connection.execute('DELETE FROM sites WHERE path = ?', (path,))
+            self.connection.executemany('INSERT INTO motifs VALUES (?, ?, ?, ?, ?, ?, ?, ?)', motif_rows)
+            self.connection.executemany('INSERT INTO sites VALUES (?, ?, ?, ?, ?, ?, ?, ?)', site_rows)
+            self.connection.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?)', (path, mtime, sha))
+
+    def update(self, processes: Optional[int] = None) -> int:
+        """brings the index up to date, returns the number of (re)ingested files"""
+        known = {path: (mtime, sha) for path, mtime, sha in self.connection.execute('SELECT * FROM files')}
+        files = self._meme_files()
+        changed = []
+        for path, full_path, database, family in files:
+            if path in known:
+                mtime = os.path.getmtime(full_path)
+                if mtime == known[path][0]:
+                    continue
+                if file_hash(full_path) == known[path][1]:
+                    with self.connection:
+                        self.connection.execute('UPDATE files SET mtime = ? WHERE path = ?', (mtime, path))
+                    continue
+            changed.append((path, full_path, database, family))
+        present = {f[0] for f in files}
+        with self.connection:
+            for path in set(known) - present:
+                for table in ('files', 'motifs', 'sites'):
+                    self.connection.execute(f'DELETE FROM {table} WHERE path = ?', (path,))
+        if len(changed) > 1:
+            with Pool(processes) as p:
+                for result in p.imap_unordered(_ingest, changed, chunksize=4):
+                    self._store(*result)
+        elif changed:
+            self._store(*_ingest(changed[0]))
+        return len(changed)
+
+    def update_file(self, full_path: str) -> None:
+        """(re)ingests a single meme.txt, e.g. as soon as its MEME run finishes"""
+        family_dir = os.path.dirname(full_path)
+        database = os.path.basename(os.path.dirname(family_dir))
+        family = os.path.basename(family_dir)
+        if os.path.isfile(full_path):
+            self._store(*_ingest((os.path.relpath(full_path, self.motivedir), full_path, database, family)))
+
+    def motifs(self, database: Optional[str] = None, family: Optional[str] = None,
+               max_evalue: Optional[float] = None, consensus: Optional[str] = None) -> pandas.DataFrame:
+        conditions, values = [], []
+        for column, value in (('database', database), ('family', family)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                values.append(value)
+        if max_evalue is not None:
+            conditions.append('evalue <= ?')
+            values.append(max_evalue)
+        if consensus is not None:
+            conditions.append('consensus LIKE ?')
+            values.append(f'%{consensus}%')
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return pandas.read_sql_query('SELECT database AS Database, family AS Family, motif AS Motif, '
+                                     'consensus AS Consensus, width AS Width, sites AS Sites, evalue AS "E-value" '
+                                     f'FROM motifs{where} ORDER BY evalue', self.connection, params=values)
+
+    def sites(self, uniprot: Optional[str] = None, database: Optional[str] = None,
+              family: Optional[str] = None, motif: Optional[str] = None) -> pandas.DataFrame:
+        conditions, values = [], []
+        for column, value in (('uniprot', uniprot), ('database', database), ('family', family), ('motif', motif)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                values.append(value)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+        return pandas.read_sql_query('SELECT uniprot AS Uniprot, database AS Database, family AS Family, '
+                                     'motif AS Motif, start AS Start, pvalue AS "P-value", site AS Site '
+                                     f'FROM sites{where} ORDER BY uniprot, start', self.connection, params=values)
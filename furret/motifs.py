@@ -0,0 +1,186 @@
+import os
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from typing import List, Optional, Sequence, Tuple
+
+import numpy
+import pandas
+
+from furret.encoding import AMINO_ACIDS, UNKNOWN, sequence_ids
+from furret.seqbuffer import SequenceBuffer
+
+PSEUDOCOUNT = 0.01
+SCORE_SCALE = 100  # scores are rounded to 1/SCORE_SCALE bits for the p-value computation
+
+
+@dataclass
+class Motif:
+    id: str
+    consensus: str
+    database: str
+    family: str
+    width: int
+    sites: int
+    evalue: float
+    probabilities: numpy.ndarray  # width x 20, AMINO_ACIDS order
+    background: numpy.ndarray  # 20
+    # (sequence name, 1-based start, p-value, site) of the sites MEME used to build the motif
+    sites_list: List[Tuple[str, int, float, str]] = field(default_factory=list)
+
+
+def _background(lines: List[str], start: int) -> numpy.ndarray:
+    frequencies = {}
+    for line in lines[start + 1:]:
+        tokens = line.split()
+        if not tokens:
+            break
+        for letter, value in zip(tokens[::2], tokens[1::2]):
+            frequencies[letter] = float(value)
+    background = numpy.array([frequencies.get(a, 0.05) for a in AMINO_ACIDS])
+    return background / background.sum()
+
+
+def _sites(lines: List[str], start: int) -> List[Tuple[str, int, float, str]]:
+    # skips the column headers, reads up to the closing dashes
+    sites = []
+    dashes = 0
+    for line in lines[start + 1:]:
+        if line.startswith('---'):
+            dashes += 1
+            if dashes == 3:
+                break
+            continue
+        if dashes < 2:
+            continue
+        tokens = line.split()
+        if len(tokens) < 4:
+            continue
+        # name, start, p-value, [left flank,] site, [right flank]: the left flank is there unless the site starts at 1
+        start_position = int(tokens[1])
+        site = tokens[3] if len(tokens) == 4 or (len(tokens) == 5 and start_position == 1) else tokens[4]
+        sites.append((tokens[0], start_position, float(tokens[2]), site))
+    return sites
+
+
+def parse_meme(file_name: str, database: str = '', family: str = '') -> List[Motif]:
+    """reads the motifs (letter-probability matrices and sites) of a MEME text output"""
+    with open(file_name, 'rt') as meme:
+        lines = meme.read().splitlines()
+    background = numpy.full(len(AMINO_ACIDS), 1.0 / len(AMINO_ACIDS))
+    motifs = []
+    motif_id, consensus = '', ''
+    sites = {}
+    for i, line in enumerate(lines):
+        if 'sites sorted by position p-value' in line:
+            tokens = line.split()
+            sites[tokens[2] if tokens[2].startswith('MEME-') else tokens[1]] = _sites(lines, i)
+        elif line.startswith('Background letter frequencies'):
+            background = _background(lines, i)
+        elif line.startswith('MOTIF '):
+            # MEME 5 writes 'MOTIF <consensus> MEME-<n>', older versions 'MOTIF <n> MEME'
+            tokens = line.split()
+            if len(tokens) > 2 and tokens[2].startswith('MEME-'):
+                motif_id, consensus = tokens[2], tokens[1]
+            else:
+                motif_id, consensus = tokens[1], tokens[1]
+        elif line.startswith('letter-probability matrix:'):
+            fields = dict(zip(line.split()[2::2], line.split()[3::2]))
+            width = int(fields['w='])
+            rows = [[float(v) for v in lines[i + 1 + j].split()] for j in range(width)]
+            motifs.append(Motif(motif_id, consensus, database, family, width, int(float(fields.get('nsites=', 0))),
+                                float(fields.get('E=', 'nan')), numpy.array(rows), background))
+    for motif in motifs:
+        motif.sites_list = sites.get(motif.id, [])
+    return motifs
+
+
+def motif_library(motive_directories: Sequence[str]) -> List[Motif]:
+    """all the motifs found in Motives/<database>/<family>/meme.txt of the given Motives directories"""
+    motifs = []
+    for motivedir in motive_directories:
+        if not os.path.isdir(motivedir):
+            continue
+        for database in sorted(os.listdir(motivedir)):
+            database_dir = os.path.join(motivedir, database)
+            if not os.path.isdir(database_dir):
+                continue
+            for family in sorted(os.listdir(database_dir)):
+                meme_file = os.path.join(database_dir, family, 'meme.txt')
+                if os.path.isfile(meme_file):
+                    motifs += parse_meme(meme_file, database, family)
+    return motifs
+
+
+def pssm(motif: Motif) -> numpy.ndarray:
+    """width x 21 log-odds (bits) matrix, unknown residues score 0"""
+    probabilities = (motif.probabilities + PSEUDOCOUNT * motif.background)
+    probabilities /= probabilities.sum(axis=1, keepdims=True)
+    matrix = numpy.zeros((motif.width, UNKNOWN + 1))
+    matrix[:, :UNKNOWN] = numpy.log2(probabilities / motif.background)
+    return matrix
+
+
+def score_pvalues(matrix: numpy.ndarray, background: numpy.ndarray) -> Tuple[int, numpy.ndarray]:
+    """
+    Exact distribution of the (rounded) score of random background sequences, by dynamic programming.
+    Returns the minimum integer score and P(score >= minimum + i) for every i.
+    """
+    scaled = numpy.round(matrix[:, :UNKNOWN] * SCORE_SCALE).astype(numpy.int64)
+    low = scaled.min(axis=1)
+    shifted = scaled - low[:, None]
+    distribution = numpy.ones(1)
+    for column in shifted:
+        new = numpy.zeros(len(distribution) + column.max())
+        for value, probability in zip(column, background):
+            new[value:value + len(distribution)] += distribution * probability
+        distribution = new
+    survival = numpy.cumsum(distribution[::-1])[::-1]
+    return int(low.sum()), numpy.minimum(survival, 1.0)
+
+
+def scan_motif(motif: Motif, codes: numpy.ndarray, offsets: numpy.ndarray, threshold: float,
+               ids: Optional[numpy.ndarray] = None) -> List[Tuple[int, int, float, float]]:
+    """(sequence index, 0-based position, score, p-value) of the windows with p-value <= threshold"""
+    matrix = pssm(motif)
+    n_windows = len(codes) - motif.width + 1
+    if n_windows <= 0:
+        return []
+    scores = numpy.zeros(n_windows)
+    for j in range(motif.width):
+        scores += matrix[j][codes[j:j + n_windows]]
+    if ids is None:
+        ids = sequence_ids(offsets)
+    valid = ids[:n_windows] == ids[motif.width - 1:]
+    low, survival = score_pvalues(matrix, motif.background)
+    index = numpy.clip(numpy.round(scores * SCORE_SCALE).astype(numpy.int64) - low, 0, len(survival) - 1)
+    pvalues = survival[index]
+    hits = numpy.flatnonzero(valid & (pvalues <= threshold))
+    return [(int(ids[h]), int(h - offsets[ids[h]]), float(scores[h]), float(pvalues[h])) for h in hits]
+
+
+_buffer = None  # SequenceBuffer attached by each worker
+_threshold = 1e-4
+
+
+def _init_worker(directory: str, threshold: float) -> None:
+    global _buffer, _threshold
+    _buffer, _threshold = SequenceBuffer(directory), threshold
+
+
+def _scan_worker(motif: Motif):
+    return motif, scan_motif(motif, _buffer.codes, _buffer.offsets, _threshold, _buffer.ids)
+
+
+def scan(motifs: List[Motif], buffer: SequenceBuffer, threshold: float = 1e-4) -> pandas.DataFrame:
+    """
+    scans all the sequences of the buffer with all motifs in a process pool, returns the hits table.
+    Workers attach to the buffer by path: the sequences are never pickled.
+    """
+    hits = []
+    with Pool(initializer=_init_worker, initargs=(buffer.directory, threshold)) as p:
+        for motif, motif_hits in p.imap_unordered(_scan_worker, motifs, chunksize=8):
+            for sequence, position, score, pvalue in motif_hits:
+                hits.append((buffer.labels[sequence], motif.id, motif.consensus, motif.database, motif.family,
+                             position + 1, score, pvalue))
+    cols = ('Uniprot', 'Motif', 'Consensus', 'Database', 'Family', 'Position', 'Score', 'P-value')
+    return pandas.DataFrame(hits, columns=cols)
@@ -0,0 +1,210 @@
+import asyncio
+import functools
+import os
+import random
+import threading
+import time
+from dataclasses import dataclass, asdict
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import furret.trace as trace
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+@dataclass
+class HostPolicy:
+    rate: float = 10.0  # requests per second
+    burst: int = 10
+    concurrency: int = 4
+
+
+@dataclass
+class HostMetrics:
+    requests: int = 0
+    bytes: int = 0
+    retries: int = 0
+    failures: int = 0
+    seconds: float = 0.0
+
+
+# hosts not listed here get HostPolicy()
+POLICIES: Dict[str, HostPolicy] = {
+    'eutils.ncbi.nlm.nih.gov': HostPolicy(rate=3.0, burst=1, concurrency=1),
+    'www.uniprot.org': HostPolicy(rate=5.0, burst=5, concurrency=2),
+    'rest.uniprot.org': HostPolicy(rate=5.0, burst=5, concurrency=2),
+    'swissmodel.expasy.org': HostPolicy(rate=5.0, burst=5, concurrency=4),
+    'files.rcsb.org': HostPolicy(rate=20.0, burst=20, concurrency=8),
+    'data.rcsb.org': HostPolicy(rate=5.0, burst=5, concurrency=2),
+}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Host:
+    def __init__(self, policy: HostPolicy) -> None:
+        self.bucket = TokenBucket(policy.rate, policy.burst)
+        self.slots = threading.BoundedSemaphore(policy.concurrency)
+        self.metrics = HostMetrics()
+
+
+class Client:
+    """
+    Shared HTTP client: pooled connections, per-host concurrency and token-bucket rate limits,
+    exponential backoff with full jitter and a total deadline per request.
+    Blocking methods are thread safe, the *_async ones run them in an executor for asyncio code so both share
+    the session, rate limits and concurrency slots. The per-host metrics of each tracing session are saved in its trace.
+    """
+
+    def __init__(self, retries: int = 6, backoff: float = 1.0, max_backoff: float = 60.0,
+                 timeout: float = 60.0, deadline: float = 600.0, pool_size: int = 16) -> None:
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.hosts: Dict[str, _Host] = {}
+        self.lock = threading.Lock()
+
+    def _host(self, url: str) -> _Host:
+        name = urlsplit(url).netloc
+        with self.lock:
+            if name not in self.hosts:
+                self.hosts[name] = _Host(POLICIES.get(name, HostPolicy()))
+            return self.hosts[name]
+
+    def _sleep_before_retry(self, attempt: int, response: Optional[requests.Response], end: float) -> None:
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        if response is not None and response.headers.get('Retry-After', '').isdigit():
+            delay = max(delay, float(response.headers['Retry-After']))
+        if time.monotonic() + delay >= end:
+            raise ConnectionAbortedError('Deadline exceeded')
+        time.sleep(delay)
+
+    def request(self, method: str, url: str, retries: Optional[int] = None, deadline: Optional[float] = None,
+                **kwargs) -> requests.Response:
+        """
+        Returns the response, also for non retryable HTTP errors (callers check response.ok).
+        Raises ConnectionAbortedError when retries or deadline are exhausted.
+        """
+        retries = self.retries if retries is None else retries
+        end = time.monotonic() + (self.deadline if deadline is None else deadline)
+        timeout = kwargs.pop('timeout', self.timeout)
+        host = self._host(url)
+        attempt = 0
+        while True:
+            response = None
+            error = None
+            host.bucket.acquire()
+            with host.slots:
+                start = time.monotonic()
+                try:
+                    response = self.session.request(method, url, timeout=min(timeout, max(1.0, end - start)),
+                                                    **kwargs)
+                    size = len(response.content)
+                except requests.RequestException as e:
+                    error = e
+                    size = 0
+                with self.lock:
+                    host.metrics.requests += 1
+                    host.metrics.bytes += size
+                    host.metrics.seconds += time.monotonic() - start
+                trace.add_bytes(size)
+            if error is None and response.status_code not in RETRY_STATUSES:
+                return response
+            attempt += 1
+            if attempt > retries:
+                with self.lock:
+                    host.metrics.failures += 1
+                raise ConnectionAbortedError(f'''No answer from {url} after {attempt} attempts: ''' +
+                                             (str(error) if error else f'HTTP {response.status_code}'))
+            with self.lock:
+                host.metrics.retries += 1
+            try:
+                self._sleep_before_retry(attempt, response, end)
+            except ConnectionAbortedError:
+                with self.lock:
+                    host.metrics.failures += 1
+                raise
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def download(self, url: str, file_name: str, **kwargs) -> bool:
+        """saves the body of a successful answer in file_name (atomically), returns False on HTTP errors"""
+        response = self.get(url, **kwargs)
+        if not response.ok:
+            return False
+        partial = file_name + '.part'
+        with open(partial, 'wb') as the_file:
+            the_file.write(response.content)
+        os.replace(partial, file_name)
+        return True
+
+    async def request_async(self, method: str, url: str, **kwargs) -> requests.Response:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, functools.partial(self.request, method, url, **kwargs))
+
+    async def get_async(self, url: str, **kwargs) -> requests.Response:
+        return await self.request_async('GET', url, **kwargs)
+
+    async def post_async(self, url: str, **kwargs) -> requests.Response:
+        return await self.request_async('POST', url, **kwargs)
+
+    def metrics(self) -> Dict[str, Dict[str, float]]:
+        with self.lock:
+            return {name: asdict(host.metrics) for name, host in self.hosts.items()}
+
+
+client = Client()
+trace.register_counters('network', client.metrics)
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return client.get(url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return client.post(url, **kwargs)
+
+
+def download(url: str, file_name: str, **kwargs) -> bool:
+    return client.download(url, file_name, **kwargs)
+
+
+async def get_async(url: str, **kwargs) -> requests.Response:
+    return await client.get_async(url, **kwargs)
+
+
+async def post_async(url: str, **kwargs) -> requests.Response:
+    return await client.post_async(url, **kwargs)
@@ -0,0 +1,162 @@
+import hashlib
+import os
+from typing import Dict, List, Optional
+
+import numpy
+import pandas
+
+import furret.config as config
+from furret.matrices import Incidence
+
+NAMESPACES = {'molecular_function': 'F', 'biological_process': 'P', 'cellular_component': 'C'}
+
+
+def parse_obo(file_name: str) -> List[Dict[str, List[str]]]:
+    """[Term] stanzas of an OBO file as {tag: [values]}"""
+    terms = []
+    stanza: Optional[Dict[str, List[str]]] = None
+    with open(file_name, 'rt', encoding='utf-8') as obo:
+        for line in obo:
+            line = line.strip()
+            if line.startswith('['):
+                stanza = {} if line == '[Term]' else None
+                if stanza is not None:
+                    terms.append(stanza)
+            elif stanza is not None and ': ' in line:
+                tag, value = line.split(': ', 1)
+                # drop trailing comments ("is_a: GO:0008150 ! biological_process")
+                stanza.setdefault(tag, []).append(value.split(' ! ')[0].strip())
+    return terms
+
+
+class Ontology:
+    """
+    GO DAG (is_a and part_of) with every term's ancestor closure, self included, stored in CSR form:
+    the ancestors of term i are indices[indptr[i]:indptr[i + 1]].
+    """
+
+    def __init__(self, ids: numpy.ndarray, names: numpy.ndarray, namespaces: numpy.ndarray, depths: numpy.ndarray,
+                 indptr: numpy.ndarray, indices: numpy.ndarray, aliases: Dict[str, int]) -> None:
+        self.ids = ids
+        self.names = names
+        self.namespaces = namespaces
+        self.depths = depths
+        self.indptr = indptr
+        self.indices = indices
+        self.index = {term: i for i, term in enumerate(ids)}
+        self.index.update(aliases)
+
+    @staticmethod
+    def from_obo(file_name: str) -> 'Ontology':
+        stanzas = [s for s in parse_obo(file_name) if s.get('is_obsolete', ['false'])[0] != 'true']
+        ids = [s['id'][0] for s in stanzas]
+        index = {term: i for i, term in enumerate(ids)}
+        aliases = {alt: index[s['id'][0]] for s in stanzas for alt in s.get('alt_id', [])}
+        parents: List[List[int]] = []
+        for s in stanzas:
+            the_parents = list(s.get('is_a', []))
+            the_parents += [r.split()[1] for r in s.get('relationship', []) if r.startswith('part_of ')]
+            parents.append([index[p] for p in the_parents if p in index])
+        # ancestors in topological order (parents before children)
+        children: List[List[int]] = [[] for _ in ids]
+        pending = numpy.array([len(p) for p in parents])
+        for child, the_parents in enumerate(parents):
+            for parent in the_parents:
+                children[parent].append(child)
+        queue = [i for i in range(len(ids)) if pending[i] == 0]
+        ancestors: List[Optional[set]] = [None] * len(ids)
+        depths = numpy.zeros(len(ids), dtype=numpy.int32)
+        while queue:
+            term = queue.pop()
+            closure = {term}
+            for parent in parents[term]:
+                closure |= ancestors[parent]
+            ancestors[term] = closure
+            depths[term] = min((depths[p] + 1 for p in parents[term]), default=0)
+            for child in children[term]:
+                pending[child] -= 1
+                if pending[child] == 0:
+                    queue.append(child)
+        if any(a is None for a in ancestors):
+            raise ValueError(f'''Cycle in the ontology {file_name}''')
+        indptr = numpy.zeros(len(ids) + 1, dtype=numpy.int64)
+        numpy.cumsum([len(a) for a in ancestors], out=indptr[1:])
+        indices = numpy.fromiter((t for a in ancestors for t in sorted(a)), dtype=numpy.int32, count=int(indptr[-1]))
+        names = numpy.array([s.get('name', [''])[0] for s in stanzas], dtype=object)
+        namespaces = numpy.array([NAMESPACES.get(s.get('namespace', [''])[0], '') for s in stanzas], dtype=object)
+        return Ontology(numpy.array(ids, dtype=object), names, namespaces, depths, indptr, indices, aliases)
+
+    def save(self, file_name: str, key: str) -> None:
+        primary = set(self.ids)
+        aliases = sorted(a for a in self.index if a not in primary)
+        numpy.savez_compressed(file_name, key=numpy.array(key), ids=self.ids.astype(str), names=self.names.astype(str),
+                               namespaces=self.namespaces.astype(str), depths=self.depths, indptr=self.indptr,
+                               indices=self.indices, aliases=numpy.array(aliases, dtype=str),
+                               alias_targets=numpy.array([self.index[a] for a in aliases], dtype=numpy.int64))
+
+    @staticmethod
+    def load(file_name: str, key: str) -> Optional['Ontology']:
+        if not os.path.isfile(file_name):
+            return None
+        with numpy.load(file_name) as data:
+            if str(data['key']) != key:
+                return None
+            aliases = dict(zip(data['aliases'].tolist(), data['alias_targets'].tolist()))
+            return Ontology(data['ids'].astype(object), data['names'].astype(object),
+                            data['namespaces'].astype(object), data['depths'], data['indptr'], data['indices'],
+                            aliases)
+
+    def ancestors(self, term: str) -> numpy.ndarray:
+        i = self.index[term]
+        return self.ids[self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def propagate(self, incidence: Incidence) -> Incidence:
+        """the incidence matrix with every annotation extended to all the ancestors of its term"""
+        known = numpy.array([self.index.get(term, -1) for term in incidence.columns], dtype=numpy.int64)
+        rows = incidence.row_ids()
+        terms = known[incidence.indices] if len(incidence.indices) else numpy.zeros(0, dtype=numpy.int64)
+        rows, terms = rows[terms >= 0], terms[terms >= 0]
+        lengths = self.indptr[terms + 1] - self.indptr[terms]
+        starts = numpy.repeat(self.indptr[terms] - numpy.cumsum(lengths) + lengths, lengths)
+        ancestors = self.indices[starts + numpy.arange(lengths.sum())]
+        return Incidence.from_pairs(incidence.rows, incidence.rows[numpy.repeat(rows, lengths)], self.ids[ancestors])
+
+    def counts(self, propagated: Incidence, max_depth: Optional[int] = None) -> pandas.DataFrame:
+        """proteins annotated (directly or through descendants) with each term, optionally down to max_depth"""
+        terms = numpy.array([self.index[t] for t in propagated.columns], dtype=numpy.int64)
+        df = pandas.DataFrame({'ID': propagated.columns, 'GO': self.names[terms], 'Depth': self.depths[terms],
+                               'Count': propagated.column_counts()})
+        if max_depth is not None:
+            df = df.loc[df['Depth'] <= max_depth]
+        return df.sort_values('Count', ascending=False)
+
+
+def file_key(file_name: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_ontology: Optional[Ontology] = None
+
+
+def load_ontology(file_name: Optional[str] = None) -> Optional[Ontology]:
+    """
+    The GO ontology of the configured OBO file, None if there is none.
+    The closure is computed once and cached in <working directory>/go_closure.npz until the file changes.
+    """
+    global _ontology
+    file_name = file_name if file_name else config.go_obo_file
+    if not file_name or not os.path.isfile(file_name):
+        return None
+    key = file_key(file_name)
+    cache = os.path.join(config.working_directory, 'go_closure.npz')
+    if _ontology is None or getattr(_ontology, 'key', '') != key:
+        _ontology = Ontology.load(cache, key)
+        if _ontology is None:
+            _ontology = Ontology.from_obo(file_name)
+            _ontology.save(cache, key)
+        _ontology.key = key
+    return _ontology
@@ -0,0 +1,90 @@
+from typing import Sequence
+
+import numpy
+import pandas
+
+from furret.encoding import AMINO_ACIDS, UNKNOWN, encode, sequence_ids
+
+# same values as Biopython ProtParam (IUPAC average masses of the free amino acids)
+WEIGHTS = {'A': 89.0932, 'C': 121.1582, 'D': 133.1027, 'E': 147.1293, 'F': 165.1891, 'G': 75.0666, 'H': 155.1546,
+           'I': 131.1729, 'K': 146.1876, 'L': 131.1729, 'M': 149.2113, 'N': 132.1179, 'P': 115.1305, 'Q': 146.1445,
+           'R': 174.201, 'S': 105.0926, 'T': 119.1192, 'V': 117.1463, 'W': 204.2252, 'Y': 181.1885}
+WATER = 18.01528
+UNKNOWN_WEIGHT = 110.0 + WATER  # X, B, Z, U, O... weighted as an average residue
+
+KYTE_DOOLITTLE = {'A': 1.8, 'R': -4.5, 'N': -3.5, 'D': -3.5, 'C': 2.5, 'Q': -3.5, 'E': -3.5, 'G': -0.4, 'H': -3.2,
+                  'I': 4.5, 'L': 3.8, 'K': -3.9, 'M': 1.9, 'F': 2.8, 'P': -1.6, 'S': -0.8, 'T': -0.7, 'W': -0.9,
+                  'Y': -1.3, 'V': 4.2}
+
+# pK values of Biopython IsoelectricPoint (Bjellqvist), termini depend on the terminal residue
+POSITIVE_PK = {'K': 10.0, 'R': 12.0, 'H': 5.98}
+NEGATIVE_PK = {'D': 4.05, 'E': 4.45, 'C': 9.0, 'Y': 10.0}
+N_TERMINAL_PK = {'A': 7.59, 'M': 7.0, 'S': 6.93, 'P': 8.36, 'T': 6.82, 'V': 7.44, 'E': 7.7}
+C_TERMINAL_PK = {'D': 4.55, 'E': 4.75}
+N_TERMINUS_PK = 7.5
+C_TERMINUS_PK = 3.55
+
+PI_ITERATIONS = 30  # bisection steps on [0, 14]: precision ~1e-8 pH units
+
+COLUMNS = ('Molecular Weight', 'pI', 'GRAVY', 'Charge pH 7', 'Cysteines') + tuple(f'%{a}' for a in AMINO_ACIDS)
+
+
+def _by_code(values, default: float = 0.0) -> numpy.ndarray:
+    """per residue code lookup array (UNKNOWN included)"""
+    table = numpy.full(UNKNOWN + 1, default)
+    for letter, value in values.items():
+        table[AMINO_ACIDS.index(letter)] = value
+    return table
+
+
+_weights = _by_code(WEIGHTS, UNKNOWN_WEIGHT) - WATER
+_hydropathy = _by_code(KYTE_DOOLITTLE)
+_positive = [(AMINO_ACIDS.index(a), pk) for a, pk in POSITIVE_PK.items()]
+_negative = [(AMINO_ACIDS.index(a), pk) for a, pk in NEGATIVE_PK.items()]
+_n_terminal = _by_code(N_TERMINAL_PK, N_TERMINUS_PK)
+_c_terminal = _by_code(C_TERMINAL_PK, C_TERMINUS_PK)
+
+
+def _charge(ph, counts: numpy.ndarray, n_pk: numpy.ndarray, c_pk: numpy.ndarray) -> numpy.ndarray:
+    """net charge of every sequence at pH (scalar or one value per sequence)"""
+    charge = 1.0 / (10.0 ** (ph - n_pk) + 1.0) - 1.0 / (10.0 ** (c_pk - ph) + 1.0)
+    for code, pk in _positive:
+        charge = charge + counts[:, code] / (10.0 ** (ph - pk) + 1.0)
+    for code, pk in _negative:
+        charge = charge - counts[:, code] / (10.0 ** (pk - ph) + 1.0)
+    return charge
+
+
+def profile(sequences: Sequence[str]) -> pandas.DataFrame:
+    """
+    molecular weight, pI, GRAVY, charge at pH 7, cysteines and composition (% of the residues) of all the
+    sequences at once, from one residue code array. Empty sequences get NaN.
+    """
+    codes, offsets = encode(sequences)
+    n = len(sequences)
+    lengths = numpy.diff(offsets)
+    counts = numpy.bincount(sequence_ids(offsets) * (UNKNOWN + 1) + codes,
+                            minlength=n * (UNKNOWN + 1)).reshape(n, UNKNOWN + 1).astype(float)
+    known = counts[:, :UNKNOWN].sum(axis=1)
+    empty = lengths == 0
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        weight = numpy.where(empty, numpy.nan, counts @ _weights + WATER)
+        gravy = (counts @ _hydropathy) / known
+        composition = 100.0 * counts[:, :UNKNOWN] / lengths[:, None]
+    first = codes[numpy.minimum(offsets[:-1], max(len(codes) - 1, 0))] if len(codes) else numpy.zeros(n, int)
+    last = codes[numpy.maximum(offsets[1:] - 1, 0)] if len(codes) else numpy.zeros(n, int)
+    n_pk, c_pk = _n_terminal[first], _c_terminal[last]
+    # the net charge decreases with pH: bisection of all the sequences together
+    low, high = numpy.zeros(n), numpy.full(n, 14.0)
+    for _ in range(PI_ITERATIONS):
+        middle = (low + high) / 2
+        positive = _charge(middle, counts, n_pk, c_pk) > 0
+        low = numpy.where(positive, middle, low)
+        high = numpy.where(positive, high, middle)
+    pi = numpy.where(empty, numpy.nan, (low + high) / 2)
+    charge = numpy.where(empty, numpy.nan, _charge(7.0, counts, n_pk, c_pk))
+    result = pandas.DataFrame({'Molecular Weight': weight, 'pI': pi, 'GRAVY': gravy, 'Charge pH 7': charge,
+                               'Cysteines': counts[:, AMINO_ACIDS.index('C')].astype(int)})
+    for i, letter in enumerate(AMINO_ACIDS):
+        result[f'%{letter}'] = composition[:, i]
+    return result
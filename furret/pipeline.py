@@ -0,0 +1,131 @@
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Sequence
+
+import furret.trace as trace
+
+_DONE = object()  # end of stream marker, passed downstream when all the workers of a step are done
+TICK = 0.1  # seconds between checks for a stopped pipeline while blocked on a queue
+
+
+@dataclass
+class Step:
+    name: str
+    function: Callable[[Any], Any]
+    workers: int = 1
+    expand: bool = False  # function returns an iterable, each of its items goes downstream
+    # a function returning None drops the item
+
+
+class Pipeline:
+    """
+    Runs a source iterator and a chain of steps in threads connected by bounded queues: a step blocks when its
+    output queue is full, so a slow step throttles the ones before it instead of letting items pile up.
+    Iterating over the pipeline yields the output of the last step in the calling thread (where the GUI can be
+    updated). The first exception raised in any thread stops the pipeline and is raised by the iteration.
+    Each step is traced (wall time, items) in every thread running it.
+    """
+
+    def __init__(self, source: Iterable, steps: Sequence[Step], source_name: str = 'source',
+                 maxsize: int = 32) -> None:
+        self.source = source
+        self.source_name = source_name
+        self.steps = list(steps)
+        self.queues = [queue.Queue(maxsize=maxsize) for _ in range(len(self.steps) + 1)]
+        self.stop = threading.Event()
+        self.errors: List[BaseException] = []
+        self.threads: List[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._running = [max(1, step.workers) for step in self.steps]
+
+    def _put(self, index: int, item) -> bool:
+        while not self.stop.is_set():
+            try:
+                self.queues[index].put(item, timeout=TICK)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, index: int):
+        while not self.stop.is_set():
+            try:
+                return self.queues[index].get(timeout=TICK)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def _fail(self, error: BaseException) -> None:
+        with self._lock:
+            self.errors.append(error)
+        self.stop.set()
+
+    def _run_source(self) -> None:
+        try:
+            with trace.stage(self.source_name) as stage:
+                for item in self.source:
+                    if not self._put(0, item):
+                        return
+                    stage.items += 1
+            self._put(0, _DONE)
+        except BaseException as e:
+            self._fail(e)
+
+    def _run_step(self, index: int) -> None:
+        step = self.steps[index]
+        try:
+            with trace.stage(step.name) as stage:
+                while True:
+                    item = self._get(index)
+                    if item is _DONE:
+                        # let the other workers of this step see the end too
+                        self._put(index, _DONE)
+                        break
+                    result = step.function(item)
+                    stage.items += 1
+                    if result is None:
+                        continue
+                    for output in (result if step.expand else (result,)):
+                        if not self._put(index + 1, output):
+                            return
+            with self._lock:
+                self._running[index] -= 1
+                last = self._running[index] == 0
+            if last:
+                self._put(index + 1, _DONE)
+        except BaseException as e:
+            self._fail(e)
+
+    def start(self) -> None:
+        self.threads = [threading.Thread(target=self._run_source, name=self.source_name, daemon=True)]
+        for index, step in enumerate(self.steps):
+            self.threads += [threading.Thread(target=self._run_step, args=(index,), name=step.name, daemon=True)
+                             for _ in range(max(1, step.workers))]
+        for thread in self.threads:
+            thread.start()
+
+    def close(self) -> None:
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+    def __iter__(self) -> Iterator:
+        if not self.threads:
+            self.start()
+        try:
+            while True:
+                item = self._get(len(self.steps))
+                if item is _DONE:
+                    break
+                yield item
+        finally:
+            self.close()
+        if self.errors:
+            raise self.errors[0]
+
+
+def run_pipeline(source: Iterable, steps: Sequence[Step], source_name: str = 'source',
+                 maxsize: int = 32) -> Iterator:
+    """the outputs of the last step, see Pipeline"""
+    return iter(Pipeline(source, steps, source_name=source_name, maxsize=maxsize))
@@ -15,6 +15,23 @@ class PreferencesDialog(QDialog):
         self.meme_executable = QLineEdit()
         meme_options_label = QLabel("Meme options:")
         self.meme_options = QLineEdit()
+        meme_identity_label = QLabel("Meme redundancy identity (0 = off):")
+        self.meme_identity = QDoubleSpinBox()
+        self.meme_identity.setRange(0.0, 1.0)
+        self.meme_identity.setSingleStep(0.05)
+        go_obo_label = QLabel("GO ontology file (.obo):")
+        self.go_obo_file = QLineEdit()
+        meme_workers_label = QLabel("Meme worker processes (0 = one per core):")
+        self.meme_workers = QSpinBox()
+        self.meme_workers.setRange(0, 1024)
+        protein_store_days_label = QLabel("Rebuild stored proteins after days (0 = never):")
+        self.protein_store_days = QSpinBox()
+        self.protein_store_days.setRange(0, 3650)
+        uniprot_format_label = QLabel("UniProt download format:")
+        self.uniprot_format = QComboBox()
+        self.uniprot_format.addItems(['xml', 'json'])
+        rcsb_graphql_label = QLabel("RCSB GraphQL URL:")
+        self.rcsb_graphql_url = QLineEdit()
         # moe_exe_label = QLabel("MOEbatch executable")
         # self.moe_executable = QLineEdit()
         entrez_email_label = QLabel("Email (for Entrez):")
@@ -37,6 +54,18 @@ class PreferencesDialog(QDialog):
         # grid.addWidget(self.moe_executable, 3, 1)
         grid.addWidget(entrez_email_label, 3, 0)
         grid.addWidget(self.entrez_email, 3, 1)
+        grid.addWidget(meme_identity_label, 4, 0)
+        grid.addWidget(self.meme_identity, 4, 1)
+        grid.addWidget(go_obo_label, 5, 0)
+        grid.addWidget(self.go_obo_file, 5, 1)
+        grid.addWidget(meme_workers_label, 6, 0)
+        grid.addWidget(self.meme_workers, 6, 1)
+        grid.addWidget(protein_store_days_label, 7, 0)
+        grid.addWidget(self.protein_store_days, 7, 1)
+        grid.addWidget(uniprot_format_label, 8, 0)
+        grid.addWidget(self.uniprot_format, 8, 1)
+        grid.addWidget(rcsb_graphql_label, 9, 0)
+        grid.addWidget(self.rcsb_graphql_url, 9, 1)
 
         main_layout = QVBoxLayout()
         main_layout.addLayout(grid)
@@ -55,6 +84,12 @@ class PreferencesDialog(QDialog):
         self.meme_options.setText(config.meme_options)
         # self.moe_executable.setText(config.moe_executable)
         self.entrez_email.setText(config.entrez_email)
+        self.meme_identity.setValue(config.meme_identity)
+        self.go_obo_file.setText(config.go_obo_file)
+        self.meme_workers.setValue(config.meme_workers)
+        self.protein_store_days.setValue(config.protein_store_days)
+        self.uniprot_format.setCurrentText(config.uniprot_format)
+        self.rcsb_graphql_url.setText(config.rcsb_graphql_url)
 
     def accept(self) -> None:
         settings = QSettings(config.APPLICATION_NAME, config.COMPANY_NAME)
@@ -63,6 +98,12 @@ class PreferencesDialog(QDialog):
         settings.setValue('memeOptions', self.meme_options.text())
         # settings.setValue('moeExcecutable', self.moe_executable.text())
         settings.setValue('entrezEmail', self.entrez_email.text())
+        settings.setValue('memeIdentity', self.meme_identity.value())
+        settings.setValue('goOboFile', self.go_obo_file.text())
+        settings.setValue('memeWorkers', self.meme_workers.value())
+        settings.setValue('proteinStoreDays', self.protein_store_days.value())
+        settings.setValue('uniprotFormat', self.uniprot_format.currentText())
+        settings.setValue('rcsbGraphqlUrl', self.rcsb_graphql_url.text())
         load_settings()
         os.makedirs(self.working_directory.text(), exist_ok=True)
         super().accept()
@@ -78,4 +119,10 @@ def load_settings() -> None:
                                          '-protein -oc . -nostatus -time 18000 -mod zoops -nmotifs 100'
                                          ' -minw 6 -maxw 50 -objfun classic -markov_order 0')
     config.entrez_email = settings.value('entrezEmail', 'my.name@my.domain')
+    config.meme_identity = float(settings.value('memeIdentity', 0.0))
+    config.go_obo_file = settings.value('goOboFile', '')
+    config.meme_workers = int(settings.value('memeWorkers', 0))
+    config.protein_store_days = int(settings.value('proteinStoreDays', 30))
+    config.uniprot_format = settings.value('uniprotFormat', 'xml')
+    config.rcsb_graphql_url = settings.value('rcsbGraphqlUrl', 'https://data.rcsb.org/graphql')
     # config.moe_executable = settings.value('moeExcecutable', '')
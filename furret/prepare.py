@@ -0,0 +1,158 @@
+import gzip
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from furret.chains import ChainGroups
+from furret.structure import open_structure
+
+CACHE_FILE = '.prepared.json'
+
+
+@dataclass
+class PrepareJob:
+    source: str
+    destination: str
+    # chain name -> residue ranges, an empty list keeps the whole chain
+    chains: Dict[str, List[Tuple[int, int]]] = field(default_factory=dict)
+    key: str = ''  # the input hash of the last preparation of destination, if any
+
+
+def chain_selection(the_chains: Optional[ChainGroups], residues: bool) -> Dict[str, List[Tuple[int, int]]]:
+    """
+    Converts ChainGroups in a picklable selection.
+    Residue ranges are in UniProt numbering: they are used only if residues is True,
+    that is when the structure is numbered on the UniProt sequence (SwissModel models).
+    """
+    if not the_chains:
+        return {}
+    return {chain.name: [(r.begin, r.end) for r in chain.ranges] if residues else []
+            for chain in the_chains}
+
+
+def job_key(source: str, chains: Dict[str, List[Tuple[int, int]]]) -> str:
+    digest = hashlib.sha256()
+    with open(source, 'rb') as the_file:
+        for block in iter(lambda: the_file.read(1 << 20), b''):
+            digest.update(block)
+    digest.update(json.dumps(chains, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+def _selected(chain: str, residue: str, chains: Dict[str, List[Tuple[int, int]]]) -> bool:
+    if chain not in chains:
+        return False
+    ranges = chains[chain]
+    if not ranges:
+        return True
+    try:
+        number = int(residue)
+    except ValueError:
+        return False
+    return any(begin <= number <= end for begin, end in ranges)
+
+
+def _chains_in_pdb(source: str) -> set:
+    with open_structure(source) as lines:
+        return {line[21] for line in lines if line.startswith(('ATOM  ', 'HETATM')) and len(line) > 21}
+
+
+def _trim_pdb(source: str, out, chains: Dict[str, List[Tuple[int, int]]]) -> int:
+    kept = 0
+    with open_structure(source) as lines:
+        for line in lines:
+            if line.startswith(('ATOM  ', 'HETATM', 'ANISOU', 'TER   ')):
+                if len(line) > 26 and _selected(line[21], line[22:26].strip(), chains):
+                    out.write(line)
+                    kept += 1
+            elif line.startswith(('HEADER', 'CRYST1', 'MODEL ', 'ENDMDL')):
+                out.write(line)
+    out.write('END\n')
+    return kept
+
+
+def _trim_cif(source: str, out, chains: Dict[str, List[Tuple[int, int]]]) -> int:
+    # only the _atom_site loop is kept, it is enough for the downstream preparation tools
+    kept = 0
+    columns = []
+    in_atom_site = False
+    with open_structure(source) as lines:
+        for line in lines:
+            if line.startswith('data_'):
+                out.write(line.rstrip('\n') + '\n#\n')
+            elif line.startswith('_atom_site.'):
+                if not columns:
+                    out.write('loop_\n')
+                columns.append(line.strip())
+                out.write(line)
+                in_atom_site = True
+            elif in_atom_site:
+                if line.startswith(('#', 'loop_', '_')):
+                    in_atom_site = False
+                    continue
+                values = line.split()
+                if len(values) != len(columns):
+                    continue
+                row = dict(zip(columns, values))
+                chain = row.get('_atom_site.auth_asym_id', row.get('_atom_site.label_asym_id', ''))
+                residue = row.get('_atom_site.auth_seq_id', row.get('_atom_site.label_seq_id', ''))
+                if _selected(chain, residue, chains):
+                    out.write(line)
+                    kept += 1
+    out.write('#\n')
+    return kept
+
+
+def _chains_in_cif(source: str) -> set:
+    columns = []
+    found = set()
+    with open_structure(source) as lines:
+        for line in lines:
+            if line.startswith('_atom_site.'):
+                columns.append(line.strip())
+            elif columns:
+                if line.startswith(('#', 'loop_', '_')):
+                    break
+                values = line.split()
+                if len(values) == len(columns):
+                    row = dict(zip(columns, values))
+                    found.add(row.get('_atom_site.auth_asym_id', row.get('_atom_site.label_asym_id', '')))
+    return found
+
+
+def prepare_structure(job: PrepareJob) -> Tuple[str, str, int]:
+    """
+    Writes the selected chains and residues of job.source (gzipped) in job.destination.
+    Returns destination, input hash and the number of records kept, -1 if the cached output is still valid.
+    """
+    key = job_key(job.source, job.chains)
+    if key == job.key and os.path.isfile(job.destination):
+        return job.destination, key, -1
+    is_cif = '.cif' in os.path.basename(job.source).lower()
+    chains = job.chains
+    present = _chains_in_cif(job.source) if is_cif else _chains_in_pdb(job.source)
+    if not chains or not present.intersection(chains):
+        # no usable selection (or chain naming differs from UniProt's), keep everything
+        chains = {chain: [] for chain in present}
+    partial = job.destination + '.part'
+    with gzip.open(partial, 'wt') as out:
+        kept = _trim_cif(job.source, out, chains) if is_cif else _trim_pdb(job.source, out, chains)
+    os.replace(partial, job.destination)
+    return job.destination, key, kept
+
+
+def load_cache(directory: str) -> Dict[str, str]:
+    path = os.path.join(directory, CACHE_FILE)
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'rt') as cache_file:
+        return json.load(cache_file)
+
+
+def save_cache(directory: str, cache: Dict[str, str]) -> None:
+    path = os.path.join(directory, CACHE_FILE)
+    with open(path + '.part', 'wt') as cache_file:
+        json.dump(cache, cache_file, indent=1, sort_keys=True)
+    os.replace(path + '.part', path)
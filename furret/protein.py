@@ -1,25 +1,48 @@
-import requests
+import functools
+import os
 import pandas
 import numpy
 from io import StringIO
 import json
+import furret.config as config
+import furret.network as network
 from furret.utilities import Link, Citation, Comment, Go, Keyword
 from furret.chains import ChainGroups
 from furret.structure import PDB, Model
-from typing import List
+from typing import Dict, List
 
+KEYWORDS_URL = 'https://www.uniprot.org/keywords/?query=*&format=tab&force=true&compress=no'
 
-class Protein:  # we look for swiss models ONLY IF no PDB is found
-    # consider caching the response
-    response = requests.get('https://www.uniprot.org/keywords/?query=*&format=tab&force=true&compress=no')
-    if response.ok:
-        text = response.text
-        kw_table = pandas.read_csv(StringIO(text), sep='\t')
-        del text
-    else:
+
+@functools.lru_cache(maxsize=None)
+def keyword_table():
+    """
+    the UniProt keyword table (None if it can't be retrieved), fetched on first use and kept in
+    <working directory>/uniprot_keywords.tsv for the next sessions
+    """
+    cache = os.path.join(config.working_directory, 'uniprot_keywords.tsv')
+    if os.path.isfile(cache):
+        return pandas.read_csv(cache, sep='\t')
+    response = network.get(KEYWORDS_URL)
+    if not response.ok:
         # logger.error('Unable to access keyword table, skipping keyword processing.')
-        kw_table = None
-    del response
+        return None
+    if os.path.isdir(config.working_directory):
+        with open(cache + '.part', 'wt') as the_file:
+            the_file.write(response.text)
+        os.replace(cache + '.part', cache)
+    return pandas.read_csv(StringIO(response.text), sep='\t')
+
+
+@functools.lru_cache(maxsize=None)
+def keyword_categories() -> Dict[str, str]:
+    table = keyword_table()
+    if table is None:
+        return {}
+    return dict(zip(table['Keyword ID'], table['Category']))
+
+
+class Protein:  # we look for swiss models ONLY IF no PDB is found
 
     def __init__(self, entry, database_list=('Gene3D', 'InterPro', 'Pfam', 'SUPFAM', 'PROSITE', 'PRINTS',
                                              'SMART', 'TIGRFAMs', 'CDD', 'PANTHER', 'PIRSF')):
@@ -103,10 +126,10 @@ class Protein:  # we look for swiss models ONLY IF no PDB is found
 
         def get_keywords(keyword_entries) -> List[Keyword]:
             keyword_list = []
+            categories = keyword_categories() if keyword_entries else {}
             for keyword in keyword_entries:
                 key_id = keyword['@id']
-                row = self.kw_table.loc[self.kw_table['Keyword ID'] == key_id]
-                category = row.iloc[0]['Category']
+                category = categories.get(key_id, '')
                 value = keyword['#text']
                 the_keyword = Keyword(key_id, value, category)
                 keyword_list.append(the_keyword)
@@ -140,7 +163,7 @@ class Protein:  # we look for swiss models ONLY IF no PDB is found
             return pdb_list
 
         def get_swiss_models() -> List[Model]:
-            answer = requests.get(f'https://swissmodel.expasy.org/repository/uniprot/{self.accession}.json')
+            answer = network.get(f'https://swissmodel.expasy.org/repository/uniprot/{self.accession}.json')
             j = json.load(StringIO(answer.text))
             structures = j['result']['structures']
             if len(structures) == 0:
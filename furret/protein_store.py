@@ -0,0 +1,71 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional, Tuple
+
+import furret.config as config
+
+# bump when Protein (or the structures it holds) changes, stored records of older layouts are then rebuilt
+SCHEMA_VERSION = 1
+
+Key = Tuple[str, str]  # (accession, UniProt entry version)
+
+
+def entry_key(entry) -> Key:
+    """(accession, entry version) of a parsed UniProt entry"""
+    return entry['accession'][0], str(entry.get('@version', ''))
+
+
+class ProteinStore:
+    """
+    Pickled Protein objects by (accession, UniProt entry version) in <working directory>/proteins.sqlite.
+    Proteins are stored as built, before any download: the downloaded state belongs to each query.
+    """
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path if path else os.path.join(config.working_directory, 'proteins.sqlite')
+        # shared by the threads of the query pipeline, calls are serialized by the lock
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.connection.execute('CREATE TABLE IF NOT EXISTS proteins (accession TEXT, version TEXT, schema INTEGER, '
+                                'stored REAL, data BLOB, PRIMARY KEY (accession, version))')
+        self.connection.commit()
+
+    def get(self, keys: Iterable[Key], max_age: Optional[float] = None) -> Dict[str, object]:
+        """{accession: Protein} for the stored keys, skipping records older than max_age days"""
+        keys = [k for k in keys if k[1]]
+        oldest = time.time() - max_age * 86400 if max_age else 0.0
+        result = {}
+        with self.lock:
+            rows = self._select(keys, oldest)
+        for accession, data in rows:
+            try:
+                result[accession] = pickle.loads(data)
+            except (pickle.UnpicklingError, AttributeError, EOFError, ImportError):
+                continue
+        return result
+
+    def _select(self, keys, oldest: float) -> list:
+        selected = []
+        for start in range(0, len(keys), 400):
+            chunk = keys[start:start + 400]
+            marks = ' OR '.join('(accession = ? AND version = ?)' for _ in chunk)
+            values = [v for key in chunk for v in key]
+            selected += self.connection.execute(f'SELECT accession, data FROM proteins WHERE schema = ? '
+                                                f'AND stored >= ? AND ({marks})', [SCHEMA_VERSION, oldest] + values)
+        return selected
+
+    def put(self, proteins: Dict[Key, object]) -> None:
+        now = time.time()
+        rows = [(accession, version, SCHEMA_VERSION, now, pickle.dumps(protein, protocol=pickle.HIGHEST_PROTOCOL))
+                for (accession, version), protein in proteins.items() if version]
+        with self.lock, self.connection:
+            # older versions of the same entries are not needed anymore
+            self.connection.executemany('DELETE FROM proteins WHERE accession = ?', [(r[0],) for r in rows])
+            self.connection.executemany('INSERT OR REPLACE INTO proteins VALUES (?, ?, ?, ?, ?)', rows)
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
@@ -0,0 +1,138 @@
+import os
+import re
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+from xml.parsers.expat import ExpatError
+
+import requests
+import xmltodict
+
+import furret.config as config
+import furret.network as network
+import furret.trace as trace
+
+EFETCH_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi'
+BATCH_SIZE = 200
+EMPTY_RETRY_DAYS = 30  # IDs efetch gave nothing for (partial answers, unparsed records) are asked again after that
+
+
+class AbstractStore:
+    """(title, abstract) of PubMed IDs in <working directory>/pubmed.sqlite, empty ones expire after EMPTY_RETRY_DAYS"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path if path else os.path.join(config.working_directory, 'pubmed.sqlite')
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS abstracts '
+                                '(pmid TEXT PRIMARY KEY, title TEXT, abstract TEXT, fetched TEXT)')
+        self.connection.commit()
+
+    def get(self, pmids: Iterable[str], empty_days: Optional[float] = None) -> Dict[str, Tuple[str, str]]:
+        """stored abstracts, without the empty ones fetched more than empty_days ago (if given)"""
+        pmids = list(pmids)
+        result = {}
+        expired = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - empty_days * 86400)) \
+            if empty_days is not None else ''
+        for start in range(0, len(pmids), 500):
+            chunk = pmids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT pmid, title, abstract, fetched FROM abstracts '
+                                           f'WHERE pmid IN ({marks})', chunk)
+            for pmid, title, abstract, fetched in rows:
+                if not title and not abstract and (fetched or '') < expired:
+                    continue
+                result[pmid] = (title, abstract)
+        return result
+
+    def put(self, abstracts: Dict[str, Tuple[str, str]]) -> None:
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.connection.executemany('INSERT OR REPLACE INTO abstracts VALUES (?, ?, ?, ?)',
+                                    [(pmid, title, abstract, now) for pmid, (title, abstract) in abstracts.items()])
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def _text(node) -> str:
+    # xmltodict gives plain strings or dicts (when the element has attributes or inline markup)
+    if node is None:
+        return ''
+    if isinstance(node, str):
+        return node
+    if isinstance(node, list):
+        return ' '.join(_text(n) for n in node)
+    return node.get('#text', '')
+
+
+def _abstract(node) -> str:
+    paragraphs = []
+    for paragraph in (node or {}).get('AbstractText', []):
+        label = paragraph.get('@Label') if isinstance(paragraph, dict) else None
+        paragraphs.append(f'{label}: {_text(paragraph)}' if label else _text(paragraph))
+    return '\n'.join(paragraphs)
+
+
+def parse_efetch(text: str) -> Dict[str, Tuple[str, str]]:
+    """
+    parses an efetch PubmedArticleSet (journal and book articles) into {pmid: (title, abstract)},
+    raises ExpatError on truncated or malformed answers
+    """
+    # drop inline markup (<i>, <sup>...), xmltodict would split the text around it
+    text = re.sub(r'</?(i|b|u|sup|sub)>', '', text)
+    data = xmltodict.parse(text, force_list=('PubmedArticle', 'PubmedBookArticle', 'AbstractText'))
+    articles = data.get('PubmedArticleSet') or {}
+    result = {}
+    for article in articles.get('PubmedArticle', []):
+        citation = article['MedlineCitation']
+        pmid = _text(citation['PMID'])
+        result[pmid] = (_text(citation['Article'].get('ArticleTitle')), _abstract(citation['Article'].get('Abstract')))
+    for article in articles.get('PubmedBookArticle', []):
+        document = article['BookDocument']
+        pmid = _text(document['PMID'])
+        title = _text(document.get('ArticleTitle')) or _text((document.get('Book') or {}).get('BookTitle'))
+        result[pmid] = (title, _abstract(document.get('Abstract')))
+    return result
+
+
+def efetch_batch(pmids: List[str]) -> Dict[str, Tuple[str, str]]:
+    # the eutils host policy in furret.network keeps us within NCBI's 3 requests per second
+    response = network.post(EFETCH_URL, data={'db': 'pubmed', 'id': ','.join(pmids), 'retmode': 'xml',
+                                              'tool': config.APPLICATION_NAME, 'email': config.entrez_email},
+                            timeout=120)
+    response.raise_for_status()
+    return parse_efetch(response.text)
+
+
+def fetch_abstracts(pmids: Iterable[str], store: Optional[AbstractStore] = None,
+                    batch_size: int = BATCH_SIZE) -> Dict[str, Tuple[str, str]]:
+    """
+    Returns {pmid: (title, abstract)} for the given PubMed IDs.
+    IDs are deduplicated, looked up in the store and only the missing ones are retrieved,
+    batch_size per efetch call. Retrieved abstracts are saved in the store, IDs efetch gave nothing for
+    are stored empty and asked again after EMPTY_RETRY_DAYS.
+    The IDs of failed batches are counted in the trace as 'unretrieved abstracts'.
+    """
+    unique = sorted({str(p) for p in pmids if p})
+    own_store = store is None
+    if own_store:
+        store = AbstractStore()
+    try:
+        result = store.get(unique, empty_days=EMPTY_RETRY_DAYS)
+        missing = [p for p in unique if p not in result]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            try:
+                fetched = efetch_batch(batch)
+            except (requests.RequestException, ConnectionAbortedError, ExpatError, KeyError):
+                trace.count('unretrieved abstracts', len(batch))
+                continue
+            # remember IDs without an article too, so they are not asked again before EMPTY_RETRY_DAYS
+            for pmid in batch:
+                fetched.setdefault(pmid, ('', ''))
+            store.put(fetched)
+            result.update(fetched)
+    finally:
+        if own_store:
+            store.close()
+    return result
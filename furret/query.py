@@ -1,39 +1,61 @@
 from datetime import datetime
-import requests
-import xmltodict
 
+import json
 import pickle
-import sys
 import shutil
+import time
 from multiprocessing import Pool
-from typing import List
-from requests import ReadTimeout, ConnectTimeout, HTTPError, Timeout, ConnectionError
+from typing import Iterator, List, Optional, Sequence, Tuple
 
 from PyQt5.QtWidgets import QApplication, QStatusBar
 
 
 import furret.config as config
+import furret.network as network
+import furret.trace as trace
+import furret.uniprot as uniprot
 from furret.utilities import format_filename, validate_string, seq2fasta, Obj
+from furret.pubmed import fetch_abstracts
+from furret.rcsb import fetch_metadata
+from furret.structure import is_structure_file, materialize, write_structure
+from furret.redundancy import cluster_sequences
+from furret.motifs import motif_library, scan
+from furret.seqbuffer import SequenceBuffer
+from furret.motif_index import MotifIndex
+from furret.search import build_index, SearchIndex
+from furret.matrices import build_matrices
+from furret.ontology import load_ontology
+from furret.table_store import TableStore, store_tables
+from furret.accessions import AccessionSpace, link_families
+from furret.protein_store import ProteinStore, entry_key
+from furret.protein import keyword_categories
+from furret.pipeline import Step, run_pipeline
+from furret.manifest import Manifest, fingerprint
+from furret.worker import WorkQueue, start_workers
+from furret.prepare import PrepareJob, chain_selection, prepare_structure, load_cache, save_cache
 from furret.tables import *
 from furret.meme import *
 from typing import Dict
 
 
+STAGES = ('fetch', 'proteins', 'sequences', 'tables')
+STAGES_FILE = 'stages.json'
+CHECKPOINT_PROTEINS = 500  # proteins built between two checkpoints of the proteins stage
+OVERLAPPED_STAGES = ('fetch', 'proteins', 'sequences')  # run concurrently by build_overlapped when all requested
+ENRICH_WORKERS = 4  # threads building proteins (Swiss Model queries) in build_overlapped
+UNIPROT_DIR = 'UniProt'
+
+
 # noinspection DuplicatedCode
 class Query:
-    def __init__(self, the_query: str, status: QStatusBar) -> None:
+    def __init__(self, the_query: str, status: QStatusBar, run: bool = True) -> None:
 
         self.query = the_query
         self.time = datetime.now().isoformat()
         name = format_filename(self.time + '_' + the_query)
         self.querydir = os.path.join(config.working_directory, name)
-        try:
-            os.makedirs(self.querydir)
-        except OSError:
-            print(f"Query directory '{self.querydir}' exists!")
-            print("This should't have happened")
-            sys.exit(1)
-        self.xmlfile = os.path.join(self.querydir, 'uniprot.xml')
+        os.makedirs(self.querydir)
+        self.uniprot_format = config.uniprot_format
         self.dump = os.path.join(self.querydir, 'query.pickle')
         self.tbldir = os.path.join(self.querydir, 'Tables')
         # os.makedirs(self.tbldir)
@@ -50,232 +72,754 @@ class Query:
         # os.makedirs(self.famstrdir)
         self.motivedir = os.path.join(self.querydir, 'Motives')
         # os.makedirs(self.motivedir)
+        self.proteins: Dict[str, Protein] = {}
+        self.tables = None
+        # saved right away: an interrupted query is listed and can be resumed
+        self.save()
         QApplication.processEvents()
 
+        if run:
+            self.run(status, action='new query')
+
+    # checkpointed pipeline
+
+    def stage_states(self) -> Dict[str, Dict[str, str]]:
+        """{stage: {'state': 'running' | 'done' | 'failed', ...}} as recorded in stages.json"""
+        path = os.path.join(self.querydir, STAGES_FILE)
+        if os.path.isfile(path):
+            with open(path, 'rt') as stages_file:
+                return json.load(stages_file)
+        # queries made before the pipeline was checkpointed
+        if self.tables is not None:
+            return {name: {'state': 'done'} for name in STAGES}
+        return {}
+
+    def _set_stage_state(self, name: str, state: str, error: str = '') -> None:
+        states = self.stage_states()
+        record = states.setdefault(name, {})
+        record['state'] = state
+        record['started' if state == 'running' else 'finished'] = datetime.now().isoformat()
+        if error:
+            record['error'] = error
+        else:
+            record.pop('error', None)
+        path = os.path.join(self.querydir, STAGES_FILE)
+        with open(path + '.part', 'wt') as stages_file:
+            json.dump(states, stages_file, indent=1)
+        os.replace(path + '.part', path)
+
+    def pending_stages(self) -> List[str]:
+        states = self.stage_states()
+        for i, name in enumerate(STAGES):
+            if states.get(name, {}).get('state') != 'done':
+                return list(STAGES[i:])
+        return []
+
+    def run(self, status: QStatusBar, stages: Optional[Sequence[str]] = None, action: str = 'resume') -> bool:
+        """
+        runs the given stages (by default the ones after the last completed stage), checkpointing after each one.
+        fetch, proteins and sequences, when all requested, run overlapped as one group.
+        A failing stage is recorded in stages.json and stops the run, returns True if all the stages completed.
+        """
+        stages = self.pending_stages() if stages is None else list(stages)
+        unknown = [name for name in stages if name not in STAGES]
+        if unknown:
+            raise ValueError(f'''Unknown stage(s) {', '.join(unknown)}''')
+        groups = []
+        index = 0
+        while index < len(stages):
+            overlapped = tuple(stages[index:index + len(OVERLAPPED_STAGES)]) == OVERLAPPED_STAGES
+            groups.append(list(OVERLAPPED_STAGES) if overlapped else [stages[index]])
+            index += len(groups[-1])
+        with trace.session(self.querydir, action):
+            for group in groups:
+                for name in group:
+                    self._set_stage_state(name, 'running')
+                try:
+                    if len(group) > 1:
+                        self.build_overlapped(status)
+                    else:
+                        getattr(self, 'stage_' + group[0])(status)
+                except Exception as e:
+                    for name in group:
+                        self._set_stage_state(name, 'failed', error=f'{type(e).__name__}: {e}')
+                    self.save()
+                    status.showMessage(f'''Stage {', '.join(group)} failed ({e}), the query can be resumed''')
+                    QApplication.processEvents()
+                    return False
+                with trace.stage('save'):
+                    self.save()
+                for name in group:
+                    self._set_stage_state(name, 'done')
+        status.showMessage(f'Done.')
+        return True
+
+    # UniProt download, saved a page at a time in <query>/UniProt
+
+    def _uniprot_format(self) -> str:
+        # queries made before the JSON mode used XML
+        return getattr(self, 'uniprot_format', 'xml')
+
+    def _download_pages(self) -> Iterator[str]:
+        """downloads the UniProt entries of the query a page at a time, saving each page, yields the page texts"""
+        the_format = self._uniprot_format()
+        pagedir = os.path.join(self.querydir, UNIPROT_DIR)
+        shutil.rmtree(pagedir, ignore_errors=True)
+        os.makedirs(pagedir)
+        for number, text in enumerate(uniprot.pages(self.query, the_format)):
+            path = os.path.join(pagedir, f'page_{number:05d}.{the_format}')
+            with open(path + '.part', 'wt') as page_file:
+                page_file.write(text)
+            os.replace(path + '.part', path)
+            yield text
+
+    def _saved_pages(self) -> Iterator[str]:
+        the_format = self._uniprot_format()
+        # queries made before paging saved a single file
+        single = os.path.join(self.querydir, 'uniprot.' + the_format)
+        pagedir = os.path.join(self.querydir, UNIPROT_DIR)
+        if os.path.isfile(single):
+            paths = [single]
+        else:
+            paths = [os.path.join(pagedir, name) for name in sorted(os.listdir(pagedir))
+                     if name.endswith('.' + the_format)]
+        for path in paths:
+            with open(path, 'rt') as page_file:
+                yield page_file.read()
+
+    def build_overlapped(self, status: QStatusBar) -> None:
+        """
+        fetch, proteins and sequences stages at once: UniProt pages are downloaded, parsed, turned into proteins
+        (ENRICH_WORKERS threads, each protein without PDB entries queries Swiss Model) and written as FASTA
+        concurrently, on bounded queues. Proteins are collected and checkpointed here, in the GUI thread.
+        """
         status.showMessage(f'Quering {self.query}, please be patient')
         QApplication.processEvents()
-        response = requests.get(f'https://www.uniprot.org/uniprot/?query={self.query}&format=xml')
-        text = response.text
-        status.showMessage(f'Saving XML for {self.query}')
+        the_format = self._uniprot_format()
+        os.makedirs(self.seqdir, exist_ok=True)
+        order: List[str] = []
+        store = ProteinStore()
+
+        def parse_page(text):
+            entries = uniprot.parse(text, the_format)
+            if any('keyword' in entry for entry in entries):
+                # loaded by this thread before the builders need it
+                keyword_categories()
+            accessions = [entry['accession'][0] for entry in entries]
+            order.extend(accessions)
+            # proteins built before an interruption are kept, the ones built by earlier queries are reused
+            keys = [entry_key(entry) for entry, accession in zip(entries, accessions) if accession not in self.proteins]
+            stored = store.get(keys, max_age=config.protein_store_days)
+            return [(entry, self.proteins.get(accession) or stored.get(accession))
+                    for entry, accession in zip(entries, accessions)]
+
+        def build(item):
+            entry, the_protein = item
+            if the_protein is None:
+                return entry, Protein(entry), True
+            return entry, the_protein, False
+
+        def write_fasta(item):
+            entry, the_protein, _ = item
+            accession = entry['accession'][0]
+            with open(os.path.join(self.seqdir, accession + '.fasta'), encoding="ascii", mode='wt') as fasta:
+                fasta.write(seq2fasta(the_protein.sequence, accession))
+            return item
+
+        steps = (Step('parse', parse_page, expand=True),
+                 Step('proteins', build, workers=ENRICH_WORKERS),
+                 Step('fasta', write_fasta))
+        built: Dict[Tuple[str, str], Protein] = {}
+        reused = 0
+        try:
+            with trace.stage('collect') as stage:
+                for entry, the_protein, is_new in run_pipeline(self._download_pages(), steps, source_name='fetch'):
+                    accession = entry['accession'][0]
+                    status.showMessage(f'Read {accession}')
+                    QApplication.processEvents()
+                    self.proteins[accession] = the_protein
+                    stage.items += 1
+                    if not is_new:
+                        reused += 1
+                        continue
+                    built[entry_key(entry)] = the_protein
+                    if len(built) == CHECKPOINT_PROTEINS:
+                        store.put(built)
+                        built = {}
+                        self.save()
+                store.put(built)
+        finally:
+            store.close()
+        # UniProt order, not completion order
+        ordered = {accession: self.proteins[accession] for accession in order if accession in self.proteins}
+        ordered.update(self.proteins)
+        self.proteins = ordered
+        status.showMessage(f'{reused} of {len(order)} proteins reused')
         QApplication.processEvents()
-        with open(self.xmlfile, 'wt') as xmlfile:
-            xmlfile.write(text)
-        status.showMessage(f'Parsing XML')
+
+    def stage_fetch(self, status: QStatusBar) -> None:
+        status.showMessage(f'Quering {self.query}, please be patient')
         QApplication.processEvents()
-        force_list = ('entry', 'accession', 'reference', 'dbReference', 'property', 'keyword', 'scope', 'name')
-        data = xmltodict.parse(text, force_list=force_list)
-        entries = data['uniprot']['entry']
-        self.proteins: Dict[str, Protein] = {}
-        for entry in entries:
-            uniprot = entry['accession'][0]
-            status.showMessage(f'Reading {uniprot}')
-            QApplication.processEvents()
-            self.proteins[uniprot] = Protein(entry)
-            sequence_file = os.path.join(self.seqdir, uniprot+'.fasta')
-            with open(sequence_file, encoding="ascii", mode='wt') as fasta:
-                fasta.write(seq2fasta(self.proteins[uniprot].sequence, uniprot))
-        self.tables = None
+        with trace.stage('fetch') as stage:
+            for _ in self._download_pages():
+                stage.items += 1
+                status.showMessage(f'Quering {self.query}, {stage.items} pages downloaded')
+                QApplication.processEvents()
+
+    def stage_proteins(self, status: QStatusBar) -> None:
+        the_format = self._uniprot_format()
+        status.showMessage(f'Parsing {the_format.upper()}')
+        QApplication.processEvents()
+        with trace.stage('parse') as stage:
+            entries = [entry for text in self._saved_pages() for entry in uniprot.parse(text, the_format)]
+            stage.items = len(entries)
+        store = ProteinStore()
+        try:
+            # proteins built before an interruption are kept, the ones built by earlier queries are reused
+            with trace.stage('protein store') as stage:
+                keys = [entry_key(entry) for entry in entries if entry['accession'][0] not in self.proteins]
+                stored = store.get(keys, max_age=config.protein_store_days)
+                self.proteins.update(stored)
+                stage.items = len(stored)
+            built: Dict[Tuple[str, str], Protein] = {}
+            with trace.stage('proteins') as stage:
+                for entry in entries:
+                    accession = entry['accession'][0]
+                    if accession in self.proteins:
+                        continue
+                    status.showMessage(f'Reading {accession}')
+                    QApplication.processEvents()
+                    self.proteins[accession] = built[entry_key(entry)] = Protein(entry)
+                    stage.items += 1
+                    if stage.items % CHECKPOINT_PROTEINS == 0:
+                        store.put(built)
+                        built = {}
+                        self.save()
+                store.put(built)
+        finally:
+            store.close()
+        status.showMessage(f'{len(stored)} of {len(entries)} proteins from the protein store')
+        QApplication.processEvents()
+
+    def stage_sequences(self, status: QStatusBar) -> None:
+        status.showMessage(f'Writing sequences')
+        QApplication.processEvents()
+        os.makedirs(self.seqdir, exist_ok=True)
+        with trace.stage('fasta', items=len(self.proteins)):
+            for uniprot, the_protein in self.proteins.items():
+                sequence_file = os.path.join(self.seqdir, uniprot+'.fasta')
+                with open(sequence_file, encoding="ascii", mode='wt') as fasta:
+                    fasta.write(seq2fasta(the_protein.sequence, uniprot))
+
+    def stage_tables(self, status: QStatusBar) -> None:
         self.process_tables(status)
-        status.showMessage(f'Saving Query')
-        self.save()
-        status.showMessage(f'Done.')
 
     def save(self):
-        pickle.dump(self, open(self.dump, 'wb'))
+        with open(self.dump + '.part', 'wb') as dump:
+            pickle.dump(self, dump)
+        os.replace(self.dump + '.part', self.dump)
         with open(os.path.join(self.querydir, 'query.txt'), 'wt') as textfile:
             textfile.write(self.query + '\n')
             textfile.write(self.time + '\n')
 
     def process_tables(self, status):
         the_tables = Obj()
+        # made by scan_motifs, not from the proteins: kept (in the table store too) when the tables are made again
+        if getattr(self.tables, 'motif_hits', None) is not None:
+            the_tables.motif_hits = self.tables.motif_hits
         os.makedirs(self.tbldir, exist_ok=True)
-        status.showMessage(f'Generating keywords table')
-        QApplication.processEvents()
-        the_tables.keywords = process_keywords(self.proteins, self.tbldir)
-        status.showMessage(f'Generating GO table')
-        QApplication.processEvents()
-        the_tables.go = process_go(self.proteins, self.tbldir)
-        status.showMessage(f'Generating databases table')
-        QApplication.processEvents()
-        the_tables.db = process_links(self.proteins, self.tbldir)
-        status.showMessage(f'Generating sequences table')
-        QApplication.processEvents()
-        the_tables.sequences = process_sequences(self.proteins, self.tbldir)
-        status.showMessage(f'Generating PDB table')
-        QApplication.processEvents()
-        the_tables.pdb = process_pdb(self.proteins, self.tbldir)
-        status.showMessage(f'Generating Swiss Models table')
-        QApplication.processEvents()
-        the_tables.sm = process_sm(self.proteins, self.tbldir)
-        status.showMessage(f'Generating citations scopes table')
-        QApplication.processEvents()
-        the_tables.cit_scopes = process_cit_scopes(self.proteins, self.tbldir)
-        status.showMessage(f'Generating citations table')
-        QApplication.processEvents()
-        the_tables.citations = process_citations(self.proteins, self.tbldir)
-        status.showMessage(f'Generating comments table')
-        QApplication.processEvents()
-        the_tables.comments = process_comments(self.proteins, self.tbldir)
-        status.showMessage(f'Generating organisms table')
-        QApplication.processEvents()
-        the_tables.organisms = process_organisms(self.proteins, self.tbldir)
-        status.showMessage(f'Generating family equivalence table')
-        QApplication.processEvents()
-        generate_families_equivalence_table(the_tables, self.tbldir)
-        # pickle.dump(the_tables, open(self.tbldump, 'wb'))
-        self.tables = the_tables
-        self.save()
+        manifest = Manifest(self.querydir)
+        with trace.session(self.querydir, 'tables'):
+            status.showMessage(f'Generating keywords table')
+            QApplication.processEvents()
+            with trace.stage('process_keywords') as stage:
+                the_tables.keywords = process_keywords(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.keywords)
+            status.showMessage(f'Generating GO table')
+            QApplication.processEvents()
+            with trace.stage('process_go') as stage:
+                the_tables.go = process_go(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = sum(len(df) for df in (the_tables.go.molecular_function,
+                                                     the_tables.go.biological_process,
+                                                     the_tables.go.cellular_component))
+            status.showMessage(f'Generating databases table')
+            QApplication.processEvents()
+            with trace.stage('process_links') as stage:
+                the_tables.db = process_links(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.db)
+            status.showMessage(f'Generating sequences table')
+            QApplication.processEvents()
+            with trace.stage('process_sequences') as stage:
+                the_tables.sequences = process_sequences(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.sequences)
+            status.showMessage(f'Generating PDB table')
+            QApplication.processEvents()
+            with trace.stage('pdb_metadata') as stage:
+                codes = {s.code for p in self.proteins.values() for s in p.experimental_structures}
+                metadata = fetch_metadata(codes)
+                stage.items = len(codes)
+            unretrieved = stage.args.get('unretrieved RCSB entries', 0)
+            if unretrieved:
+                status.showMessage(f'Unable to retrieve {unretrieved} RCSB entries, they are asked again next time')
+                QApplication.processEvents()
+            with trace.stage('process_pdb') as stage:
+                the_tables.pdb = process_pdb(self.proteins, self.tbldir, manifest=manifest, metadata=metadata)
+                stage.items = len(the_tables.pdb)
+            status.showMessage(f'Generating Swiss Models table')
+            QApplication.processEvents()
+            with trace.stage('process_sm') as stage:
+                the_tables.sm = process_sm(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.sm)
+            status.showMessage(f'Generating citations scopes table')
+            QApplication.processEvents()
+            with trace.stage('process_cit_scopes') as stage:
+                the_tables.cit_scopes = process_cit_scopes(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.cit_scopes)
+            status.showMessage(f'Retrieving PubMed abstracts')
+            QApplication.processEvents()
+            with trace.stage('abstracts') as stage:
+                pmids = {c.pubmed for p in self.proteins.values() for c in p.citations if c.pubmed}
+                abstracts = fetch_abstracts(pmids)
+                stage.items = len(pmids)
+            unretrieved = stage.args.get('unretrieved abstracts', 0)
+            if unretrieved:
+                status.showMessage(f'Unable to retrieve {unretrieved} PubMed abstracts, they are asked again next time')
+                QApplication.processEvents()
+            status.showMessage(f'Generating citations table')
+            QApplication.processEvents()
+            with trace.stage('process_citations') as stage:
+                the_tables.citations = process_citations(self.proteins, self.tbldir, abstracts=abstracts,
+                                                         manifest=manifest)
+                stage.items = len(the_tables.citations)
+            status.showMessage(f'Generating comments table')
+            QApplication.processEvents()
+            with trace.stage('process_comments') as stage:
+                the_tables.comments = process_comments(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.comments)
+            status.showMessage(f'Generating organisms table')
+            QApplication.processEvents()
+            with trace.stage('process_organisms') as stage:
+                the_tables.organisms = process_organisms(self.proteins, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.organisms)
+            status.showMessage(f'Generating family equivalence table')
+            QApplication.processEvents()
+            with trace.stage('families_equivalence'):
+                generate_families_equivalence_table(the_tables, self.tbldir, manifest=manifest)
+            status.showMessage(f'Generating annotation matrices')
+            QApplication.processEvents()
+            with trace.stage('matrices') as stage:
+                the_tables.matrices = build_matrices(self.proteins, the_tables)
+                stage.items = len(the_tables.matrices.accessions)
+            ontology = load_ontology()
+            if ontology is not None:
+                status.showMessage(f'Generating propagated GO table')
+                QApplication.processEvents()
+                with trace.stage('process_go_propagated') as stage:
+                    the_tables.go_propagated = process_go_propagated(the_tables, ontology, self.tbldir,
+                                                                     manifest=manifest)
+                    stage.items = len(the_tables.matrices.go_mf_propagated.indices) + \
+                        len(the_tables.matrices.go_bp_propagated.indices) + \
+                        len(the_tables.matrices.go_cc_propagated.indices)
+            status.showMessage(f'Generating enrichment table')
+            QApplication.processEvents()
+            with trace.stage('process_enrichment') as stage:
+                the_tables.enrichment = process_enrichment(the_tables, self.tbldir, manifest=manifest)
+                stage.items = len(the_tables.enrichment)
+            status.showMessage(f'Generating search index')
+            QApplication.processEvents()
+            with trace.stage('search_index') as stage:
+                index, stage.items = build_index(self.proteins, the_tables, SearchIndex.load(self.querydir))
+                index.save(self.querydir)
+            status.showMessage(f'Storing tables')
+            QApplication.processEvents()
+            with trace.stage('table_store') as stage:
+                store = store_tables(the_tables, self.querydir)
+                stage.items = len(store.names())
+                store.close()
+            status.showMessage(f'Indexing accession sets')
+            QApplication.processEvents()
+            with trace.stage('accession sets') as stage:
+                stage.items = self.index_accessions(the_tables.db)
+            manifest.save()
+            # pickle.dump(the_tables, open(self.tbldump, 'wb'))
+            self.tables = the_tables
+            self.save()
+
+    def index_accessions(self, links: Optional[pandas.DataFrame] = None) -> int:
+        """stores the members of the query and of its families in the working directory accession space"""
+        space = AccessionSpace()
+        try:
+            return space.index_query(self.querydir, self.proteins, link_families(links))
+        finally:
+            space.close()
+
+    @classmethod
+    def derive(cls, description: str, accessions: Sequence[str], sources: Sequence[str],
+               status: QStatusBar) -> 'Query':
+        """
+        a new query made of the given proteins, taken from the queries in the source directories:
+        nothing is fetched, only the sequences and the tables are made
+        """
+        the_query = cls(description, status, run=False)
+        wanted = set(accessions)
+        proteins: Dict[str, Protein] = {}
+        for source in sources:
+            status.showMessage(f'Reading {os.path.basename(source)}')
+            QApplication.processEvents()
+            with open(os.path.join(source, 'query.pickle'), 'rb') as query_pickle:
+                source_query = pickle.load(query_pickle)
+            for accession in wanted.difference(proteins):
+                if accession in source_query.proteins:
+                    proteins[accession] = source_query.proteins[accession]
+                    the_query._adopt_structures(source, accession, proteins[accession])
+            if len(proteins) == len(wanted):
+                break
+        the_query.proteins = {accession: proteins[accession] for accession in accessions if accession in proteins}
+        for name in ('fetch', 'proteins'):
+            the_query._set_stage_state(name, 'done')
+        the_query.run(status, action='derived query')
+        return the_query
+
+    def _adopt_structures(self, source: str, accession: str, the_protein: Protein) -> None:
+        """
+        copies the structure files of a protein taken from the query in source into this query: the source
+        may be deleted. Structures whose file is not there are downloaded again by download_structures.
+        """
+        source_dir = os.path.join(source, 'Structures', accession)
+        the_dir = os.path.join(self.structdir, accession)
+        if os.path.isdir(source_dir) and not os.path.isdir(the_dir):
+            shutil.copytree(source_dir, the_dir)
+        for structure in the_protein.experimental_structures + the_protein.models:
+            copied = os.path.join(the_dir, os.path.basename(structure.file)) if structure.file else ''
+            if copied and os.path.isfile(copied):
+                structure.file = copied
+            else:
+                structure.file = None
+                structure.downloaded = False
 
     def download_structures(self, status: QStatusBar) -> None:
 
-        # @timeout_retries(60, 5)
-        def retrieve_best_sm():
-            attempt = 1
-            response = None
-            while attempt < 10:
-                try:
-                    response = requests.get(
-                        'https://swissmodel.expasy.org/repository/uniprot/' + accession.upper() + '.pdb',
-                        timeout=30)
-                    break
-                except (ConnectTimeout, HTTPError, ReadTimeout, Timeout, ConnectionError):
-                    attempt += 1
-                    if attempt == 10:
-                        raise ConnectionAbortedError
-            if response.ok:
-                model_name = os.path.join(the_dir, f"{accession}_SM.pdb")
-                with open(model_name, 'w') as text_file:
-                    text_file.write(response.text)
+        def retrieve_best_sm() -> bool:
+            response = network.get('https://swissmodel.expasy.org/repository/uniprot/' + accession.upper() + '.pdb',
+                                   timeout=30)
+            if not response.ok:
+                return False
+            model_name = write_structure(os.path.join(the_dir, f"{accession}_SM.pdb"), response.text)
+            for model in the_protein.models:
+                model.file = model_name
+            return True
 
         total = len(self.proteins)
-        for count, (accession, the_protein) in enumerate(self.proteins.items()):
-            the_dir = os.path.join(self.structdir, accession)
-            if the_protein.experimental_structures:
-                for pdb in the_protein.experimental_structures:
-                    if not pdb.downloaded:
-                        status.showMessage(f'{count} of {total} Downloading structures for {accession}: {pdb.code}')
-                        QApplication.processEvents()
-                        os.makedirs(the_dir, exist_ok=True)
-                        pdb.retrieve_file(the_dir)
-                        pdb.downloaded = True
-            elif the_protein.models and the_protein.models[0].downloaded is False:
-                status.showMessage(f'{count} of {total} Downloading Model for {accession}')
-                QApplication.processEvents()
-                os.makedirs(the_dir, exist_ok=True)
-                retrieve_best_sm()
-                for model in the_protein.models:
-                    model.downloaded = True
-        self.save()
+        with trace.session(self.querydir, 'download structures') as session:
+            for count, (accession, the_protein) in enumerate(self.proteins.items()):
+                the_dir = os.path.join(self.structdir, accession)
+                if the_protein.experimental_structures:
+                    for pdb in the_protein.experimental_structures:
+                        if not pdb.downloaded:
+                            status.showMessage(f'{count} of {total} Downloading structures for {accession}: {pdb.code}')
+                            QApplication.processEvents()
+                            os.makedirs(the_dir, exist_ok=True)
+                            with trace.stage('download pdb', items=1):
+                                # structures the server did not give are tried again next time
+                                if pdb.retrieve_file(the_dir):
+                                    pdb.downloaded = True
+                                    session.items += 1
+                elif the_protein.models and the_protein.models[0].downloaded is False:
+                    status.showMessage(f'{count} of {total} Downloading Model for {accession}')
+                    QApplication.processEvents()
+                    os.makedirs(the_dir, exist_ok=True)
+                    with trace.stage('download model', items=1):
+                        if retrieve_best_sm():
+                            for model in the_protein.models:
+                                model.downloaded = True
+                            session.items += 1
+            self.save()
         status.showMessage(f'Done.')
 
+    def _structure_source(self, accession: str, prefix: str, known: Optional[str]) -> Optional[str]:
+        # structures downloaded before compression was introduced have no file attribute
+        if known and os.path.isfile(known):
+            return known
+        the_dir = os.path.join(self.structdir, accession)
+        if not os.path.isdir(the_dir):
+            return None
+        for n in sorted(os.listdir(the_dir)):
+            if n.lower().startswith(prefix.lower()) and is_structure_file(n):
+                return os.path.join(the_dir, n)
+        return None
+
+    def prepare_structures(self, status: QStatusBar) -> None:
+        """fills Prepared/<accession> with the chains (and residues) of the downloaded structures mapping on it"""
+        os.makedirs(self.prepdir, exist_ok=True)
+        cache = load_cache(self.prepdir)
+        jobs: List[PrepareJob] = []
+        for accession, the_protein in self.proteins.items():
+            candidates = [(pdb.code, pdb.file, chain_selection(pdb.chains, residues=False))
+                          for pdb in the_protein.experimental_structures]
+            if not candidates and the_protein.models:
+                # the repository model is numbered on the UniProt sequence
+                best = the_protein.best_model()
+                candidates = [(f'{accession}_SM', best.file, chain_selection(best.chains, residues=True))]
+            for prefix, known, chains in candidates:
+                source = self._structure_source(accession, prefix, known)
+                if not source:
+                    continue
+                extension = '.cif.gz' if '.cif' in os.path.basename(source).lower() else '.pdb.gz'
+                destination = os.path.join(self.prepdir, accession, prefix + extension)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                relative = os.path.relpath(destination, self.prepdir)
+                jobs.append(PrepareJob(source, destination, chains, cache.get(relative, '')))
+        reused = 0
+        with trace.session(self.querydir, 'prepare structures') as session:
+            session.items = len(jobs)
+            try:
+                with Pool() as p:
+                    for count, (destination, key, kept) in enumerate(p.imap_unordered(prepare_structure, jobs,
+                                                                                      chunksize=4)):
+                        cache[os.path.relpath(destination, self.prepdir)] = key
+                        # -1: the cached output was still valid
+                        if kept < 0:
+                            reused += 1
+                            trace.count('structures reused')
+                        if count % 10 == 0:
+                            status.showMessage(f'{count} of {len(jobs)} structures prepared')
+                            QApplication.processEvents()
+            finally:
+                # what was prepared before a failure is not done again
+                save_cache(self.prepdir, cache)
+        status.showMessage(f'Done, {reused} of {len(jobs)} structures were already prepared.')
+
     def gen_fam_seq(self, status: QStatusBar) -> None:
-        db_list = self.tables.db['Database'].unique()
-        for db in db_list:
-            df = self.tables.db.loc[self.tables.db['Database'] == db]
-            values = df['Value'].unique()
-            names = [validate_string(n) for n in values]
-            if len(set(names)) != len(values):
-                raise ValueError('Ambiguous validated value in {db}')
-            for i, (value, name) in enumerate(zip(values, names)):
-                subdirectory = os.path.join(self.famdir, db, name)
-                if not os.path.exists(subdirectory):
-                    os.makedirs(subdirectory, exist_ok=True)
-                if i % 1 == 0:
-                    status.showMessage(f'Processing {name}')
-                    QApplication.processEvents()
-                text = ""
-                hits = df.loc[df['Value'] == value]
-                codes = hits['Uniprot'].unique()
-                proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
-                for _, protein in proteins.iterrows():
-                    text += seq2fasta(protein['Sequence'], protein['Uniprot'])
-                filename = f'{db}_{name}.fasta'
-                filename = os.path.join(subdirectory, filename)
-                with open(filename, "wt") as handle:
-                    handle.write(text)
+        with trace.session(self.querydir, 'family sequences') as session:
+            manifest = Manifest(self.querydir)
+            db_list = self.tables.db['Database'].unique()
+            for db in db_list:
+                df = self.tables.db.loc[self.tables.db['Database'] == db]
+                values = df['Value'].unique()
+                names = [validate_string(n) for n in values]
+                if len(set(names)) != len(values):
+                    raise ValueError('Ambiguous validated value in {db}')
+                for i, (value, name) in enumerate(zip(values, names)):
+                    subdirectory = os.path.join(self.famdir, db, name)
+                    if not os.path.exists(subdirectory):
+                        os.makedirs(subdirectory, exist_ok=True)
+                    if i % 1 == 0:
+                        status.showMessage(f'Processing {name}')
+                        QApplication.processEvents()
+                    text = ""
+                    hits = df.loc[df['Value'] == value]
+                    codes = hits['Uniprot'].unique()
+                    proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
+                    for _, protein in proteins.iterrows():
+                        text += seq2fasta(protein['Sequence'], protein['Uniprot'])
+                    filename = f'{db}_{name}.fasta'
+                    filename = os.path.join(subdirectory, filename)
+                    # unchanged families keep their files (and timestamps)
+                    if manifest.write_text(filename, text):
+                        session.items += 1
+            manifest.save()
 
         status.showMessage(f'Done.')
 
     def gen_meme(self, status: QStatusBar) -> None:
 
-        db_list = self.tables.db['Database'].unique()
-        jobs: List[MemeJob] = []
-        for db in db_list:
-            df = self.tables.db.loc[self.tables.db['Database'] == db]
-            values = df['Value'].unique()
-            family_names = [validate_string(n) for n in values]
-            if len(set(family_names)) != len(values):
-                raise ValueError('Ambiguous validated value in {db}')
-            for i, (value, family_name) in enumerate(zip(values, family_names)):
-                subdirectory = os.path.join(self.famdir, db, family_name)
-                if not os.path.exists(subdirectory):
-                    os.makedirs(subdirectory, exist_ok=True)
-                # if i % 1 == 0:
-                    # status.showMessage(f'Processing {family_name}')
-                    # QApplication.processEvents()
-                text = ""
-                hits = df.loc[df['Value'] == value]
-                codes = hits['Uniprot'].unique()
-                proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
-                count = 0
-                for _, protein in proteins.iterrows():
-                    count += 1
-                    text += seq2fasta(protein['Sequence'], protein['Uniprot'])
-                filename = f'{db}_{family_name}.fasta'
-                filename = os.path.join(subdirectory, filename)
-                with open(filename, "wt") as handle:
-                    handle.write(text)
-                if count > 1:
-
-                    os.makedirs(self.motivedir, exist_ok=True)
-                    motivedir = os.path.join(self.motivedir, db, family_name)
-                    os.makedirs(motivedir, exist_ok=True)
-                    htmlfile = os.path.join(motivedir, 'meme.html')
-                    txtfile = os.path.join(motivedir, 'meme.txt')
-                    if os.path.isfile(txtfile) and os.path.isfile(htmlfile):
-                        continue
-                    jobs.append(MemeJob(filename, motivedir, config.meme_executable))
-        status.showMessage(f'Processing Meme Motifs')
-        QApplication.processEvents()
-        p = Pool()
-        _ = p.map(process_meme, jobs)
+        with trace.session(self.querydir, 'motives'):
+            manifest = Manifest(self.querydir)
+            db_list = self.tables.db['Database'].unique()
+            jobs: List[MemeJob] = []
+            keys: Dict[str, str] = {}  # MEME output directory: fingerprint of its inputs
+            for db in db_list:
+                df = self.tables.db.loc[self.tables.db['Database'] == db]
+                values = df['Value'].unique()
+                family_names = [validate_string(n) for n in values]
+                if len(set(family_names)) != len(values):
+                    raise ValueError('Ambiguous validated value in {db}')
+                for i, (value, family_name) in enumerate(zip(values, family_names)):
+                    subdirectory = os.path.join(self.famdir, db, family_name)
+                    if not os.path.exists(subdirectory):
+                        os.makedirs(subdirectory, exist_ok=True)
+                    # if i % 1 == 0:
+                        # status.showMessage(f'Processing {family_name}')
+                        # QApplication.processEvents()
+                    text = ""
+                    hits = df.loc[df['Value'] == value]
+                    codes = hits['Uniprot'].unique()
+                    proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
+                    count = 0
+                    for _, protein in proteins.iterrows():
+                        count += 1
+                        text += seq2fasta(protein['Sequence'], protein['Uniprot'])
+                    filename = f'{db}_{family_name}.fasta'
+                    filename = os.path.join(subdirectory, filename)
+                    manifest.write_text(filename, text)
+                    if count > 1 and config.meme_identity > 0:
+                        with trace.stage('redundancy', items=count) as stage:
+                            filename, count = self.reduce_family(proteins, filename, manifest)
+                            stage.items = count
+                    if count > 1:
+
+                        os.makedirs(self.motivedir, exist_ok=True)
+                        motivedir = os.path.join(self.motivedir, db, family_name)
+                        os.makedirs(motivedir, exist_ok=True)
+                        htmlfile = os.path.join(motivedir, 'meme.html')
+                        txtfile = os.path.join(motivedir, 'meme.txt')
+                        # the outputs are current when made from the very sequences MEME gets, with the same options
+                        with open(filename, 'rb') as fasta:
+                            key = fingerprint(fasta.read(), MEME_OPTIONS, config.meme_executable)
+                        outputs = os.path.isfile(txtfile) and os.path.isfile(htmlfile)
+                        if outputs and not manifest.was_recorded(motivedir) and \
+                                os.path.getmtime(txtfile) > os.path.getmtime(filename):
+                            # made before the outputs were fingerprinted, from the current sequences
+                            manifest.record(motivedir, key)
+                        if outputs and manifest.is_current(motivedir, key):
+                            continue
+                        jobs.append(MemeJob(filename, motivedir, config.meme_executable))
+                        keys[os.path.normpath(motivedir)] = key
+            manifest.save()
+            status.showMessage(f'Processing Meme Motifs')
+            QApplication.processEvents()
+            index = MotifIndex(self.motivedir)
+            with trace.stage('meme', items=len(jobs)):
+                # the jobs go through a queue in the query directory: workers on other hosts can help
+                queue = WorkQueue(self.querydir)
+                queue.submit(jobs)
+                workers = start_workers(self.querydir, config.meme_workers or os.cpu_count()) if jobs else []
+                waiting = {os.path.normpath(job.destination_directory) for job in jobs}
+                while waiting:
+                    # each family is indexed as soon as its run is over
+                    for destination, state in queue.states().items():
+                        if destination in waiting and state in ('done', 'failed'):
+                            waiting.discard(destination)
+                            if state == 'done':
+                                index.update_file(os.path.join(destination, 'meme.txt'))
+                                # failed or interrupted runs are not recorded: they run again next time
+                                manifest.record(destination, keys[destination])
+                                manifest.save()
+                    counts = queue.counts()
+                    status.showMessage(f"Meme: {counts['done']} done, {counts['running']} running, "
+                                       f"{counts['pending']} pending, {counts['failed']} failed")
+                    QApplication.processEvents()
+                    if waiting and counts['pending'] and not any(worker.is_alive() for worker in workers):
+                        # the local workers left while jobs of dead remote workers were queued again
+                        workers += start_workers(self.querydir, config.meme_workers or os.cpu_count())
+                    if waiting:
+                        time.sleep(1)
+                for worker in workers:
+                    worker.join()
+                queue.close()
+            with trace.stage('motif index'):
+                index.update()
+            # browsable with the other tables
+            with trace.stage('motif tables') as stage:
+                store = TableStore(self.querydir)
+                motifs, sites = index.motifs(), index.sites()
+                store.write('Motifs', motifs)
+                store.write('Motif Sites', sites)
+                store.close()
+                stage.items = len(motifs) + len(sites)
+            index.close()
+        status.showMessage(f'Done.')
+
+    def scan_motifs(self, status: QStatusBar, other_queries: Sequence[str] = ()) -> None:
+        """
+        scans all the query sequences with the MEME motifs of this query (and of the other query directories)
+        and writes Tables/motif_hits.xlsx
+        """
+        with trace.session(self.querydir, 'scan motives') as session:
+            status.showMessage(f'Reading motives')
+            QApplication.processEvents()
+            motive_directories = [self.motivedir] + [os.path.join(q, 'Motives') for q in other_queries]
+            motifs = motif_library(motive_directories)
+            status.showMessage(f'Scanning {len(self.proteins)} sequences with {len(motifs)} motives')
+            QApplication.processEvents()
+            with trace.stage('sequence buffer', items=len(self.proteins)):
+                buffer = SequenceBuffer.for_query(self.querydir, self.proteins)
+            with trace.stage('scan', items=len(motifs) * len(buffer)):
+                hits = scan(motifs, buffer)
+            session.items = len(hits)
+            os.makedirs(self.tbldir, exist_ok=True)
+            manifest = Manifest(self.querydir)
+            self.tables.motif_hits = process_motif_hits(hits, self.tbldir, manifest=manifest)
+            manifest.save()
+            store = TableStore(self.querydir)
+            store.write('Motif Hits', self.tables.motif_hits)
+            store.close()
+            self.save()
         status.showMessage(f'Done.')
 
-    def gen_fam_struct(self, status: QStatusBar) -> None:
+    @staticmethod
+    def reduce_family(proteins, filename, manifest: Optional[Manifest] = None):
+        """
+        writes the non redundant <family>_nr.fasta and the <family>_nr.tsv representative -> member mapping
+        next to filename, returns the new fasta file name and the number of representatives
+        """
+        clusters = cluster_sequences(list(proteins['Uniprot']), list(proteins['Sequence']), config.meme_identity)
+        sequences = dict(zip(proteins['Uniprot'], proteins['Sequence']))
+        root = os.path.splitext(filename)[0]
+        fasta = ''.join(seq2fasta(sequences[representative], representative) for representative in clusters)
+        mapping = 'Representative\tMember\n' + ''.join(f'{representative}\t{member}\n'
+                                                       for representative, members in clusters.items()
+                                                       for member in members)
+        if manifest is None:
+            manifest = Manifest(os.path.dirname(filename))
+        manifest.write_text(root + '_nr.fasta', fasta)
+        manifest.write_text(root + '_nr.tsv', mapping)
+        return root + '_nr.fasta', len(clusters)
+
+    def gen_fam_struct(self, status: QStatusBar, decompress: bool = False) -> None:
         # struct dir is where structures are, directory is where to put results
-        db_list = self.tables.db['Database'].unique()
-        for db in db_list:
-            df = self.tables.db.loc[self.tables.db['Database'] == db]
-            values = df['Value'].unique()
-            names = [validate_string(n) for n in values]
-            if len(set(names)) != len(values):
-                raise ValueError('Ambiguous validated value in {db}')
-            for i, (value, name) in enumerate(zip(values, names)):
-                subdirectory = os.path.join(self.famstrdir, db, name)
-                if not os.path.exists(subdirectory):
-                    os.makedirs(subdirectory, exist_ok=True)
-                if i % 10 == 0:
-                    status.showMessage(f'Processing {name}')
-                    QApplication.processEvents()
-                text = ""
-                hits = df.loc[df['Value'] == value]
-                codes = hits['Uniprot'].unique()
-                proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
-                for _, protein in proteins.iterrows():
-                    if protein["Fragment"] is not '':
+        with trace.session(self.querydir, 'family structures') as session:
+            self.prepare_structures(status)
+            manifest = Manifest(self.querydir)
+            db_list = self.tables.db['Database'].unique()
+            for db in db_list:
+                df = self.tables.db.loc[self.tables.db['Database'] == db]
+                values = df['Value'].unique()
+                names = [validate_string(n) for n in values]
+                if len(set(names)) != len(values):
+                    raise ValueError('Ambiguous validated value in {db}')
+                for i, (value, name) in enumerate(zip(values, names)):
+                    subdirectory = os.path.join(self.famstrdir, db, name)
+                    if not os.path.exists(subdirectory):
+                        os.makedirs(subdirectory, exist_ok=True)
+                    if i % 10 == 0:
+                        status.showMessage(f'Processing {name}')
+                        QApplication.processEvents()
+                    text = ""
+                    hits = df.loc[df['Value'] == value]
+                    codes = hits['Uniprot'].unique()
+                    proteins = self.tables.sequences.loc[self.tables.sequences['Uniprot'].isin(codes)]
+                    structures = []
+                    for _, protein in proteins.iterrows():
+                        if protein["Fragment"] is not '':
+                            continue
+                        text += seq2fasta(protein['Sequence'], protein['Uniprot'])
+                        path = os.path.join(self.prepdir, protein['Uniprot'])
+                        if os.path.exists(path):
+                            structures += [os.path.join(path, n) for n in sorted(os.listdir(path))
+                                           if is_structure_file(n)]
+                    # the family directory is rebuilt only when its members or their prepared structures change
+                    key = fingerprint(text, decompress,
+                                      [(n, os.path.getsize(n), os.path.getmtime(n)) for n in structures])
+                    if manifest.is_current(subdirectory, key):
                         continue
-                    text += seq2fasta(protein['Sequence'], protein['Uniprot'])
-                    path = os.path.join(self.prepdir, protein['Uniprot'])
-                    if os.path.exists(path):
-                        ll = os.listdir(path)
-                        for n in ll:
-                            if n[-4:] in ['.PDB', '.pdb']:
-                                the_name = os.path.join(path, n)
-                                shutil.copy2(the_name, subdirectory)
-                filename = f'{db}_{name}_nofragments.fasta'
-                filename = os.path.join(subdirectory, filename)
-                with open(filename, "wt") as handle:
-                    handle.write(text)
+                    wanted = set()
+                    for the_name in structures:
+                        if decompress:
+                            wanted.add(os.path.basename(materialize(the_name, subdirectory)))
+                        else:
+                            shutil.copy2(the_name, subdirectory)
+                            wanted.add(os.path.basename(the_name))
+                    # structures of former members
+                    for n in os.listdir(subdirectory):
+                        if is_structure_file(n) and n not in wanted:
+                            os.remove(os.path.join(subdirectory, n))
+                    filename = f'{db}_{name}_nofragments.fasta'
+                    filename = os.path.join(subdirectory, filename)
+                    manifest.write_text(filename, text)
+                    manifest.record(subdirectory, key)
+                    session.items += 1
+            manifest.save()
         status.showMessage(f'Done.')
 
     def gen_summary(self, status: QStatusBar) -> None:
@@ -0,0 +1,146 @@
+import json
+import os
+import sqlite3
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy
+import requests
+
+import furret.config as config
+import furret.network as network
+import furret.trace as trace
+
+BATCH_SIZE = 200
+EMPTY_RETRY_DAYS = 30  # codes RCSB gave nothing for are asked again after that
+
+GRAPHQL_QUERY = '''
+query ($ids: [String!]!) {
+  entries(entry_ids: $ids) {
+    rcsb_id
+    rcsb_accession_info { initial_release_date }
+    refine { ls_R_factor_R_free }
+    rcsb_entry_info { nonpolymer_bound_components }
+    polymer_entities { rcsb_entity_source_organism { ncbi_scientific_name } }
+    assemblies { rcsb_struct_symmetry { oligomeric_state } }
+  }
+}
+'''
+
+COLUMNS = ('Release Date', 'R-free', 'Ligands', 'Source Organism', 'Oligomeric State')
+
+
+class MetadataStore:
+    """the COLUMNS of PDB codes in <working directory>/rcsb.sqlite, as parse_entry made them"""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self.path = path if path else os.path.join(config.working_directory, 'rcsb.sqlite')
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS entries (code TEXT PRIMARY KEY, data TEXT, fetched TEXT)')
+        self.connection.commit()
+
+    def get(self, codes: Iterable[str], empty_days: Optional[float] = None) -> Dict[str, Dict]:
+        """stored metadata, without the empty entries fetched more than empty_days ago (if given)"""
+        codes = list(codes)
+        result = {}
+        expired = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - empty_days * 86400)) \
+            if empty_days is not None else ''
+        for start in range(0, len(codes), 500):
+            chunk = codes[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            rows = self.connection.execute(f'SELECT code, data, fetched FROM entries WHERE code IN ({marks})', chunk)
+            for code, data, fetched in rows:
+                entry = json.loads(data)
+                if not entry and (fetched or '') < expired:
+                    continue
+                result[code] = entry
+        return result
+
+    def put(self, entries: Dict[str, Dict]) -> None:
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        self.connection.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?)',
+                                    [(code, json.dumps(data), now) for code, data in entries.items()])
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def parse_entry(entry: Dict) -> Dict:
+    """the COLUMNS of one entry of the GraphQL answer"""
+    release = (entry.get('rcsb_accession_info') or {}).get('initial_release_date') or ''
+    r_free = [r['ls_R_factor_R_free'] for r in entry.get('refine') or [] if r.get('ls_R_factor_R_free') is not None]
+    ligands = (entry.get('rcsb_entry_info') or {}).get('nonpolymer_bound_components') or []
+    organisms = {organism['ncbi_scientific_name']
+                 for entity in entry.get('polymer_entities') or []
+                 for organism in entity.get('rcsb_entity_source_organism') or []
+                 if organism.get('ncbi_scientific_name')}
+    # the first assembly is the one the authors deposited (or the software predicted) as biological
+    symmetries = [s for assembly in entry.get('assemblies') or []
+                  for s in assembly.get('rcsb_struct_symmetry') or []]
+    return {'Release Date': release[:10],
+            'R-free': float(r_free[0]) if r_free else None,
+            'Ligands': ', '.join(sorted(ligands)),
+            'Source Organism': '; '.join(sorted(organisms)),
+            'Oligomeric State': (symmetries[0].get('oligomeric_state') or '') if symmetries else ''}
+
+
+def graphql_batch(codes: List[str], url: Optional[str] = None) -> Tuple[Dict[str, Dict], bool]:
+    """the entries RCSB returned for codes, and whether the answer is complete (it has no GraphQL errors)"""
+    response = network.post(url if url else config.rcsb_graphql_url,
+                            json={'query': GRAPHQL_QUERY, 'variables': {'ids': codes}}, timeout=120)
+    response.raise_for_status()
+    answer = response.json()
+    if answer.get('errors') and not answer.get('data'):
+        raise requests.RequestException(answer['errors'][0].get('message', 'GraphQL error'))
+    entries = (answer.get('data') or {}).get('entries') or []
+    return {entry['rcsb_id'].upper(): parse_entry(entry) for entry in entries if entry}, not answer.get('errors')
+
+
+def fetch_metadata(codes: Iterable[str], store: Optional[MetadataStore] = None,
+                   batch_size: int = BATCH_SIZE, url: Optional[str] = None) -> Dict[str, Dict]:
+    """
+    Returns {PDB code: {column: value}} for the given PDB codes.
+    Codes are deduplicated, looked up in the store and only the missing ones are retrieved,
+    batch_size per GraphQL request to url (default config.rcsb_graphql_url). Retrieved entries are saved in the store,
+    codes a complete answer gave nothing for are stored empty and asked again after EMPTY_RETRY_DAYS.
+    Codes that could not be retrieved are counted in the trace as 'unretrieved RCSB entries'.
+    """
+    unique = sorted({str(c).upper() for c in codes if c})
+    own_store = store is None
+    if own_store:
+        store = MetadataStore()
+    try:
+        result = store.get(unique, empty_days=EMPTY_RETRY_DAYS)
+        missing = [c for c in unique if c not in result]
+        for start in range(0, len(missing), batch_size):
+            batch = missing[start:start + batch_size]
+            try:
+                fetched, complete = graphql_batch(batch, url)
+            except (requests.RequestException, ConnectionAbortedError, ValueError):
+                trace.count('unretrieved RCSB entries', len(batch))
+                continue
+            if complete:
+                # remember codes RCSB does not know too, so they are not asked again before EMPTY_RETRY_DAYS
+                for code in batch:
+                    fetched.setdefault(code, {})
+            else:
+                # the codes an answer with errors left out may exist: they are asked again next time
+                trace.count('unretrieved RCSB entries', len(batch) - len(fetched))
+            store.put(fetched)
+            result.update(fetched)
+    finally:
+        if own_store:
+            store.close()
+    return result
+
+
+def metadata_columns(codes: Iterable[str], metadata: Dict[str, Dict]) -> Dict[str, list]:
+    """{column: values} aligned with codes, empty (NaN for R-free) where the metadata is missing"""
+    codes = [str(c).upper() for c in codes]
+    columns = {}
+    for column in COLUMNS:
+        missing = numpy.nan if column == 'R-free' else ''
+        values = [metadata.get(code, {}).get(column) for code in codes]
+        columns[column] = [missing if value is None else value for value in values]
+    return columns
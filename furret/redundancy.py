@@ -0,0 +1,81 @@
+import hashlib
+from typing import Dict, List, Sequence
+
+import numpy
+
+from furret.encoding import encode, sequence_ids, UNKNOWN
+from furret.matrices import Incidence
+
+KMER = 3
+
+
+def kmer_matrix(sequences: Sequence[str], k: int = KMER) -> Incidence:
+    """
+    sparse binary sequence x k-mer presence matrix: rows are the sequence indices, columns the codes of the k-mers
+    present in some sequence. Memory grows with the total sequence length, not with sequences x k-mers.
+    """
+    codes, offsets = encode(sequences)
+    rows = numpy.arange(len(sequences))
+    if len(codes) < k:
+        return Incidence(rows, numpy.zeros(0, dtype=numpy.int64), numpy.zeros(len(sequences) + 1, dtype=numpy.int64),
+                         numpy.zeros(0, dtype=numpy.int32))
+    ids = sequence_ids(offsets)
+    n_windows = len(codes) - k + 1
+    kmers = numpy.zeros(n_windows, dtype=numpy.int64)
+    valid = numpy.ones(n_windows, dtype=bool)
+    for shift in range(k):
+        window = codes[shift:shift + n_windows]
+        kmers = kmers * UNKNOWN + window
+        valid &= window != UNKNOWN
+    # windows must not contain unknown residues nor cross two sequences
+    valid &= ids[:n_windows] == ids[k - 1:]
+    columns, kmer_index = numpy.unique(kmers[valid], return_inverse=True)
+    # a k-mer repeated in a sequence counts once, pairs come out sorted by row as CSR wants them
+    pairs = numpy.sort(ids[:n_windows][valid] * max(len(columns), 1) + kmer_index)
+    first = numpy.ones(len(pairs), dtype=bool)
+    first[1:] = pairs[1:] != pairs[:-1]
+    pairs = pairs[first]
+    row_ids, column_ids = numpy.divmod(pairs, max(len(columns), 1))
+    indptr = numpy.zeros(len(sequences) + 1, dtype=numpy.int64)
+    numpy.cumsum(numpy.bincount(row_ids, minlength=len(sequences)), out=indptr[1:])
+    return Incidence(rows, columns, indptr, column_ids.astype(numpy.int32))
+
+
+def cluster_sequences(labels: Sequence[str], sequences: Sequence[str],
+                      identity: float, k: int = KMER) -> Dict[str, List[str]]:
+    """
+    Greedy redundancy reduction. Exact duplicates are collapsed first (by sequence hash), then, from the longest
+    sequence down, each representative absorbs the shorter sequences sharing at least identity ** k of their k-mers
+    (the expected fraction of conserved k-mers at that identity).
+    Returns {representative label: [labels of all cluster members, representative first]}.
+    """
+    unique: Dict[str, List[str]] = {}
+    unique_sequences: Dict[str, str] = {}
+    for label, sequence in zip(labels, sequences):
+        digest = hashlib.sha1(sequence.upper().encode()).hexdigest()
+        unique.setdefault(digest, []).append(label)
+        unique_sequences[digest] = sequence
+    digests = list(unique)
+    the_sequences = [unique_sequences[d] for d in digests]
+    matrix = kmer_matrix(the_sequences, k)
+    transposed = matrix.transpose()
+    n_kmers = matrix.row_lengths()
+    lengths = numpy.array([len(s) for s in the_sequences])
+    order = numpy.argsort(-lengths, kind='stable')
+    assigned = numpy.zeros(len(digests), dtype=bool)
+    threshold = identity ** k
+    clusters: Dict[str, List[str]] = {}
+    for i in order:
+        if assigned[i]:
+            continue
+        assigned[i] = True
+        members = [i]
+        if n_kmers[i] > 0:
+            shared = matrix.intersections(i, transposed)
+            similarity = shared / numpy.maximum(numpy.minimum(n_kmers, n_kmers[i]), 1)
+            folded = numpy.flatnonzero(~assigned & (similarity >= threshold) & (lengths <= lengths[i]))
+            assigned[folded] = True
+            members += folded.tolist()
+        representative = unique[digests[i]][0]
+        clusters[representative] = [label for m in members for label in unique[digests[m]]]
+    return clusters
@@ -0,0 +1,204 @@
+import bisect
+import hashlib
+import os
+import pickle
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy
+import pandas
+
+INDEX_FILE = 'search.pickle'
+SNIPPET_LENGTH = 120
+
+_token = re.compile(r'[a-z0-9]+')
+
+
+def tokenize(text: str) -> List[str]:
+    return _token.findall(str(text).lower()) if text else []
+
+
+class SearchIndex:
+    """
+    Inverted index over the free text of a query: term -> sorted array of document ids.
+    A document is one (table, accession, row, column) text cell.
+    The documents of each accession are kept with a fingerprint of their text: update() re-indexes only the
+    accessions added or changed since the last build and drops the ones no longer in the query.
+
+    Queries: space separated terms must all match, OR separates alternatives,
+    -term or NOT term excludes, term* matches every term with that prefix.
+    """
+
+    def __init__(self) -> None:
+        self.documents: List[Tuple[str, str, int, str]] = []  # table, accession, row, snippet
+        self.postings: Dict[str, numpy.ndarray] = {}
+        self.terms: List[str] = []
+        self.accession_documents: Dict[str, List[int]] = {}
+        self.fingerprints: Dict[str, str] = {}  # accession -> digest of its indexed text
+        self._pending: Dict[str, List[int]] = {}
+        self._removed: List[int] = []
+
+    def __setstate__(self, state: Dict) -> None:
+        # indexes saved by older versions miss some of the attributes
+        self.__init__()
+        self.__dict__.update(state)
+
+    def add(self, table: str, accession: str, row: int, text: str) -> None:
+        doc = len(self.documents)
+        self.documents.append((table, accession, row, str(text)[:SNIPPET_LENGTH]))
+        self.accession_documents.setdefault(accession, []).append(doc)
+        for term in set(tokenize(text)):
+            self._pending.setdefault(term, []).append(doc)
+
+    def remove(self, accession: str) -> None:
+        """drops the documents of accession, at the next commit"""
+        self._removed += self.accession_documents.pop(accession, [])
+        self.fingerprints.pop(accession, None)
+
+    def update(self, cells: Dict[str, List[Tuple[str, int, str]]]) -> int:
+        """
+        makes the index match cells, {accession: [(table, row, text)...]}: accessions whose text did not change
+        only get their rows renumbered. Returns the number of accessions (re)indexed.
+        """
+        for accession in set(self.accession_documents) - set(cells):
+            self.remove(accession)
+        indexed = 0
+        for accession, accession_cells in cells.items():
+            digest = hashlib.sha1(repr([(table, text) for table, _, text in accession_cells]).encode()).hexdigest()
+            if self.fingerprints.get(accession) == digest:
+                for doc, (table, row, _) in zip(self.accession_documents[accession], accession_cells):
+                    _, _, _, snippet = self.documents[doc]
+                    self.documents[doc] = (table, accession, row, snippet)
+                continue
+            self.remove(accession)
+            for table, row, text in accession_cells:
+                self.add(table, accession, row, text)
+            self.fingerprints[accession] = digest
+            indexed += 1
+        self.commit()
+        return indexed
+
+    def _compact(self) -> None:
+        """renumbers the documents without the removed ones"""
+        keep = numpy.ones(len(self.documents), dtype=bool)
+        keep[self._removed] = False
+        new_ids = (numpy.cumsum(keep) - 1).astype(numpy.int32)
+        postings = {}
+        for term, docs in self.postings.items():
+            docs = new_ids[docs[keep[docs]]]
+            if len(docs):
+                postings[term] = docs
+        self.postings = postings
+        self.documents = [document for document, kept in zip(self.documents, keep) if kept]
+        self.accession_documents = {accession: new_ids[docs].tolist()
+                                    for accession, docs in self.accession_documents.items()}
+        self._removed = []
+
+    def commit(self) -> None:
+        """merges the documents added since the last commit into the postings"""
+        for term, docs in self._pending.items():
+            new = numpy.array(docs, dtype=numpy.int32)
+            self.postings[term] = numpy.concatenate((self.postings[term], new)) if term in self.postings else new
+        self._pending = {}
+        if self._removed:
+            self._compact()
+        self.terms = sorted(self.postings)
+
+    def _term(self, term: str) -> numpy.ndarray:
+        if term.endswith('*'):
+            prefix = term[:-1]
+            first = bisect.bisect_left(self.terms, prefix)
+            last = bisect.bisect_left(self.terms, prefix + '\uffff')
+            if first == last:
+                return numpy.zeros(0, dtype=numpy.int32)
+            # a mask over all documents is cheaper than sorting the union of many postings
+            mask = numpy.zeros(len(self.documents), dtype=bool)
+            for t in self.terms[first:last]:
+                mask[self.postings[t]] = True
+            return numpy.flatnonzero(mask).astype(numpy.int32)
+        return self.postings.get(term, numpy.zeros(0, dtype=numpy.int32))
+
+    def _conjunction(self, words: List[str]) -> numpy.ndarray:
+        included, excluded = [], []
+        negate = False
+        for word in words:
+            if word == 'NOT':
+                negate = True
+                continue
+            if word.startswith('-'):
+                negate, word = True, word[1:]
+            prefix = word.endswith('*')
+            terms = tokenize(word)
+            if terms:
+                # words like 'alpha-toxin' are split as the indexed text, and all pieces are required
+                for term in terms[:-1]:
+                    (excluded if negate else included).append(self._term(term))
+                (excluded if negate else included).append(self._term(terms[-1] + ('*' if prefix else '')))
+            negate = False
+        if not included:
+            return numpy.zeros(0, dtype=numpy.int32)
+        included.sort(key=len)
+        result = included[0]
+        for docs in included[1:]:
+            result = numpy.intersect1d(result, docs, assume_unique=True)
+        for docs in excluded:
+            result = numpy.setdiff1d(result, docs, assume_unique=True)
+        return result
+
+    def query(self, text: str) -> numpy.ndarray:
+        """ids of the documents matching text"""
+        if self._pending or self._removed:
+            self.commit()
+        alternatives = [a.split() for a in re.split(r'\s+OR\s+', text.strip()) if a.strip()]
+        result = numpy.zeros(0, dtype=numpy.int32)
+        for words in alternatives:
+            result = numpy.union1d(result, self._conjunction(words))
+        return result
+
+    def search(self, text: str) -> pandas.DataFrame:
+        hits = [self.documents[doc] for doc in self.query(text)]
+        return pandas.DataFrame(hits, columns=('Table', 'Uniprot', 'Row', 'Text'))
+
+    def save(self, directory: str) -> None:
+        if self._pending or self._removed:
+            self.commit()
+        path = os.path.join(directory, INDEX_FILE)
+        with open(path + '.part', 'wb') as index_file:
+            pickle.dump(self, index_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.part', path)
+
+    @staticmethod
+    def load(directory: str) -> Optional['SearchIndex']:
+        path = os.path.join(directory, INDEX_FILE)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as index_file:
+            return pickle.load(index_file)
+
+
+def _collect(cells: Dict[str, List[Tuple[str, int, str]]], table: str, df: pandas.DataFrame,
+             columns: Iterable[str]) -> None:
+    for column in columns:
+        for row, (accession, text) in enumerate(zip(df['Uniprot'], df[column])):
+            if isinstance(text, list):
+                text = ' '.join(str(t) for t in text)
+            if isinstance(text, str) and text:
+                cells.setdefault(accession, []).append((table, row, text))
+
+
+def build_index(proteins, tables, index: Optional[SearchIndex] = None) -> Tuple[SearchIndex, int]:
+    """
+    the index of the text of the tables, updating index (the one of the previous build) if given.
+    Returns the index and the number of accessions (re)indexed.
+    """
+    # indexes saved before update() existed have no fingerprints: they are built again
+    if index is None or (index.documents and not index.fingerprints):
+        index = SearchIndex()
+    names = pandas.DataFrame([(p.accession, p.name, p.organism) for p in proteins.values()],
+                             columns=('Uniprot', 'Name', 'Organism'))
+    cells: Dict[str, List[Tuple[str, int, str]]] = {}
+    _collect(cells, 'proteins', names, ('Name', 'Organism'))
+    _collect(cells, 'comments', tables.comments, ('Text',))
+    _collect(cells, 'citations', tables.citations, ('Title',))
+    _collect(cells, 'cit_scopes', tables.cit_scopes, ('Title', 'Scope'))
+    return index, index.update(cells)
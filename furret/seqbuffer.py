@@ -0,0 +1,72 @@
+import os
+from typing import List, Sequence
+
+import numpy
+
+from furret.encoding import encode, sequence_ids
+from furret.manifest import fingerprint
+
+BUFFER_DIR = 'SequenceBuffer'
+ARRAYS = ('residues', 'codes', 'offsets', 'ids')
+
+
+class SequenceBuffer:
+    """
+    All the sequences of a query in <query>/SequenceBuffer as .npy files opened as read only memory maps:
+    residues (ASCII) and codes (furret.encoding) concatenated, offsets (sequence i is [offsets[i]:offsets[i + 1]])
+    and ids (the sequence of every position). Process pool workers attach to it by path: the pages are shared
+    through the OS page cache, nothing is pickled or copied per worker.
+    """
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        for name in ARRAYS:
+            setattr(self, name, numpy.load(os.path.join(directory, name + '.npy'), mmap_mode='r'))
+        with open(os.path.join(directory, 'labels.txt'), 'rt') as labels_file:
+            self.labels: List[str] = labels_file.read().split('\n')[:-1]
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+    def sequence(self, i: int) -> str:
+        return self.residues[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('ascii')
+
+    @staticmethod
+    def _key_file(directory: str) -> str:
+        return os.path.join(directory, 'key.txt')
+
+    @classmethod
+    def build(cls, directory: str, labels: Sequence[str], sequences: Sequence[str]) -> 'SequenceBuffer':
+        """
+        writes the buffer unless the one in directory holds the same sequences, then attaches to it.
+        The key file is written last: a buffer without it is incomplete and is written again.
+        """
+        key = fingerprint(list(labels), list(sequences))
+        key_file = cls._key_file(directory)
+        if os.path.isfile(key_file):
+            with open(key_file, 'rt') as the_file:
+                if the_file.read() == key:
+                    return cls(directory)
+            os.remove(key_file)
+        os.makedirs(directory, exist_ok=True)
+        codes, offsets = encode(sequences)
+        arrays = {'residues': numpy.frombuffer(''.join(sequences).encode('ascii', 'replace'), dtype=numpy.uint8),
+                  'codes': codes,
+                  'offsets': offsets,
+                  'ids': sequence_ids(offsets).astype(numpy.int32)}
+        for name in ARRAYS:
+            path = os.path.join(directory, name + '.npy')
+            with open(path + '.part', 'wb') as the_file:
+                numpy.save(the_file, arrays[name])
+            os.replace(path + '.part', path)
+        with open(os.path.join(directory, 'labels.txt'), 'wt') as labels_file:
+            labels_file.write(''.join(label + '\n' for label in labels))
+        with open(key_file, 'wt') as the_file:
+            the_file.write(key)
+        return cls(directory)
+
+    @classmethod
+    def for_query(cls, querydir: str, proteins) -> 'SequenceBuffer':
+        """the buffer of the proteins of a query ({accession: Protein}), built once"""
+        labels = list(proteins)
+        return cls.build(os.path.join(querydir, BUFFER_DIR), labels, [proteins[label].sequence for label in labels])
@@ -1,19 +1,54 @@
+import gzip
 import os
-import shutil
-import tempfile
 import re
-import requests
-from typing import Optional, List, Dict
+import shutil
+from typing import Optional, List, Dict, TextIO
 
 import numpy
 
-# noinspection PyPackageRequirements
-from Bio.PDB import PDBList
 from furret.chains import ChainGroups
 from furret.utilities import Citation
 
+STRUCTURE_EXTENSIONS = ('.pdb.gz', '.cif.gz', '.pdb', '.cif', '.ent')
+
+
+def is_structure_file(file_name: str) -> bool:
+    return file_name.lower().endswith(STRUCTURE_EXTENSIONS)
+
+
+def open_structure(file_name: str) -> TextIO:
+    """opens a (possibly gzipped) structure file for streaming text reading"""
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, 'rt')
+    return open(file_name, 'rt')
+
+
+def write_structure(file_name: str, text: str) -> str:
+    """writes text gzipped in file_name.gz and returns the name of the written file"""
+    if not file_name.endswith('.gz'):
+        file_name += '.gz'
+    partial = file_name + '.part'
+    with gzip.open(partial, 'wt') as the_file:
+        the_file.write(text)
+    os.replace(partial, file_name)
+    return file_name
+
+
+def materialize(file_name: str, directory: str) -> str:
+    """copies a structure file into directory, uncompressing it if needed"""
+    base_name = os.path.basename(file_name)
+    if not base_name.endswith('.gz'):
+        shutil.copy2(file_name, directory)
+        return os.path.join(directory, base_name)
+    destination = os.path.join(directory, base_name[:-3])
+    with gzip.open(file_name, 'rb') as source, open(destination, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    return destination
+
 
 class Structure:
+    file: Optional[str] = None  # class level default for queries pickled before structures were compressed
+
     def __init__(self, uniprot: str,
                  sequence: Optional[str] = None,
                  the_chains: Optional[ChainGroups] = None) -> None:
@@ -41,17 +76,9 @@ class Structure:
 
 
 class PDB(Structure):
-    pdb_lister = PDBList()
-
-    # fucking stupid people think that you may need an empty random directory to pollute your hierarchy
-    shutil.rmtree(pdb_lister.obsolete_pdb, ignore_errors=True)
-    # prevent a bunch of unwandted prints
-    pdb_lister._verbose = False
-
-    tmp_dir = os.path.join(tempfile.gettempdir(), '.{}'.format(hash(os.times())))
-    os.makedirs(tmp_dir)
-    if not os.path.exists(tmp_dir):
-        raise PermissionError(f'''Unable to create {tmp_dir} temporary directory''')
+    # large entries have no legacy PDB format, we fall back to mmCIF
+    download_urls = (('https://files.rcsb.org/download/{}.pdb.gz', '.pdb.gz'),
+                     ('https://files.rcsb.org/download/{}.cif.gz', '.cif.gz'))
 
     def __init__(self, uniprot: str,
                  sequence: Optional[str] = None,
@@ -68,7 +95,6 @@ class PDB(Structure):
         else:
             self.coverage = 0.0
 
-    # @timeout_retries(60, 5)
     def retrieve_file(self, directory: Optional[str] = None) -> bool:
         if not self.code:
             return False
@@ -78,23 +104,14 @@ class PDB(Structure):
             os.makedirs(directory, exist_ok=True)
         if not os.access(directory, os.W_OK):
             raise PermissionError(f'''Can't write in {directory}''')
-        file_retrieved = os.path.join(PDB.tmp_dir, 'pdb' + self.code + '.ent')
-        file_name = os.path.join(directory, self.code + '.pdb')
-        attempt = 0
-        while attempt < 10:
-            # noinspection PyBroadException
-            try:
-                PDB.pdb_lister.retrieve_pdb_file(self.code, file_format='pdb', pdir=PDB.tmp_dir)
-                break
-            except:
-                attempt += 1
-                if attempt == 10:
-                    raise ConnectionAbortedError
-        if os.path.exists(file_retrieved):
-            shutil.move(file_retrieved, file_name)
-            self.downloaded = True
-        else:
-            return False
+        import furret.network as network  # not at import time: worker processes only read structures
+        for url, extension in PDB.download_urls:
+            file_name = os.path.join(directory, self.code + extension)
+            if network.download(url.format(self.code), file_name):
+                self.file = file_name
+                self.downloaded = True
+                return True
+        return False
 
 
 # class PDBsm(PDB):
@@ -140,20 +157,10 @@ class Model(Structure):  # single structure within a uniprot accession
             raise PermissionError(f'''Can't write in {directory}''')
         template = '_' + self.template if self.template else ''
 
-        attempt = 0
-        response = None
-        while attempt < 10:
-            # noinspection PyBroadException
-            try:
-                response = requests.get(self.request)
-                if response:
-                    break
-            except:
-                attempt += 1
-                if attempt == 10:
-                    raise ConnectionAbortedError
+        import furret.network as network
+        response = network.get(self.request)
+        if not response.ok:
+            return None
         file_name = os.path.join(directory, self.uniprot + template + '.pdb')
-        with open(file_name, 'w') as the_model:
-            the_model.write(response.text)
-
+        self.file = write_structure(file_name, response.text)
         self.downloaded = True
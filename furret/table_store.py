@@ -0,0 +1,147 @@
+import os
+import re
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+import numpy
+import pandas
+
+STORE_FILE = 'tables.sqlite'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS catalog (name TEXT PRIMARY KEY, sql_table TEXT, position INTEGER, rows INTEGER);
+CREATE TABLE IF NOT EXISTS columns (name TEXT, position INTEGER, label TEXT);
+'''
+
+
+def _quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def _cells(df: pandas.DataFrame) -> List[tuple]:
+    # sqlite takes python scalars only: numpy scalars are unboxed, missing values become NULL, lists become text
+    frame = df.astype(object).where(df.notnull(), None)
+    for column in frame.columns:
+        if frame[column].map(lambda v: v is None or isinstance(v, (str, int, float))).all():
+            continue
+        frame[column] = frame[column].map(lambda v: v if v is None or isinstance(v, (str, int, float)) else str(v))
+    return list(frame.itertuples(index=False, name=None))
+
+
+class TableStore:
+    """
+    Per query store of the result tables in <query>/tables.sqlite, one sqlite table per DataFrame.
+    Readers (e.g. the table browser) get pages of rows, sorted and filtered by sqlite, without unpickling the Query.
+    """
+
+    def __init__(self, querydir: str) -> None:
+        self.path = os.path.join(querydir, STORE_FILE)
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def exists(querydir: str) -> bool:
+        return os.path.isfile(os.path.join(querydir, STORE_FILE))
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def write(self, name: str, df: pandas.DataFrame) -> None:
+        """(re)places table name with the content of df"""
+        sql_table = 't_' + re.sub(r'\W', '_', name.lower())
+        labels = [str(c) for c in df.columns]
+        with self.connection:
+            old = self.connection.execute('SELECT sql_table FROM catalog WHERE name = ?', (name,)).fetchone()
+            if old:
+                self.connection.execute(f'DROP TABLE IF EXISTS {_quote(old[0])}')
+            self.connection.execute(f'DROP TABLE IF EXISTS {_quote(sql_table)}')
+            self.connection.execute('DELETE FROM columns WHERE name = ?', (name,))
+            position = self.connection.execute('SELECT COALESCE(MAX(position), -1) + 1 FROM catalog').fetchone()[0]
+            if old:
+                position = self.connection.execute('SELECT position FROM catalog WHERE name = ?', (name,)).fetchone()[0]
+            # the columns are c0, c1... the labels (any text) are in the columns table
+            self.connection.execute(f'CREATE TABLE {_quote(sql_table)} '
+                                    f'({", ".join(f"c{i}" for i in range(len(labels)))})')
+            if labels:
+                marks = ', '.join('?' * len(labels))
+                self.connection.executemany(f'INSERT INTO {_quote(sql_table)} VALUES ({marks})', _cells(df))
+            self.connection.executemany('INSERT INTO columns VALUES (?, ?, ?)',
+                                        [(name, i, label) for i, label in enumerate(labels)])
+            self.connection.execute('INSERT OR REPLACE INTO catalog VALUES (?, ?, ?, ?)',
+                                    (name, sql_table, position, len(df)))
+
+    def names(self) -> List[str]:
+        return [name for name, in self.connection.execute('SELECT name FROM catalog ORDER BY position')]
+
+    def columns(self, name: str) -> List[str]:
+        return [label for label, in self.connection.execute('SELECT label FROM columns WHERE name = ? '
+                                                            'ORDER BY position', (name,))]
+
+    def size(self, name: str) -> int:
+        row = self.connection.execute('SELECT rows FROM catalog WHERE name = ?', (name,)).fetchone()
+        return row[0] if row else 0
+
+    def _sql_table(self, name: str) -> str:
+        row = self.connection.execute('SELECT sql_table FROM catalog WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            raise KeyError(f'''No table {name} in {self.path}''')
+        return _quote(row[0])
+
+    def row_ids(self, name: str, text: str = '', order_by: Optional[int] = None,
+                descending: bool = False) -> numpy.ndarray:
+        """
+        rowids of the rows of name containing text (in any column, case insensitive), sorted by column order_by.
+        Only the ids are kept in memory, the rows are read a page at a time with rows().
+        """
+        where, values = '', []
+        if text:
+            n_columns = len(self.columns(name))
+            where = ' WHERE ' + ' OR '.join(f"c{i} LIKE ? ESCAPE '\\'" for i in range(n_columns))
+            pattern = '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            values = [pattern] * n_columns
+        order = f' ORDER BY c{order_by} {"DESC" if descending else "ASC"}, rowid' if order_by is not None else \
+            ' ORDER BY rowid'
+        cursor = self.connection.execute(f'SELECT rowid FROM {self._sql_table(name)}{where}{order}', values)
+        return numpy.fromiter((rowid for rowid, in cursor), dtype=numpy.int64)
+
+    def rows(self, name: str, ids: Sequence[int]) -> List[Tuple]:
+        """the rows with the given rowids, in the same order"""
+        ids = [int(i) for i in ids]
+        found = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            marks = ','.join('?' * len(chunk))
+            for row in self.connection.execute(f'SELECT rowid, * FROM {self._sql_table(name)} '
+                                               f'WHERE rowid IN ({marks})', chunk):
+                found[row[0]] = row[1:]
+        return [found[i] for i in ids if i in found]
+
+    def frame(self, name: str) -> pandas.DataFrame:
+        return pandas.DataFrame(self.rows(name, self.row_ids(name)), columns=self.columns(name))
+
+
+def store_tables(the_tables, querydir: str) -> TableStore:
+    """writes every result table of a query in its table store"""
+    store = TableStore(querydir)
+    tables = [('Sequences', the_tables.sequences),
+              ('PDB', the_tables.pdb),
+              ('Swiss Models', the_tables.sm),
+              ('Databases', the_tables.db),
+              ('Keywords', the_tables.keywords),
+              ('GO Function', the_tables.go.molecular_function),
+              ('GO Process', the_tables.go.biological_process),
+              ('GO Component', the_tables.go.cellular_component),
+              ('Citations', the_tables.citations),
+              ('Citation Scopes', the_tables.cit_scopes),
+              ('Comments', the_tables.comments),
+              ('Organisms', the_tables.organisms)]
+    for attribute, name in (('enrichment', 'Enrichment'), ('motif_hits', 'Motif Hits')):
+        if getattr(the_tables, attribute, None) is not None:
+            tables.append((name, getattr(the_tables, attribute)))
+    if getattr(the_tables, 'go_propagated', None) is not None:
+        tables += [('GO Function (Propagated Counts)', the_tables.go_propagated.molecular_function),
+                   ('GO Process (Propagated Counts)', the_tables.go_propagated.biological_process),
+                   ('GO Component (Propagated Counts)', the_tables.go_propagated.cellular_component)]
+    for name, df in tables:
+        store.write(name, df)
+    return store
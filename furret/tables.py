@@ -1,12 +1,134 @@
 import os
+import numpy
 import pandas
+import xlsxwriter
+import furret.trace as trace
 from furret.utilities import Gos
+from furret.enrichment import enrichment
+from furret.physchem import profile
+from furret.rcsb import metadata_columns
 from furret.protein import Protein
-from typing import Dict, Optional
-
-
-def process_keywords(protein_dict: Dict[str, Protein], output_dir: str, output_file: Optional[str] = 'keywords.xlsx')\
-        -> pandas.DataFrame:
+from furret.manifest import Manifest, fingerprint, replace_path
+from typing import Dict, Optional, List, Tuple
+
+
+MAX_ROWS = 1048576  # rows of an Excel worksheet, header included
+CHUNK = 4096  # rows converted to python values at once
+
+
+def _cell(value):
+    """value as pandas.DataFrame.to_excel writes it, None for an empty cell"""
+    if value is None:
+        return None
+    if isinstance(value, (float, numpy.floating)):
+        if numpy.isnan(value):
+            return None
+        # Excel has no infinities, pandas writes them as text
+        return float(value) if numpy.isfinite(value) else ('inf' if value > 0 else '-inf')
+    if isinstance(value, (bool, numpy.bool_)):
+        return bool(value)
+    if isinstance(value, (int, numpy.integer)):
+        return int(value)
+    if isinstance(value, str):
+        return value
+    if value is pandas.NaT:
+        return None
+    return str(value)
+
+
+def _sheet_names(name: str, parts: int) -> List[str]:
+    """name, then 'name (2)', 'name (3)'... for the parts of a sheet too long for Excel (31 characters at most)"""
+    names = [name]
+    for part in range(2, parts + 1):
+        suffix = f' ({part})'
+        names.append(name[:31 - len(suffix)] + suffix)
+    return names
+
+
+def _column_writer(worksheet, values: numpy.ndarray, cell_format):
+    """write(row, column, value) for the values of one column, chosen once from its dtype"""
+    kind = values.dtype.kind
+    if kind == 'f':
+        def write(i, j, value):
+            if value != value:  # NaN
+                return
+            if abs(value) == numpy.inf:
+                worksheet.write_string(i, j, 'inf' if value > 0 else '-inf', cell_format)
+            else:
+                worksheet.write_number(i, j, value, cell_format)
+        return write
+    if kind in 'iu':
+        return lambda i, j, value: worksheet.write_number(i, j, value, cell_format)
+    if kind == 'b':
+        return lambda i, j, value: worksheet.write_boolean(i, j, value, cell_format)
+
+    def write(i, j, value):
+        value = _cell(value)
+        if value is not None:
+            worksheet.write(i, j, value, cell_format)
+    return write
+
+
+def _write_sheets(workbook, name: str, frame, index: bool, header_format) -> int:
+    """streams the rows of frame (a DataFrame or a Series) from its column arrays, returns the number of sheets"""
+    if isinstance(frame, pandas.Series):
+        headers = [frame.name if frame.name is not None else 0]
+        columns = [frame.values]
+    else:
+        headers = list(frame.columns)
+        columns = [frame.iloc[:, i].values for i in range(frame.shape[1])]
+    index_columns = []
+    if index:
+        index_columns = [frame.index.get_level_values(level).values for level in range(frame.index.nlevels)]
+        headers = [n if n is not None else '' for n in frame.index.names] + headers
+    # index values are written bold and with a border, like the headers
+    formats = [header_format] * len(index_columns) + [None] * len(columns)
+    # extension arrays (categoricals...) as plain numpy arrays
+    columns = [numpy.asarray(values) for values in index_columns + columns]
+    per_sheet = MAX_ROWS - 1
+    parts = max(1, -(-len(frame) // per_sheet))
+    for part, sheet_name in enumerate(_sheet_names(name, parts)):
+        worksheet = workbook.add_worksheet(sheet_name)
+        for j, header in enumerate(headers):
+            worksheet.write(0, j, _cell(header), header_format)
+        writers = [_column_writer(worksheet, values, f) for values, f in zip(columns, formats)]
+        end = min(len(frame), (part + 1) * per_sheet)
+        # rows in order (constant memory mode flushes each row when the next one starts), CHUNK at a time
+        for start in range(part * per_sheet, end, CHUNK):
+            stop = min(start + CHUNK, end)
+            chunk = [values[start:stop].tolist() for values in columns]
+            for i, row in enumerate(zip(*chunk), start - part * per_sheet + 1):
+                for j, value in enumerate(row):
+                    writers[j](i, j, value)
+    return parts
+
+
+def write_workbook(path: str, sheets: List[Tuple[str, pandas.DataFrame, bool]],
+                   manifest: Optional[Manifest] = None) -> bool:
+    """
+    writes the (sheet name, frame, index) sheets in the workbook path, atomically.
+    Rows are streamed in xlsxwriter constant memory mode, sheets longer than Excel allows are split in parts.
+    With a manifest the workbook is left untouched when its content did not change, returns True if written.
+    """
+    key = fingerprint(*(part for sheet in sheets for part in sheet))
+    if manifest is not None and manifest.is_current(path, key):
+        trace.count('workbooks unchanged')
+        return False
+    partial = replace_path(path)
+    workbook = xlsxwriter.Workbook(partial, {'constant_memory': True})
+    header_format = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    for name, frame, index in sheets:
+        _write_sheets(workbook, name, frame, index, header_format)
+    workbook.close()
+    os.replace(partial, path)
+    if manifest is not None:
+        manifest.record(path, key)
+    trace.count('workbooks written')
+    return True
+
+
+def process_keywords(protein_dict: Dict[str, Protein], output_dir: str, output_file: Optional[str] = 'keywords.xlsx',
+                     manifest: Optional[Manifest] = None) -> pandas.DataFrame:
 
     keywords = []
     for i, p in protein_dict.items():
@@ -25,20 +147,17 @@ def process_keywords(protein_dict: Dict[str, Protein], output_dir: str, output_f
         dd = df.loc[df['Category'] == name]
         counts.append(dd['Keyword'].value_counts())
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-    df.to_excel(writer, sheet_name='Keywords (All)', index=False)
-    df_count.to_excel(writer, sheet_name='Keywords (All Counts)')
+    sheets = [('Keywords (All)', df, False),
+              ('Keywords (All Counts)', df_count, True)]
 
     for name, count in zip(names, counts):
-        count.to_excel(writer, sheet_name=name)
+        sheets.append((name, count, True))
 
-    writer.save()
-
-    print(f'''File {output_file} written''')
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
     return df
 
 
-def process_go(protein_dict, output_dir, output_file='go.xlsx'):
+def process_go(protein_dict, output_dir, output_file='go.xlsx', manifest=None):
     molecular_function = []
     cellular_component = []
     biological_process = []
@@ -63,21 +182,18 @@ def process_go(protein_dict, output_dir, output_file='go.xlsx'):
     cc_counts = cc['GO'].value_counts()
     bp_counts = bp['GO'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-
-    mf.to_excel(writer, sheet_name='Molecular Function (All)', index=False)
-    mf_counts.to_excel(writer, sheet_name='Molecular Function (Counts)')
-    bp.to_excel(writer, sheet_name='Biological Process (All)', index=False)
-    bp_counts.to_excel(writer, sheet_name='Biological Process (Counts)')
-    cc.to_excel(writer, sheet_name='Cellular Component (All)', index=False)
-    cc_counts.to_excel(writer, sheet_name='Cellular Component (Counts)')
+    sheets = [('Molecular Function (All)', mf, False),
+              ('Molecular Function (Counts)', mf_counts, True),
+              ('Biological Process (All)', bp, False),
+              ('Biological Process (Counts)', bp_counts, True),
+              ('Cellular Component (All)', cc, False),
+              ('Cellular Component (Counts)', cc_counts, True)]
 
-    writer.save()
-    print('Done with GO')
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
     return Gos(mf, bp, cc)
 
 
-def process_links(protein_dict, output_dir, output_file='databases.xlsx'):
+def process_links(protein_dict, output_dir, output_file='databases.xlsx', manifest=None):
 
     links = []
     for i, p in protein_dict.items():
@@ -104,18 +220,17 @@ def process_links(protein_dict, output_dir, output_file='databases.xlsx'):
 
         dbs.append(dd)
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-    df.to_excel(writer, sheet_name='Databases (All)', index=False)
-    df_count.to_excel(writer, sheet_name='Databases (All Counts)')
+    sheets = [('Databases (All)', df, False),
+              ('Databases (All Counts)', df_count, True)]
 
     for name, count, db in zip(names, counts, dbs):
-        count.to_excel(writer, sheet_name=name)
+        sheets.append((name, count, True))
 
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
     return df
 
 
-def process_sequences(protein_dict, output_dir, output_file='sequences.xlsx'):
+def process_sequences(protein_dict, output_dir, output_file='sequences.xlsx', manifest=None):
     sequences = []
     for p in protein_dict.values():
         the_structure = ''
@@ -129,6 +244,9 @@ def process_sequences(protein_dict, output_dir, output_file='sequences.xlsx'):
     cols = ("Uniprot", "Fragment", "Precursor", "Structure", "Length", "Crystal Coverage", "Best PDB", "Sequence")
 
     se = pandas.DataFrame(sequences, columns=cols)
+    # physicochemical profile, before the sequence column
+    profiles = profile(list(se['Sequence']))
+    se = pandas.concat([se.drop(columns='Sequence'), profiles, se[['Sequence']]], axis=1)
     se['Length_by_10'] = 10 * (pandas.to_numeric(se['Length'], errors='coerce') // 10 + 1)
     len_counts = se['Length_by_10'].value_counts().sort_index()
     se = se.drop(['Length_by_10'], axis=1)
@@ -136,19 +254,17 @@ def process_sequences(protein_dict, output_dir, output_file='sequences.xlsx'):
     pr_counts = se['Precursor'].value_counts()
     fr_counts = se['Fragment'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
+    sheets = [('Sequences (All)', se, False),
+              ('Precursor (Counts)', pr_counts, True),
+              ('Fragment (Counts)', fr_counts, True),
+              ('Lenght by 10 res', len_counts, True)]
 
-    se.to_excel(writer, sheet_name='Sequences (All)', index=False)
-    pr_counts.to_excel(writer, sheet_name='Precursor (Counts)')
-    fr_counts.to_excel(writer, sheet_name='Fragment (Counts)')
-    len_counts.to_excel(writer, sheet_name='Lenght by 10 res')
-
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return se
 
 
-def process_pdb(protein_dict, output_dir, output_file='pdb.xlsx'):
+def process_pdb(protein_dict, output_dir, output_file='pdb.xlsx', manifest=None, metadata=None):
     structures = []
     for p in protein_dict.values():
         for s in p.experimental_structures:
@@ -156,23 +272,25 @@ def process_pdb(protein_dict, output_dir, output_file='pdb.xlsx'):
     cols = ('Uniprot', 'PDB', 'Method', 'Resolution', "Coverage")
     # noinspection DuplicatedCode
     dframe = pandas.DataFrame(structures, columns=cols)
+    if metadata is not None:
+        # RCSB entry metadata (furret.rcsb.fetch_metadata)
+        for column, values in metadata_columns(dframe['PDB'], metadata).items():
+            dframe[column] = values
     uniprot_counts = dframe['Uniprot'].value_counts()
     pdb_counts = dframe['PDB'].value_counts()
     method_counts = dframe['Method'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-
-    dframe.to_excel(writer, sheet_name='PDB (All)', index=False)
-    uniprot_counts.to_excel(writer, sheet_name='Uniprot (Counts)')
-    pdb_counts.to_excel(writer, sheet_name='PDB (Counts)')
-    method_counts.to_excel(writer, sheet_name='Method (Counts)')
+    sheets = [('PDB (All)', dframe, False),
+              ('Uniprot (Counts)', uniprot_counts, True),
+              ('PDB (Counts)', pdb_counts, True),
+              ('Method (Counts)', method_counts, True)]
 
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return dframe
 
 
-def process_sm(protein_dict, output_dir, output_file='swiss_models.xlsx'):
+def process_sm(protein_dict, output_dir, output_file='swiss_models.xlsx', manifest=None):
     models = []
     for p in protein_dict.values():
         for m in p.models:
@@ -184,21 +302,19 @@ def process_sm(protein_dict, output_dir, output_file='swiss_models.xlsx'):
     df = pandas.DataFrame(models, columns=cols)
     uniprot_counts = df['Uniprot'].value_counts()
     templete_counts = df['Template'].value_counts()
-    method_counts = df['Method'].value_counts()
-
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
+    oligo_counts = df['Oligo'].value_counts()
 
-    df.to_excel(writer, sheet_name='Swiss Models (All)', index=False)
-    uniprot_counts.to_excel(writer, sheet_name='Uniprot (Counts)')
-    templete_counts.to_excel(writer, sheet_name='Template (Counts)')
-    method_counts.to_excel(writer, sheet_name='Method (Counts)')
+    sheets = [('Swiss Models (All)', df, False),
+              ('Uniprot (Counts)', uniprot_counts, True),
+              ('Template (Counts)', templete_counts, True),
+              ('Oligo (Counts)', oligo_counts, True)]
 
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return df
 
 
-def process_cit_scopes(protein_dict, output_dir, output_file='citation_scopes.xlsx'):
+def process_cit_scopes(protein_dict, output_dir, output_file='citation_scopes.xlsx', manifest=None):
     scopes = []
     for p in protein_dict.values():
         for c in p.citations:
@@ -207,20 +323,19 @@ def process_cit_scopes(protein_dict, output_dir, output_file='citation_scopes.xl
 
     df = pandas.DataFrame(scopes, columns=cols)
     uniprot_counts = df['Uniprot'].value_counts()
-    templete_counts = df['Scope'].value_counts()
+    # scopes are lists (unhashable): each scope of a citation is counted
+    templete_counts = df['Scope'].explode().value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
+    sheets = [('Scopes (All)', df, False),
+              ('Uniprot (Counts)', uniprot_counts, True),
+              ('Scope (Counts)', templete_counts, True)]
 
-    df.to_excel(writer, sheet_name='Scopes (All)', index=False)
-    uniprot_counts.to_excel(writer, sheet_name='Uniprot (Counts)')
-    templete_counts.to_excel(writer, sheet_name='Scope (Counts)')
-
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return df
 
 
-def process_citations(protein_dict, output_dir, output_file='citations.xlsx'):
+def process_citations(protein_dict, output_dir, output_file='citations.xlsx', abstracts=None, manifest=None):
     citations = []
     for p in protein_dict.values():
         for c in p.citations:
@@ -228,19 +343,22 @@ def process_citations(protein_dict, output_dir, output_file='citations.xlsx'):
     cols = ('Uniprot', 'Pubmed', 'DOI', 'Title')
 
     df = pandas.DataFrame(citations, columns=cols)
+    if abstracts is not None:
+        df['Abstract'] = [abstracts.get(str(pmid), ('', ''))[1] if pmid else '' for pmid in df['Pubmed']]
+        # uniprot gives no title for some citations, pubmed does
+        df['Title'] = [title if title else abstracts.get(str(pmid), ('', ''))[0] if pmid else title
+                       for title, pmid in zip(df['Title'], df['Pubmed'])]
     uniprot_counts = df['Uniprot'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-
-    df.to_excel(writer, sheet_name='Citations (All)', index=False)
-    uniprot_counts.to_excel(writer, sheet_name='Uniprot (Counts)')
+    sheets = [('Citations (All)', df, False),
+              ('Uniprot (Counts)', uniprot_counts, True)]
 
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return df
 
 
-def process_comments(protein_dict, output_dir, output_file='comments.xlsx'):
+def process_comments(protein_dict, output_dir, output_file='comments.xlsx', manifest=None):
     comments = []
     for p in protein_dict.values():
         for c in p.comments:
@@ -251,17 +369,15 @@ def process_comments(protein_dict, output_dir, output_file='comments.xlsx'):
     uniprot_counts = df['Uniprot'].value_counts()
     type_counts = df['Type'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
-
-    df.to_excel(writer, sheet_name='Comments (All)', index=False)
-    uniprot_counts.to_excel(writer, sheet_name='Uniprot (Counts)')
-    type_counts.to_excel(writer, sheet_name='Type (Counts)')
-    writer.save()
+    sheets = [('Comments (All)', df, False),
+              ('Uniprot (Counts)', uniprot_counts, True),
+              ('Type (Counts)', type_counts, True)]
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return df
 
 
-def process_organisms(protein_dict, output_dir, output_file='organisms.xlsx'):
+def process_organisms(protein_dict, output_dir, output_file='organisms.xlsx', manifest=None):
     organisms = []
     for p in protein_dict.values():
         organisms.append((p.accession, p.organism))
@@ -269,17 +385,79 @@ def process_organisms(protein_dict, output_dir, output_file='organisms.xlsx'):
     df = pandas.DataFrame(organisms, columns=cols)
     orgnism_counts = df['Organism'].value_counts()
 
-    writer = pandas.ExcelWriter(os.path.join(output_dir, output_file), engine='xlsxwriter')
+    sheets = [('Organisms (All)', df, False),
+              ('Organism (Counts)', orgnism_counts, True)]
+
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
+
+    return df
+
+
+def process_motif_hits(hits, output_dir, output_file='motif_hits.xlsx', manifest=None):
+    uniprot_counts = hits['Uniprot'].value_counts()
+    family_counts = hits['Family'].value_counts()
+
+    sheets = [('Motif Hits (All)', hits, False),
+              ('Uniprot (Counts)', uniprot_counts, True),
+              ('Family (Counts)', family_counts, True)]
+
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
+
+    return hits
+
+
+def process_go_propagated(the_tables, ontology, output_dir, output_file='go_propagated.xlsx', manifest=None):
+    matrices = the_tables.matrices
+    matrices.go_mf_propagated = ontology.propagate(matrices.go_mf)
+    matrices.go_bp_propagated = ontology.propagate(matrices.go_bp)
+    matrices.go_cc_propagated = ontology.propagate(matrices.go_cc)
+
+    mf = matrices.go_mf_propagated.to_frame()
+    bp = matrices.go_bp_propagated.to_frame()
+    cc = matrices.go_cc_propagated.to_frame()
+    mf_counts = ontology.counts(matrices.go_mf_propagated)
+    bp_counts = ontology.counts(matrices.go_bp_propagated)
+    cc_counts = ontology.counts(matrices.go_cc_propagated)
+
+    sheets = [('Molecular Function (All)', mf, False),
+              ('Molecular Function (Counts)', mf_counts, False),
+              ('Biological Process (All)', bp, False),
+              ('Biological Process (Counts)', bp_counts, False),
+              ('Cellular Component (All)', cc, False),
+              ('Cellular Component (Counts)', cc_counts, False)]
+
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
+
+    return Gos(mf_counts, bp_counts, cc_counts)
+
+
+def process_enrichment(the_tables, output_dir, output_file='enrichment.xlsx', max_pvalue=0.05, manifest=None):
+    family_names = the_tables.db.assign(Family=the_tables.db['Database'] + ':' + the_tables.db['ID'])
+    family_names = family_names.drop_duplicates('Family').set_index('Family')
+    sources = (('GO Function', the_tables.matrices.go_mf, the_tables.go.molecular_function, 'GO'),
+               ('GO Process', the_tables.matrices.go_bp, the_tables.go.biological_process, 'GO'),
+               ('GO Component', the_tables.matrices.go_cc, the_tables.go.cellular_component, 'GO'),
+               ('Keywords', the_tables.matrices.keywords, the_tables.keywords, 'Keyword'))
+    frames = []
+    for source, matrix, table, name_column in sources:
+        df = enrichment(the_tables.matrices.families, matrix)
+        term_names = table.drop_duplicates('ID').set_index('ID')[name_column]
+        df.insert(0, 'Source', source)
+        df.insert(1, 'Database', family_names['Database'].reindex(df['Family']).values)
+        df.insert(3, 'Family Name', family_names['Value'].reindex(df['Family']).values)
+        df.insert(5, 'Term Name', term_names.reindex(df['Term']).values)
+        frames.append(df.sort_values('P-value'))
+    df = pandas.concat(frames, ignore_index=True)
 
-    df.to_excel(writer, sheet_name='Organisms (All)', index=False)
-    orgnism_counts.to_excel(writer, sheet_name='Organism (Counts)')
+    sheets = [(source, frame.loc[frame['P-value'] <= max_pvalue], False)
+              for source, frame in zip((s[0] for s in sources), frames)]
 
-    writer.save()
+    write_workbook(os.path.join(output_dir, output_file), sheets, manifest)
 
     return df
 
 
-def generate_families_equivalence_table(the_tables, table_dir, output_file='Pfam_identities.xlsx'):
+def generate_families_equivalence_table(the_tables, table_dir, output_file='Pfam_identities.xlsx', manifest=None):
     db_list = the_tables.db['Database'].unique()
     triples = []
     for db in db_list:
@@ -316,9 +494,9 @@ def generate_families_equivalence_table(the_tables, table_dir, output_file='Pfam
                     ignore.append(fam[1])
                 pfams[pf[1]].append((fam[0], fam[1]))
 
-    writer = pandas.ExcelWriter(os.path.join(table_dir, output_file), engine='xlsxwriter')
+    sheets = []
     for key, fams in pfams.items():
         cols = ("Database", "Family")
         df = pandas.DataFrame(fams, columns=cols)
-        df.to_excel(writer, sheet_name=key, index=False)
-    writer.save()
+        sheets.append((key, df, False))
+    write_workbook(os.path.join(table_dir, output_file), sheets, manifest)
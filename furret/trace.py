@@ -0,0 +1,261 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict, field
+from typing import Callable, Optional, List, Dict
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+TRACE_FILE = 'trace.jsonl'
+CHROME_TRACE_FILE = 'trace.chrome.json'
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+SAMPLE_INTERVAL = 0.02  # seconds between two RSS samples while stages are open
+
+
+def current_rss() -> int:
+    """resident set size of this process now, in bytes (0 where /proc is not available)"""
+    try:
+        with open('/proc/self/statm', 'rt') as statm:
+            return int(statm.read().split()[1]) * PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+def children_cpu() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+@dataclass
+class Stage:
+    session: str
+    name: str
+    depth: int
+    thread: int
+    start: float
+    pid: int = 0
+    wall: float = 0.0
+    cpu: float = 0.0  # of the thread running the stage
+    process_cpu: float = 0.0  # of all the threads, concurrent stages count each other's
+    cpu_children: float = 0.0
+    rss: int = 0  # at the end of the stage
+    rss_delta: int = 0  # end - start
+    stage_peak_rss: int = 0  # highest RSS sampled while the stage was open
+    items: int = 0
+    bytes: int = 0
+    args: Dict = field(default_factory=dict)  # counters of other modules, see register_counters
+
+
+class Tracer:
+    """
+    Collects per-stage wall time, CPU time, RSS (and its sampled peak), item counts and network bytes
+    for one action on a query and appends them to <directory>/trace.jsonl.
+    """
+
+    def __init__(self, directory: str, action: str) -> None:
+        self.directory = directory
+        self.session = f'{action} {time.strftime("%Y-%m-%dT%H:%M:%S")}'
+        self.stages: List[Stage] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # the stages open in any thread, whose peak RSS the sampler thread updates
+        self._open: List[Stage] = []
+        self._sampler: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(SAMPLE_INTERVAL):
+            rss = current_rss()
+            with self._lock:
+                for record in self._open:
+                    record.stage_peak_rss = max(record.stage_peak_rss, rss)
+
+    def close(self) -> None:
+        """stops the RSS sampler"""
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    def _stack(self) -> List[Stage]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    @contextmanager
+    def stage(self, name: str, items: int = 0):
+        stack = self._stack()
+        record = Stage(self.session, name, len(stack), threading.get_ident(), time.time(), os.getpid(), items=items)
+        wall0 = time.perf_counter()
+        cpu0 = time.thread_time()
+        process_cpu0 = time.process_time()
+        children0 = children_cpu()
+        rss0 = current_rss()
+        record.stage_peak_rss = rss0
+        stack.append(record)
+        with self._lock:
+            self._open.append(record)
+            if self._sampler is None and rss0:
+                self._sampler = threading.Thread(target=self._sample, name='trace RSS sampler', daemon=True)
+                self._sampler.start()
+        try:
+            yield record
+        finally:
+            stack.pop()
+            with self._lock:
+                self._open.remove(record)
+            record.wall = time.perf_counter() - wall0
+            record.cpu = time.thread_time() - cpu0
+            record.process_cpu = time.process_time() - process_cpu0
+            record.cpu_children = children_cpu() - children0
+            record.rss = current_rss()
+            record.rss_delta = record.rss - rss0
+            record.stage_peak_rss = max(record.stage_peak_rss, record.rss)
+            with self._lock:
+                self.stages.append(record)
+
+    def add_bytes(self, n: int) -> None:
+        # bytes are accounted to every open stage, so parents include their children
+        for record in self._stack():
+            record.bytes += n
+
+    def add_items(self, n: int = 1) -> None:
+        stack = self._stack()
+        if stack:
+            stack[-1].items += n
+
+    def count(self, name: str, n: int = 1) -> None:
+        stack = self._stack()
+        if stack:
+            args = stack[-1].args
+            args[name] = args.get(name, 0) + n
+
+    def save(self) -> None:
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            records = sorted(self.stages, key=lambda s: s.start)
+            self.stages = []
+        with open(os.path.join(self.directory, TRACE_FILE), 'at') as trace_file:
+            for record in records:
+                trace_file.write(json.dumps(asdict(record)) + '\n')
+        write_chrome_trace(self.directory)
+
+
+_active: Optional[Tracer] = None
+_counters: Dict[str, Callable[[], Dict[str, Dict[str, float]]]] = {}
+
+
+def register_counters(name: str, function: Callable[[], Dict[str, Dict[str, float]]]) -> None:
+    """
+    function returns cumulative counters as {key: {counter: value}} (e.g. the network metrics of every host):
+    each session records their increase in the args of its stage, under name
+    """
+    _counters[name] = function
+
+
+def _increase(before: Dict[str, Dict[str, float]], after: Dict[str, Dict[str, float]]) -> Dict[str, Dict]:
+    result = {}
+    for key, counters in after.items():
+        old = before.get(key, {})
+        delta = {counter: value - old.get(counter, 0) for counter, value in counters.items()}
+        if any(delta.values()):
+            result[key] = delta
+    return result
+
+
+@contextmanager
+def session(directory: str, action: str):
+    """
+    Opens a tracing session for an action on the query in directory.
+    If a session is already active the action is recorded as a stage of it.
+    """
+    global _active
+    if _active is not None:
+        with _active.stage(action) as record:
+            yield record
+        return
+    _active = Tracer(directory, action)
+    before = {name: function() for name, function in _counters.items()}
+    try:
+        with _active.stage(action) as record:
+            try:
+                yield record
+            finally:
+                for name, function in _counters.items():
+                    increase = _increase(before[name], function())
+                    if increase:
+                        record.args[name] = increase
+    finally:
+        tracer, _active = _active, None
+        tracer.close()
+        tracer.save()
+
+
+@contextmanager
+def stage(name: str, items: int = 0):
+    """times a stage of the active session, does nothing (but yielding a record) if tracing is off"""
+    if _active is None:
+        yield Stage('', name, 0, threading.get_ident(), time.time(), os.getpid(), items=items)
+        return
+    with _active.stage(name, items) as record:
+        yield record
+
+
+def add_bytes(n: int) -> None:
+    if _active is not None:
+        _active.add_bytes(n)
+
+
+def add_items(n: int = 1) -> None:
+    if _active is not None:
+        _active.add_items(n)
+
+
+def count(name: str, n: int = 1) -> None:
+    """adds n to the counter name in the args of the innermost stage (e.g. outputs left unchanged)"""
+    if _active is not None:
+        _active.count(name, n)
+
+
+def read_trace(directory: str) -> List[Dict]:
+    records = []
+    path = os.path.join(directory, TRACE_FILE)
+    if not os.path.isfile(path):
+        return records
+    with open(path, 'rt') as trace_file:
+        for line in trace_file:
+            line = line.strip()
+            if line:
+                records.append(json.loads(line))
+    return records
+
+
+def write_chrome_trace(directory: str) -> str:
+    """converts trace.jsonl into a timeline loadable in chrome://tracing or Perfetto"""
+    events = []
+    for record in read_trace(directory):
+        # records written by older versions miss some of the fields
+        args = {key: record[key] for key in ('cpu', 'process_cpu', 'cpu_children', 'rss', 'rss_delta',
+                                             'stage_peak_rss', 'items', 'bytes') if key in record}
+        args.update(record.get('args', {}))
+        events.append({'name': record['name'],
+                       'cat': record['session'],
+                       'ph': 'X',
+                       'ts': int(record['start'] * 1e6),
+                       'dur': int(record['wall'] * 1e6),
+                       # older records have no pid
+                       'pid': record.get('pid', 0),
+                       'tid': record['thread'],
+                       'args': args})
+    path = os.path.join(directory, CHROME_TRACE_FILE)
+    with open(path, 'wt') as chrome_file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, chrome_file)
+    return path
@@ -0,0 +1,142 @@
+import json
+import re
+from typing import Dict, Iterator, List
+
+import xmltodict
+
+import furret.network as network
+
+SEARCH_URL = 'https://rest.uniprot.org/uniprotkb/search'
+PAGE_SIZE = 500  # entries per page, the largest UniProt allows
+
+# elements Protein expects as lists even when an entry has only one
+FORCE_LIST = ('entry', 'accession', 'reference', 'dbReference', 'property', 'keyword', 'scope', 'name', 'comment')
+
+DATABASES = ('Gene3D', 'InterPro', 'Pfam', 'SUPFAM', 'PROSITE', 'PRINTS', 'SMART', 'TIGRFAMs', 'CDD', 'PANTHER',
+             'PIRSF')
+
+# only what Protein reads: no features, evidences, sequence annotations...
+FIELDS = ('accession', 'protein_name', 'organism_name', 'version', 'protein_existence', 'fragment', 'sequence',
+          'keyword', 'go', 'xref_pdb', 'lit_pubmed_id', 'lit_doi_id', 'cc_function', 'cc_subcellular_location',
+          'cc_tissue_specificity', 'cc_ptm', 'cc_toxic_dose', 'cc_similarity', 'cc_domain', 'cc_mass_spectrometry',
+          'cc_miscellaneous', 'cc_caution', 'cc_developmental_stage', 'cc_induction', 'cc_pharmaceutical',
+          'cc_disease', 'cc_subunit', 'cc_catalytic_activity', 'cc_cofactor', 'cc_activity_regulation',
+          'cc_pathway', 'cc_biotechnology', 'cc_allergen', 'cc_polymorphism', 'cc_sequence_caution',
+          'cc_alternative_products', 'cc_biophysicochemical_properties', 'cc_interaction', 'cc_rna_editing',
+          'cc_disruption_phenotype') + tuple('xref_' + database.lower() for database in DATABASES)
+
+# UniProt REST property keys -> XML property types
+PROPERTY_TYPES = {'GoTerm': 'term', 'GoEvidenceType': 'evidence', 'Method': 'method', 'Resolution': 'resolution',
+                  'Chains': 'chains', 'EntryName': 'entry name', 'MatchStatus': 'match status'}
+
+# comment types written differently in the XML
+COMMENT_TYPES = {'PTM': 'PTM', 'RNA EDITING': 'RNA editing'}
+
+_camel = re.compile(r'(?<=[a-z])(?=[A-Z])')
+
+
+def parse_xml(text: str) -> List[Dict]:
+    data = xmltodict.parse(text, force_list=FORCE_LIST)
+    return (data['uniprot'] or {}).get('entry', [])
+
+
+def pages(query: str, the_format: str = 'xml', size: int = PAGE_SIZE) -> Iterator[str]:
+    """
+    the entries of a query a page at a time (XML or JSON restricted to FIELDS), following the next links of the
+    UniProt REST search: pages can be parsed while the next ones are downloaded
+    """
+    params = {'query': query, 'format': the_format, 'size': size}
+    if the_format == 'json':
+        params['fields'] = ','.join(FIELDS)
+    url = SEARCH_URL
+    while url:
+        response = network.get(url, params=params, headers={'Accept-Encoding': 'gzip'})
+        response.raise_for_status()
+        yield response.text
+        # the next link carries all the parameters and the cursor
+        url = response.links.get('next', {}).get('url')
+        params = None
+
+
+def parse(text: str, the_format: str = 'xml') -> List[Dict]:
+    return parse_json(text) if the_format == 'json' else parse_xml(text)
+
+
+def _property_type(key: str) -> str:
+    return PROPERTY_TYPES.get(key, _camel.sub(' ', key).lower())
+
+
+def _cross_reference(reference: Dict) -> Dict:
+    # always a list, as Protein and Link read it: empty when the entry has no properties
+    properties = [{'@type': _property_type(p['key']), '@value': p['value']} for p in reference.get('properties', [])]
+    return {'@type': reference['database'], '@id': reference['id'], 'property': properties}
+
+
+def _comment(comment: Dict) -> Dict:
+    comment_type = comment['commentType']
+    result = {'@type': COMMENT_TYPES.get(comment_type, comment_type.lower())}
+    note = comment.get('note') or {}
+    # the note of a mass spectrometry comment is a plain string, the <text> of the XML
+    if isinstance(note, str):
+        result['text'] = note
+        return result
+    texts = comment.get('texts') or note.get('texts') or []
+    if texts:
+        result['text'] = ' '.join(t['value'] for t in texts)
+    return result
+
+
+def _reference(reference: Dict) -> Dict:
+    citation = reference.get('citation', {})
+    result_citation = {}
+    if 'title' in citation:
+        result_citation['title'] = citation['title']
+    cross_references = [{'@type': c['database'], '@id': c['id']} for c in citation.get('citationCrossReferences', [])]
+    if cross_references:
+        result_citation['dbReference'] = cross_references
+    result = {'citation': result_citation}
+    if reference.get('referencePositions'):
+        result['scope'] = list(reference['referencePositions'])
+    return result
+
+
+def _name(names: Dict) -> Dict:
+    return {'fullName': names['fullName']['value']}
+
+
+def json_entry(entry: Dict) -> Dict:
+    """a UniProt REST JSON entry in the shape xmltodict gives to the XML one, the one Protein reads"""
+    description = entry.get('proteinDescription', {})
+    protein = {}
+    if 'recommendedName' in description:
+        protein['recommendedName'] = _name(description['recommendedName'])
+    elif description.get('submissionNames'):
+        protein['submittedName'] = _name(description['submissionNames'][0])
+    organism = entry.get('organism', {})
+    names = [{'@type': 'scientific', '#text': organism['scientificName']}] if 'scientificName' in organism else []
+    if 'commonName' in organism:
+        names.append({'@type': 'common', '#text': organism['commonName']})
+    flag = description.get('flag', '')
+    sequence = {'#text': entry['sequence']['value']}
+    if 'Fragment' in flag:
+        sequence['@fragment'] = 'multiple' if 'Fragments' in flag else 'single'
+    if 'Precursor' in flag:
+        sequence['@precursor'] = 'true'
+    result = {'@version': str(entry.get('entryAudit', {}).get('entryVersion', '')),
+              'accession': [entry['primaryAccession']] + entry.get('secondaryAccessions', []),
+              'protein': protein,
+              'organism': {'name': names},
+              'reference': [_reference(r) for r in entry.get('references', [])],
+              'dbReference': [_cross_reference(r) for r in entry.get('uniProtKBCrossReferences', [])],
+              # '1: Evidence at protein level' in JSON, 'evidence at protein level' in XML
+              'proteinExistence': {'@type': re.sub(r'^\d+:\s*', '', entry.get('proteinExistence', '')).lower()},
+              'keyword': [{'@id': k['id'], '#text': k['name']} for k in entry.get('keywords', [])],
+              'sequence': sequence}
+    comments = [_comment(c) for c in entry.get('comments', [])]
+    if comments:
+        result['comment'] = comments
+    return result
+
+
+def parse_json(text: str) -> List[Dict]:
+    return [json_entry(entry) for entry in json.loads(text).get('results', [])]
@@ -1,25 +1,19 @@
-import multiprocessing.pool
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from dataclasses import dataclass
 import functools
-# noinspection PyPackageRequirements
-from Bio.Entrez import efetch, read
-import xmltodict
-import furret.config as config
-import pandas
 
-from typing import Optional
+from typing import Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import pandas
 
 
 def fetch_abstract(pmid):
-    handle = efetch(db='pubmed', id=pmid, retmode='xml')
-    xml_data = read(handle)
-    try:
-        article = xml_data['PubmedArticle'][0]['MedlineCitation']['Article']
-        abstract = article['Abstract']['AbstractText'][0]
-        title = article['ArticleTitle']
-        return abstract, title
-    except (IndexError, KeyError) as _:
+    from furret.pubmed import fetch_abstracts
+    title, abstract = fetch_abstracts([pmid]).get(str(pmid), ('', ''))
+    if not abstract:
         return None
+    return abstract, title
 
 
 def validate_string(s):
@@ -43,16 +37,23 @@ def seq2fasta(seq: str, label: str) -> str:
     return f'>{label}\n' + group_by(seq, 60)
 
 
+_timeout_executor = None
+
+
 def timeout_retries(max_timout, max_retries):
+    # network calls should rather go through furret.network, which handles deadlines and retries itself
     def timeout_decorator(function):
         @functools.wraps(function)
         def wrapper(*args, **kwargs):
-            pool = multiprocessing.pool.ThreadPool(processes=1)
-            async_results = pool.apply_async(function, args, kwargs)
+            global _timeout_executor
+            if _timeout_executor is None:
+                _timeout_executor = ThreadPoolExecutor(max_workers=4)
             for _ in range(max_retries):
+                future = _timeout_executor.submit(function, *args, **kwargs)
                 try:
-                    return async_results.get(max_timout)
+                    return future.result(max_timout)
                 except TimeoutError:
+                    future.cancel()
                     continue
             else:
                 raise TimeoutError(f'''No answer after {max_retries} retries  when calling {function}''')
@@ -76,9 +77,9 @@ class Obj:
 
 @dataclass
 class Gos:
-    molecular_function: pandas.DataFrame
-    biological_process: pandas.DataFrame
-    cellular_component: pandas.DataFrame
+    molecular_function: 'pandas.DataFrame'
+    biological_process: 'pandas.DataFrame'
+    cellular_component: 'pandas.DataFrame'
 
 
 class Link:
@@ -86,7 +87,8 @@ class Link:
         assert data and database
         self.database: str = database
         self.id: str = data['@id']
-        self.name: str = data['property'][0]['@value']
+        properties = data.get('property') or []
+        self.name: str = properties[0]['@value'] if properties else ''
 
 
 @dataclass
@@ -94,11 +96,8 @@ class PubMed:
     id: str
 
     def retrieve_abstract(self):
-        # noinspection PyUnresolvedReferences
-        answer = requests.get('https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id=' +
-                              f'{self.id}&tool=my_tool&email={config.entrez_email}&retmode=xml')
-        pm = xmltodict.parse(answer.text)
-        abstract = pm['PubmedArticleSet']['PubmedArticle']['MedlineCitation']['Article']['Abstract']['AbstractText']
+        from furret.pubmed import fetch_abstracts
+        _, abstract = fetch_abstracts([self.id]).get(str(self.id), ('', ''))
         return abstract
 
 
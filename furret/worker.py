@@ -0,0 +1,193 @@
+"""
+MEME worker: runs the jobs queued by gen_meme in <query>/Motives/queue.sqlite.
+
+    python -m furret.worker <query directory> [--processes N] [--meme /path/to/meme] [--wait]
+
+Any host that sees the query directory can run workers. A job is leased to one worker, which renews the
+lease while MEME runs. Jobs whose lease expires (the worker died or its host went down) are queued again.
+"""
+import argparse
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from multiprocessing import Process
+from typing import Dict, Iterable, Optional, Tuple
+
+from furret.meme import MemeJob, process_meme
+
+QUEUE_FILE = 'queue.sqlite'
+LEASE = 300.0  # seconds a job stays assigned to a worker without a heartbeat
+MAX_ATTEMPTS = 3  # a job whose lease expired this many times is marked as failed
+POLL = 2.0
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY, fasta_file TEXT, destination TEXT UNIQUE, executable TEXT,
+                                 state TEXT, worker TEXT, lease_until REAL, attempts INTEGER DEFAULT 0,
+                                 submitted REAL, finished REAL, error TEXT);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+'''
+
+
+class WorkQueue:
+    """
+    Durable queue of MemeJobs in <motivedir>/queue.sqlite, paths are stored relative to the query directory
+    so workers may see it mounted elsewhere. States: pending, running, done, failed.
+    """
+
+    def __init__(self, querydir: str) -> None:
+        self.querydir = querydir
+        motivedir = os.path.join(querydir, 'Motives')
+        os.makedirs(motivedir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(motivedir, QUEUE_FILE), timeout=60, isolation_level=None)
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE takes the write lock at once: two workers can't claim the same job
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def submit(self, jobs: Iterable[MemeJob]) -> int:
+        """queues the jobs (a job already queued for the same destination is queued again), returns their number"""
+        now = time.time()
+        rows = [(os.path.relpath(job.fasta_file, self.querydir),
+                 os.path.relpath(job.destination_directory, self.querydir), job.meme_executable, now) for job in jobs]
+        with self._transaction():
+            self.connection.executemany('DELETE FROM jobs WHERE destination = ?', [(row[1],) for row in rows])
+            self.connection.executemany("INSERT INTO jobs (fasta_file, destination, executable, state, submitted) "
+                                        "VALUES (?, ?, ?, 'pending', ?)", rows)
+        return len(rows)
+
+    def _requeue_expired(self, now: float) -> None:
+        self.connection.execute("UPDATE jobs SET state = 'failed', error = 'lease expired too many times' "
+                                "WHERE state = 'running' AND lease_until < ? AND attempts >= ?", (now, MAX_ATTEMPTS))
+        self.connection.execute("UPDATE jobs SET state = 'pending', worker = NULL "
+                                "WHERE state = 'running' AND lease_until < ?", (now,))
+
+    def claim(self, worker: str, lease: float = LEASE) -> Optional[Tuple[int, MemeJob]]:
+        now = time.time()
+        with self._transaction():
+            self._requeue_expired(now)
+            row = self.connection.execute("SELECT id, fasta_file, destination, executable FROM jobs "
+                                          "WHERE state = 'pending' ORDER BY id LIMIT 1").fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET state = 'running', worker = ?, lease_until = ?, "
+                                    "attempts = attempts + 1 WHERE id = ?", (worker, now + lease, row[0]))
+        job_id, fasta_file, destination, executable = row
+        return job_id, MemeJob(os.path.join(self.querydir, fasta_file), os.path.join(self.querydir, destination),
+                               executable)
+
+    def heartbeat(self, job_id: int, worker: str, lease: float = LEASE) -> bool:
+        """renews the lease, False if the job is not this worker's anymore"""
+        cursor = self.connection.execute("UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? "
+                                         "AND state = 'running'", (time.time() + lease, job_id, worker))
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: int, worker: str, error: str = '') -> None:
+        self.connection.execute("UPDATE jobs SET state = ?, finished = ?, error = ? WHERE id = ? AND worker = ?",
+                                ('failed' if error else 'done', time.time(), error or None, job_id, worker))
+
+    def counts(self) -> Dict[str, int]:
+        with self._transaction():
+            self._requeue_expired(time.time())
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        counts.update(dict(self.connection.execute('SELECT state, COUNT(*) FROM jobs GROUP BY state')))
+        return counts
+
+    def states(self) -> Dict[str, str]:
+        """{destination directory: state} of all the queued jobs"""
+        rows = self.connection.execute('SELECT destination, state FROM jobs')
+        return {os.path.normpath(os.path.join(self.querydir, destination)): state for destination, state in rows}
+
+
+def _heartbeat(querydir: str, job_id: int, worker: str, lease: float, stop: threading.Event) -> None:
+    # sqlite connections are per thread
+    queue = WorkQueue(querydir)
+    try:
+        while not stop.wait(lease / 3):
+            if not queue.heartbeat(job_id, worker, lease):
+                break
+    finally:
+        queue.close()
+
+
+def work(querydir: str, meme_executable: Optional[str] = None, lease: float = LEASE, wait: bool = False) -> int:
+    """runs queued jobs until the queue is drained (or forever with wait), returns the number of jobs run"""
+    worker = f'{socket.gethostname()}:{os.getpid()}'
+    queue = WorkQueue(querydir)
+    done = 0
+    try:
+        while True:
+            claimed = queue.claim(worker, lease)
+            if claimed is None:
+                counts = queue.counts()
+                if not wait and counts['pending'] == 0 and counts['running'] == 0:
+                    return done
+                # running jobs may still come back if their worker dies
+                time.sleep(POLL)
+                continue
+            job_id, job = claimed
+            if meme_executable:
+                job.meme_executable = meme_executable
+            stop = threading.Event()
+            beat = threading.Thread(target=_heartbeat, args=(querydir, job_id, worker, lease, stop), daemon=True)
+            beat.start()
+            error = ''
+            started = time.time()
+            try:
+                output = os.path.join(job.destination_directory, 'meme.txt')
+                if not process_meme(job):
+                    error = 'MEME failed'
+                # the meme.txt of an earlier run is not this run's result
+                elif not os.path.isfile(output) or os.path.getmtime(output) < started - 1:
+                    error = 'meme.txt not written'
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+            finally:
+                stop.set()
+                beat.join()
+            queue.finish(job_id, worker, error)
+            done += 1
+    finally:
+        queue.close()
+
+
+def start_workers(querydir: str, processes: int, meme_executable: Optional[str] = None,
+                  lease: float = LEASE, wait: bool = False):
+    workers = [Process(target=work, args=(querydir, meme_executable, lease, wait)) for _ in range(processes)]
+    for process in workers:
+        process.start()
+    return workers
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('querydir', help='query directory, as seen from this host')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(), help='worker processes (default: cores)')
+    parser.add_argument('--meme', default=None, help='MEME executable on this host (default: the queued one)')
+    parser.add_argument('--lease', type=float, default=LEASE, help='lease duration in seconds')
+    parser.add_argument('--wait', action='store_true', help="keep waiting for new jobs when the queue is empty")
+    args = parser.parse_args()
+    if not os.path.isdir(args.querydir):
+        parser.error(f'{args.querydir} is not a directory')
+    workers = start_workers(os.path.abspath(args.querydir), max(1, args.processes), args.meme, args.lease, args.wait)
+    for process in workers:
+        process.join()
+    return 0 if all(process.exitcode == 0 for process in workers) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,51 @@
+import numpy
+import pandas
+import pytest
+
+from furret.accessions import AccessionSpace, WHOLE_QUERY, combine, difference, intersection, link_families, union
+
+
+def _ids(*values):
+    return numpy.array(values, dtype=numpy.uint32)
+
+
+def test_set_algebra():
+    a, b, c = _ids(1, 3, 5, 7), _ids(3, 4, 5), _ids(5, 9)
+    assert union(a, b, c).tolist() == [1, 3, 4, 5, 7, 9]
+    assert intersection(a, b, c).tolist() == [5]
+    assert intersection(a, b).tolist() == [3, 5]
+    assert difference(a, b, c).tolist() == [1, 7]
+    assert difference(a).tolist() == a.tolist()
+    assert union().tolist() == intersection().tolist() == []
+    assert union(a).dtype == numpy.uint32
+    assert combine('Union', [a, b]).tolist() == [1, 3, 4, 5, 7]
+    assert combine('Intersection', [a, _ids()]).tolist() == []
+    assert combine('Difference', [b, a]).tolist() == [4]
+
+
+def test_ids_are_stable_and_sets_stored_by_query_name(tmp_path):
+    space = AccessionSpace(str(tmp_path / 'accessions.sqlite'))
+    first = space.id_map(['P1', 'P2'])
+    assert space.id_map(['P2', 'P3'])['P2'] == first['P2']
+    families = {('Pfam', 'PF1'): ['P1', 'P3', 'P1'], ('Pfam', 'PF2'): ['P4']}
+    assert space.index_query(str(tmp_path / 'query'), ['P1', 'P2', 'P3'], families) == 3
+    # the query goes by directory name, trailing separators included
+    assert space.is_indexed(str(tmp_path / 'elsewhere' / 'query') + '/')
+    assert not space.is_indexed(str(tmp_path / 'other'))
+    assert sorted(space.accessions(space.members('query'))) == ['P1', 'P2', 'P3']
+    assert sorted(space.accessions(space.members('query', ('Pfam', 'PF1')))) == ['P1', 'P3']
+    assert space.families('query') == [('Pfam', 'PF1', 2), ('Pfam', 'PF2', 1)]
+    with pytest.raises(KeyError):
+        space.members('query', ('Pfam', 'PF3'))
+    # indexing again replaces the old sets
+    space.index_query(str(tmp_path / 'query'), ['P4'])
+    assert space.families('query') == []
+    assert space.accessions(space.members('query', WHOLE_QUERY)) == ['P4']
+    space.close()
+
+
+def test_link_families():
+    links = pandas.DataFrame([('P1', 'Pfam', 'PF1'), ('P2', 'Pfam', 'PF1'), ('P1', 'Pfam', 'PF1'),
+                              ('P1', 'PROSITE', 'PS1')], columns=('Uniprot', 'Database', 'Value'))
+    assert link_families(links) == {('Pfam', 'PF1'): ['P1', 'P2'], ('PROSITE', 'PS1'): ['P1']}
+    assert link_families(links.iloc[:0]) == {}
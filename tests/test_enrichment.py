@@ -0,0 +1,58 @@
+from fractions import Fraction
+from math import comb
+
+import numpy
+
+from furret.enrichment import benjamini_hochberg, enrichment, hypergeometric_sf
+from furret.matrices import Incidence
+
+
+def _exact_sf(k, population, successes, draws):
+    """P(X >= k) from the binomial coefficients, in exact arithmetic"""
+    upper = min(successes, draws)
+    total = sum(comb(successes, i) * comb(population - successes, draws - i) for i in range(max(k, 0), upper + 1))
+    return float(Fraction(total, comb(population, draws)))
+
+
+def test_hypergeometric_sf_is_exact_on_both_sides_of_the_mode():
+    cases = [(k, population, successes, draws) for population, successes, draws in
+             [(20, 7, 5), (50, 25, 25), (60, 3, 40), (100, 10, 90), (1, 1, 1), (30, 0, 10), (30, 10, 0)]
+             for k in range(-1, min(successes, draws) + 2)]
+    k, population, successes, draws = (numpy.array(c) for c in zip(*cases))
+    result = hypergeometric_sf(k, population, successes, draws)
+    expected = numpy.array([_exact_sf(*c) for c in cases])
+    assert numpy.allclose(result, expected, rtol=1e-9, atol=1e-15)
+
+
+def test_hypergeometric_sf_keeps_tiny_upper_tails():
+    # far below what 1 - P(X < k) could resolve in double precision
+    result = hypergeometric_sf(numpy.array([40]), numpy.array([5000]), numpy.array([40]), numpy.array([40]))
+    assert numpy.isclose(result[0], _exact_sf(40, 5000, 40, 40), rtol=1e-9)
+    assert 0 < result[0] < 1e-90
+
+
+def test_hypergeometric_sf_of_nothing():
+    assert hypergeometric_sf(numpy.array([]), numpy.array([]), numpy.array([]), numpy.array([])).shape == (0,)
+
+
+def test_benjamini_hochberg():
+    pvalues = numpy.array([0.01, 0.04, 0.03, 0.005, 0.5])
+    # sorted: 0.005 0.01 0.03 0.04 0.5 scaled by 5 / rank, then made monotone from the largest
+    expected = numpy.array([0.025, 0.05, 0.05, 0.025, 0.5])
+    assert numpy.allclose(benjamini_hochberg(pvalues), expected)
+    assert benjamini_hochberg(numpy.array([0.9, 0.8])).tolist() == [0.9, 0.9]
+    assert benjamini_hochberg(numpy.array([1.0, 1.0, 0.6])).max() == 1.0
+    assert len(benjamini_hochberg(numpy.zeros(0))) == 0
+
+
+def test_enrichment_counts_only_annotated_proteins():
+    proteins = ['P1', 'P2', 'P3', 'P4', 'P5']
+    families = Incidence.from_pairs(proteins, ['P1', 'P2', 'P3', 'P5'], ['F', 'F', 'F', 'G'])
+    terms = Incidence.from_pairs(proteins, ['P1', 'P2', 'P3', 'P4'], ['T', 'T', 'U', 'U'])
+    df = enrichment(families, terms).set_index(['Family', 'Term'])
+    # P5 has no term: the background is 4 and family F has 3 annotated members
+    assert sorted(df.index) == [('F', 'T'), ('F', 'U')]
+    row = df.loc[('F', 'T')]
+    assert (row['Count'], row['Family Size'], row['Term Count'], row['Background']) == (2, 3, 2, 4)
+    assert numpy.isclose(row['P-value'], _exact_sf(2, 4, 2, 3))
+    assert numpy.isclose(row['Expected'], 1.5)
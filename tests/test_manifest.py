@@ -0,0 +1,48 @@
+import os
+
+import pandas
+
+from furret.manifest import MANIFEST_FILE, Manifest, fingerprint
+
+
+def test_is_current_needs_the_same_key_and_the_file(tmp_path):
+    manifest = Manifest(str(tmp_path))
+    path = str(tmp_path / 'table.xlsx')
+    manifest.record(path, 'key')
+    assert not manifest.is_current(path, 'key')
+    open(path, 'wt').close()
+    assert manifest.is_current(path, 'key')
+    assert not manifest.is_current(path, 'other key')
+    assert not manifest.is_current(str(tmp_path / 'other.xlsx'), 'key')
+    os.remove(path)
+    assert not manifest.is_current(path, 'key')
+
+
+def test_entries_survive_saving_and_are_relative(tmp_path):
+    querydir = tmp_path / 'query'
+    (querydir / 'Families').mkdir(parents=True)
+    manifest = Manifest(str(querydir))
+    path = str(querydir / 'Families' / 'list.txt')
+    assert manifest.write_text(path, 'P1\n')
+    assert not manifest.write_text(path, 'P1\n')
+    manifest.save()
+    assert os.path.isfile(querydir / MANIFEST_FILE)
+    # the query directory can be moved
+    os.rename(querydir, tmp_path / 'moved')
+    moved = Manifest(str(tmp_path / 'moved'))
+    path = str(tmp_path / 'moved' / 'Families' / 'list.txt')
+    assert moved.was_recorded(path)
+    assert moved.is_current(path, fingerprint(b'P1\n'))
+    assert not moved.write_text(path, 'P1\n')
+    assert moved.write_text(path, 'P2\n')
+    with open(path, 'rt') as the_file:
+        assert the_file.read() == 'P2\n'
+    assert not os.path.exists(str(tmp_path / 'moved' / 'Families' / 'list.part.txt'))
+
+
+def test_fingerprint_of_frames_depends_on_content_and_labels():
+    df = pandas.DataFrame({'Uniprot': ['P1', 'P2'], 'Scope': [['a'], ['b']]})
+    assert fingerprint(df) == fingerprint(df.copy())
+    assert fingerprint(df) != fingerprint(df.rename(columns={'Scope': 'Scopes'}))
+    assert fingerprint(df) != fingerprint(df.iloc[::-1])
+    assert fingerprint('a', 'b') != fingerprint('ab')
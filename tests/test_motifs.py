@@ -0,0 +1,51 @@
+import itertools
+
+import numpy
+
+from furret.encoding import AMINO_ACIDS, UNKNOWN, encode, sequence_ids
+from furret.motifs import SCORE_SCALE, Motif, pssm, scan_motif, score_pvalues
+
+
+def _motif(width, seed):
+    random = numpy.random.default_rng(seed)
+    probabilities = random.dirichlet(numpy.full(len(AMINO_ACIDS), 0.3), size=width)
+    background = random.dirichlet(numpy.full(len(AMINO_ACIDS), 5.0))
+    return Motif('MEME-1', '', 'Pfam', 'PF1', width, 10, 1e-5, probabilities, background)
+
+
+def _enumerated(matrix, background):
+    """{rounded score: probability} of every word of the motif width"""
+    scaled = numpy.round(matrix[:, :UNKNOWN] * SCORE_SCALE).astype(numpy.int64)
+    distribution = {}
+    for word in itertools.product(range(len(AMINO_ACIDS)), repeat=len(matrix)):
+        score = int(sum(scaled[j, a] for j, a in enumerate(word)))
+        distribution[score] = distribution.get(score, 0.0) + numpy.prod(background[list(word)])
+    return distribution
+
+
+def test_score_pvalues_is_the_exact_distribution():
+    for width, seed in ((1, 1), (2, 2), (3, 3)):
+        motif = _motif(width, seed)
+        matrix = pssm(motif)
+        low, survival = score_pvalues(matrix, motif.background)
+        distribution = _enumerated(matrix, motif.background)
+        assert low == min(distribution)
+        assert len(survival) == max(distribution) - low + 1
+        assert numpy.isclose(survival[0], 1.0)
+        for score in range(low, max(distribution) + 1):
+            expected = sum(p for s, p in distribution.items() if s >= score)
+            assert numpy.isclose(survival[score - low], expected, rtol=1e-9, atol=1e-15), (width, score)
+
+
+def test_scan_finds_the_consensus_inside_sequences_only():
+    motif = _motif(4, 4)
+    consensus = ''.join(AMINO_ACIDS[i] for i in motif.probabilities.argmax(axis=1))
+    sequences = ['GG' + consensus + 'GG', consensus[:2], consensus[2:] + 'XX', consensus]
+    codes, offsets = encode(sequences)
+    hits = scan_motif(motif, codes, offsets, threshold=1e-3)
+    # the halves at the end of one sequence and the start of the next are not a window
+    assert [(sequence, position) for sequence, position, _, _ in hits] == [(0, 2), (3, 0)]
+    score = pssm(motif)[numpy.arange(4), encode([consensus])[0]].sum()
+    assert numpy.isclose(hits[0][2], score)
+    assert scan_motif(motif, codes, offsets, 1e-3, sequence_ids(offsets)) == hits
+    assert scan_motif(motif, *encode(['GG']), threshold=1.0) == []
@@ -0,0 +1,103 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import furret.network as network
+from furret.network import Client, HostPolicy
+
+RATE = 10.0
+BURST = 2
+CONCURRENCY = 2
+
+
+class StubHost(BaseHTTPRequestHandler):
+    lock = threading.Lock()
+    arrivals = []  # time of every request
+    active = 0
+    most_active = 0
+
+    def _answer(self):
+        with StubHost.lock:
+            StubHost.arrivals.append(time.monotonic())
+            StubHost.active += 1
+            StubHost.most_active = max(StubHost.most_active, StubHost.active)
+        time.sleep(0.05)
+        with StubHost.lock:
+            StubHost.active -= 1
+        length = int(self.headers.get('Content-Length') or 0)
+        answer = self.rfile.read(length) if length else b'ok'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    do_GET = _answer
+    do_POST = _answer
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(monkeypatch):
+    StubHost.arrivals, StubHost.active, StubHost.most_active = [], 0, 0
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), StubHost)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    host = f'127.0.0.1:{httpd.server_port}'
+    monkeypatch.setitem(network.POLICIES, host, HostPolicy(rate=RATE, burst=BURST, concurrency=CONCURRENCY))
+    yield f'http://{host}/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _check_rate_limit(n):
+    arrivals = sorted(StubHost.arrivals)
+    assert len(arrivals) == n
+    # by the k-th request the bucket has given at most BURST + RATE * elapsed tokens
+    for k, arrival in enumerate(arrivals):
+        assert k + 1 <= BURST + RATE * (arrival - arrivals[0]) + 1, f'request {k} too early'
+    assert StubHost.most_active <= CONCURRENCY
+
+
+def test_concurrent_async_calls_share_the_rate_limit(server):
+    client = Client(retries=0)
+
+    async def main():
+        return await asyncio.gather(*[client.get_async(server) for _ in range(8)],
+                                    *[client.post_async(server, data=b'posted') for _ in range(4)])
+
+    start = time.monotonic()
+    responses = asyncio.run(main())
+    assert [r.content for r in responses] == [b'ok'] * 8 + [b'posted'] * 4
+    assert time.monotonic() - start >= (12 - BURST) / RATE * 0.9
+    _check_rate_limit(12)
+    metrics = client.metrics()[server.split('/')[2]]
+    assert metrics['requests'] == 12 and metrics['failures'] == 0
+
+
+def test_async_and_threaded_calls_share_the_limits(server):
+    client = Client(retries=0)
+    threads = [threading.Thread(target=client.get, args=(server,)) for _ in range(5)]
+
+    async def main():
+        return await asyncio.gather(*[client.get_async(server) for _ in range(5)])
+
+    for thread in threads:
+        thread.start()
+    asyncio.run(main())
+    for thread in threads:
+        thread.join()
+    _check_rate_limit(10)
+
+
+def test_module_functions_use_the_shared_client(server):
+    async def main():
+        return await asyncio.gather(network.get_async(server), network.post_async(server, data=b'x'))
+
+    first, second = asyncio.run(main())
+    assert (first.content, second.content) == (b'ok', b'x')
+    assert network.client.metrics()[server.split('/')[2]]['requests'] == 2
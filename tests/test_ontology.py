@@ -0,0 +1,98 @@
+import pytest
+
+from furret.matrices import Incidence
+from furret.ontology import Ontology
+
+# root <- a <- c, root <- b <- c (part_of), d obsolete, e has an alternative id
+OBO = '''format-version: 1.2
+
+[Term]
+id: GO:0000001
+name: root
+namespace: biological_process
+
+[Term]
+id: GO:0000002
+name: a
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000003
+name: b
+namespace: biological_process
+is_a: GO:0000001 ! root
+
+[Term]
+id: GO:0000004
+name: c
+namespace: biological_process
+is_a: GO:0000002 ! a
+relationship: part_of GO:0000003 ! b
+
+[Term]
+id: GO:0000005
+name: d
+is_obsolete: true
+
+[Term]
+id: GO:0000006
+name: e
+namespace: molecular_function
+alt_id: GO:0000099
+is_a: GO:0000004
+relationship: regulates GO:0000001
+
+[Typedef]
+id: part_of
+name: part of
+'''
+
+
+@pytest.fixture
+def ontology(tmp_path):
+    obo = tmp_path / 'go.obo'
+    obo.write_text(OBO)
+    return Ontology.from_obo(str(obo))
+
+
+def _ancestors(ontology, term):
+    return sorted(ontology.ancestors(term))
+
+
+def test_closure_follows_is_a_and_part_of(ontology):
+    assert list(ontology.ids) == ['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004', 'GO:0000006']
+    assert _ancestors(ontology, 'GO:0000001') == ['GO:0000001']
+    assert _ancestors(ontology, 'GO:0000004') == ['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004']
+    # other relationships are not followed, alternative ids are the same term
+    assert _ancestors(ontology, 'GO:0000099') == _ancestors(ontology, 'GO:0000006') == \
+        ['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004', 'GO:0000006']
+    assert list(ontology.depths) == [0, 1, 1, 2, 3]
+    assert list(ontology.namespaces) == ['P', 'P', 'P', 'P', 'F']
+
+
+def test_cycles_are_refused(tmp_path):
+    obo = tmp_path / 'go.obo'
+    obo.write_text('[Term]\nid: GO:1\nis_a: GO:2\n\n[Term]\nid: GO:2\nis_a: GO:1\n')
+    with pytest.raises(ValueError):
+        Ontology.from_obo(str(obo))
+
+
+def test_saved_closure_is_loaded_only_with_its_key(ontology, tmp_path):
+    cache = str(tmp_path / 'closure.npz')
+    ontology.save(cache, 'key')
+    assert Ontology.load(cache, 'other key') is None
+    loaded = Ontology.load(cache, 'key')
+    assert _ancestors(loaded, 'GO:0000099') == _ancestors(ontology, 'GO:0000006')
+    assert list(loaded.names) == list(ontology.names)
+
+
+def test_propagate_and_counts(ontology):
+    annotations = Incidence.from_pairs(['P1', 'P2', 'P3'], ['P1', 'P1', 'P2', 'P3'],
+                                       ['GO:0000004', 'GO:0000002', 'GO:0000099', 'GO:unknown'])
+    propagated = ontology.propagate(annotations)
+    terms = {row: sorted(propagated.terms(row)) for row in propagated.rows}
+    assert terms == {'P1': ['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004'],
+                     'P2': ['GO:0000001', 'GO:0000002', 'GO:0000003', 'GO:0000004', 'GO:0000006'], 'P3': []}
+    counts = ontology.counts(propagated, max_depth=1).set_index('ID')['Count'].to_dict()
+    assert counts == {'GO:0000001': 2, 'GO:0000002': 2, 'GO:0000003': 2}
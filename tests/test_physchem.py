@@ -0,0 +1,48 @@
+import numpy
+
+from furret.encoding import AMINO_ACIDS, UNKNOWN, encode
+from furret.physchem import C_TERMINAL_PK, N_TERMINAL_PK, WATER, WEIGHTS, _charge, _c_terminal, _n_terminal, profile
+
+SEQUENCES = ['MKTLLLTLVVVTIVCLDLGYTRICFNHQSSQPQTTKTCSPGESSCYNKQWSDFRGTIIERGCGCPTVKPGIKLSCCESEVCNN',
+             'DDDDEEEE', 'KKKKRRRR', 'GGGG', 'AXBC', '']
+
+
+def _counts(sequence):
+    codes, _ = encode([sequence])
+    return numpy.bincount(codes, minlength=UNKNOWN + 1).astype(float)[None, :], codes
+
+
+def test_charge_is_zero_at_the_pi():
+    df = profile(SEQUENCES)
+    for sequence, pi in zip(SEQUENCES[:-1], df['pI']):
+        counts, codes = _counts(sequence)
+        charge = _charge(pi, counts, _n_terminal[codes[:1]], _c_terminal[codes[-1:]])
+        assert abs(charge[0]) < 1e-6, sequence
+    acidic, basic, neutral = df['pI'][1:4]
+    assert acidic < 4 < neutral < 7 < 10 < basic
+
+
+def test_terminal_pk_depend_on_the_terminal_residues():
+    codes, _ = encode(['AGGE'])
+    assert _n_terminal[codes[0]] == N_TERMINAL_PK['A']
+    assert _c_terminal[codes[-1]] == C_TERMINAL_PK['E']
+
+
+def test_weight_composition_and_empty_sequences():
+    df = profile(SEQUENCES)
+    assert numpy.isclose(df['Molecular Weight'][3], 4 * WEIGHTS['G'] - 3 * WATER)
+    assert df['Cysteines'].tolist()[3:] == [0, 1, 0]
+    # unknown residues count in the composition denominator but have no hydropathy
+    assert numpy.isclose(df['%C'][4], 25.0)
+    assert numpy.isclose(df['GRAVY'][4], (1.8 + 2.5) / 2)
+    assert numpy.isclose(df['Charge pH 7'][1], profile(['DDDDEEEE'])['Charge pH 7'][0])
+    assert df.iloc[-1][['Molecular Weight', 'pI', 'Charge pH 7', '%A']].isna().all()
+    composition = df[[f'%{a}' for a in AMINO_ACIDS]].sum(axis=1)
+    assert numpy.allclose(composition[:4], 100.0)
+
+
+def test_sequences_do_not_affect_each_other():
+    together = profile(SEQUENCES)
+    for i, sequence in enumerate(SEQUENCES[:-1]):
+        alone = profile([sequence])
+        assert numpy.allclose(together.iloc[i].values, alone.iloc[0].values, equal_nan=True), sequence
@@ -0,0 +1,54 @@
+import threading
+import time
+
+import pytest
+
+from furret.pipeline import Pipeline, Step, run_pipeline
+
+
+def test_steps_run_in_order():
+    steps = [Step('double', lambda x: 2 * x), Step('odd only', lambda x: x if x % 4 else None),
+             Step('split', lambda x: (x, -x), expand=True)]
+    assert list(run_pipeline(range(6), steps)) == [2, -2, 6, -6, 10, -10]
+    assert sorted(run_pipeline(range(100), [Step('square', lambda x: x * x, workers=4)])) == \
+        [x * x for x in range(100)]
+    assert list(run_pipeline([], steps)) == []
+
+
+def _failing(x):
+    if x == 3:
+        raise ValueError(f'bad item {x}')
+    return x
+
+
+def test_a_failing_step_stops_everything_and_raises():
+    seen = []
+    steps = [Step('check', _failing, workers=2), Step('collect', seen.append)]
+    with pytest.raises(ValueError, match='bad item 3'):
+        list(run_pipeline(range(10_000), steps, maxsize=2))
+    # the pipeline stopped early: the bounded queues kept the source from running ahead
+    assert len(seen) < 100
+    assert not any(thread.name in ('source', 'check', 'collect') for thread in threading.enumerate())
+
+
+def test_a_failing_source_raises():
+    def source():
+        yield 1
+        raise OSError('source is gone')
+
+    with pytest.raises(OSError, match='source is gone'):
+        list(run_pipeline(source(), [Step('identity', lambda x: x)]))
+
+
+def test_leaving_the_iteration_stops_the_threads():
+    def slow(x):
+        time.sleep(0.01)
+        return x
+
+    pipeline = Pipeline(range(10_000), [Step('slow', slow, workers=2)], maxsize=2)
+    for item in pipeline:
+        if item >= 5:
+            break
+    assert pipeline.stop.is_set()
+    assert not any(thread.is_alive() for thread in pipeline.threads)
+    assert pipeline.errors == []
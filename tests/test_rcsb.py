@@ -0,0 +1,137 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+import furret.trace as trace
+from furret.rcsb import EMPTY_RETRY_DAYS, MetadataStore, fetch_metadata
+
+# what the stub RCSB knows
+ENTRIES = {
+    '1ABC': {'rcsb_id': '1ABC',
+             'rcsb_accession_info': {'initial_release_date': '1999-05-04T00:00:00+0000'},
+             'refine': [{'ls_R_factor_R_free': 0.234}],
+             'rcsb_entry_info': {'nonpolymer_bound_components': ['ZN', 'HEM']},
+             'polymer_entities': [{'rcsb_entity_source_organism': [{'ncbi_scientific_name': 'Naja naja'}]}],
+             'assemblies': [{'rcsb_struct_symmetry': [{'oligomeric_state': 'Homo 2-mer'}]}]},
+    '2DEF': {'rcsb_id': '2DEF',
+             'rcsb_accession_info': {'initial_release_date': '2005-01-01T00:00:00+0000'},
+             'refine': None,
+             'rcsb_entry_info': {'nonpolymer_bound_components': None},
+             'polymer_entities': [],
+             'assemblies': []},
+    '3GHI': {'rcsb_id': '3GHI',
+             'rcsb_accession_info': {'initial_release_date': '2010-10-10T00:00:00+0000'},
+             'refine': [{'ls_R_factor_R_free': None}],
+             'rcsb_entry_info': {'nonpolymer_bound_components': []},
+             'polymer_entities': [{'rcsb_entity_source_organism': [{'ncbi_scientific_name': 'Homo sapiens'}]},
+                                  {'rcsb_entity_source_organism': [{'ncbi_scientific_name': 'Mus musculus'}]}],
+             'assemblies': [{'rcsb_struct_symmetry': [{'oligomeric_state': 'Monomer'}]}]},
+}
+
+
+class StubRCSB(BaseHTTPRequestHandler):
+    requests = []  # the ids of every GraphQL request
+    failing = set()  # ids answered with a GraphQL error, and left out of the data
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        ids = body['variables']['ids']
+        StubRCSB.requests.append(ids)
+        # like RCSB, unknown ids are left out of the answer
+        answer = {'data': {'entries': [ENTRIES[i] for i in ids if i in ENTRIES and i not in StubRCSB.failing]}}
+        errors = [{'message': f'timeout fetching {i}'} for i in ids if i in StubRCSB.failing]
+        if errors:
+            answer['errors'] = errors
+        answer = json.dumps(answer).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    StubRCSB.requests, StubRCSB.failing = [], set()
+    httpd = HTTPServer(('127.0.0.1', 0), StubRCSB)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/graphql'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def store(tmp_path):
+    the_store = MetadataStore(str(tmp_path / 'rcsb.sqlite'))
+    yield the_store
+    the_store.close()
+
+
+def test_codes_are_deduplicated_and_batched(server, store):
+    metadata = fetch_metadata(['1abc', '1ABC', '2def', '3ghi', '9zzz', None], store, batch_size=2, url=server)
+    assert StubRCSB.requests == [['1ABC', '2DEF'], ['3GHI', '9ZZZ']]
+    assert metadata['1ABC'] == {'Release Date': '1999-05-04', 'R-free': 0.234, 'Ligands': 'HEM, ZN',
+                                'Source Organism': 'Naja naja', 'Oligomeric State': 'Homo 2-mer'}
+    assert metadata['2DEF'] == {'Release Date': '2005-01-01', 'R-free': None, 'Ligands': '',
+                                'Source Organism': '', 'Oligomeric State': ''}
+    assert metadata['3GHI']['Source Organism'] == 'Homo sapiens; Mus musculus'
+    assert metadata['3GHI']['R-free'] is None
+
+
+def test_second_call_is_served_from_the_store(server, store):
+    first = fetch_metadata(['1ABC', '2DEF', '3GHI'], store, url=server)
+    assert len(StubRCSB.requests) == 1
+    second = fetch_metadata(['3ghi', '1abc', '2def'], store, url=server)
+    assert len(StubRCSB.requests) == 1
+    assert second == first
+
+
+def test_unknown_codes_are_cached(server, store):
+    assert fetch_metadata(['9ZZZ'], store, url=server) == {'9ZZZ': {}}
+    assert fetch_metadata(['9ZZZ'], store, url=server) == {'9ZZZ': {}}
+    assert StubRCSB.requests == [['9ZZZ']]
+    # only the new codes are asked
+    fetch_metadata(['9ZZZ', '1ABC'], store, url=server)
+    assert StubRCSB.requests == [['9ZZZ'], ['1ABC']]
+
+
+def test_failed_batches_are_not_cached(store):
+    # nothing listens there: the batch fails, nothing is stored and the codes are asked again next time
+    unreachable = 'http://127.0.0.1:9/graphql'
+    from furret.network import client
+    retries = client.retries
+    client.retries = 0
+    try:
+        assert fetch_metadata(['1ABC'], store, url=unreachable) == {}
+    finally:
+        client.retries = retries
+    assert store.get(['1ABC']) == {}
+
+
+def test_unknown_codes_are_asked_again_after_the_retry_window(server, store):
+    fetch_metadata(['9ZZZ', '1ABC'], store, url=server)
+    # as if they had been stored EMPTY_RETRY_DAYS + 1 days ago
+    old = time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - (EMPTY_RETRY_DAYS + 1) * 86400))
+    store.connection.execute('UPDATE entries SET fetched = ?', (old,))
+    store.connection.commit()
+    fetch_metadata(['9ZZZ', '1ABC'], store, url=server)
+    assert StubRCSB.requests == [['1ABC', '9ZZZ'], ['9ZZZ']]
+
+
+def test_codes_left_out_of_an_answer_with_errors_are_not_cached(server, store, tmp_path):
+    StubRCSB.failing = {'2DEF'}
+    with trace.session(str(tmp_path), 'test') as record:
+        metadata = fetch_metadata(['1ABC', '2DEF', '9ZZZ'], store, url=server)
+    assert set(metadata) == {'1ABC'}
+    assert record.args['unretrieved RCSB entries'] == 2
+    StubRCSB.failing = set()
+    metadata = fetch_metadata(['1ABC', '2DEF', '9ZZZ'], store, url=server)
+    assert StubRCSB.requests == [['1ABC', '2DEF', '9ZZZ'], ['2DEF', '9ZZZ']]
+    assert metadata['2DEF']['Release Date'] == '2005-01-01' and metadata['9ZZZ'] == {}
@@ -0,0 +1,45 @@
+import random
+
+import numpy
+
+from furret.redundancy import cluster_sequences, kmer_matrix
+
+
+def _dense(matrix):
+    dense = numpy.zeros(matrix.shape, dtype=int)
+    dense[matrix.row_ids(), matrix.indices] = 1
+    return dense
+
+
+def test_kmer_matrix_is_sparse_and_skips_unknown_and_crossing_windows():
+    matrix = kmer_matrix(['ACDAC', 'ACXDA', 'CD'])
+    # ACD, CDA, DAC | nothing with X, and no window across two sequences | CD is too short
+    assert matrix.shape == (3, 3)
+    assert matrix.row_lengths().tolist() == [3, 0, 0]
+    assert len(matrix.indices) == 3
+
+
+def test_repeated_kmers_count_once():
+    matrix = kmer_matrix(['AAAAAA', 'AAAC'])
+    assert matrix.row_lengths().tolist() == [1, 2]
+
+
+def test_intersections_are_the_dense_product():
+    random.seed(3)
+    sequences = [''.join(random.choice('ACDEFGHIKX') for _ in range(random.randint(0, 40))) for _ in range(30)]
+    matrix = kmer_matrix(sequences)
+    dense = _dense(matrix)
+    transposed = matrix.transpose()
+    for i in range(len(sequences)):
+        assert matrix.intersections(i, transposed).tolist() == (dense @ dense[i]).tolist()
+
+
+def test_clusters():
+    base = 'MKTLLLTLVVVTIVCLDLGYTRICFNHQSSQPQTTKTCSPGESSCYNKQWSDFRGTIIERGCGCPTVKPGIKLSCCESEVCNN'
+    near = base[:40] + 'W' + base[41:]
+    other = 'GSSGSSGSSGAVLKEVMLKLAQEAREKAGLEQDRHAALLLRNHGAEQGPV'
+    clusters = cluster_sequences(['base', 'copy', 'near', 'other', 'short'],
+                                 [base, base.lower(), near, other, base[:30]], identity=0.9)
+    # the longest sequence represents its exact copies, its near duplicates and its fragments
+    assert clusters == {'base': ['base', 'copy', 'near', 'short'], 'other': ['other']}
+    assert cluster_sequences(['a', 'b'], [base, near], identity=1.0) == {'a': ['a'], 'b': ['b']}
@@ -0,0 +1,91 @@
+import pickle
+from types import SimpleNamespace
+
+import pandas
+
+from furret.search import build_index, SearchIndex
+
+
+def _query(proteins):
+    """(proteins, tables) of a query with one comment and one citation per protein"""
+    the_proteins = {accession: SimpleNamespace(accession=accession, name=name, organism=organism)
+                    for accession, name, organism, _, _ in proteins}
+    tables = SimpleNamespace(
+        comments=pandas.DataFrame([(accession, 'function', comment) for accession, _, _, comment, _ in proteins],
+                                  columns=('Uniprot', 'Type', 'Text')),
+        citations=pandas.DataFrame([(accession, title) for accession, _, _, _, title in proteins],
+                                   columns=('Uniprot', 'Title')),
+        cit_scopes=pandas.DataFrame([(accession, title, ['PROTEIN SEQUENCE'])
+                                     for accession, _, _, _, title in proteins], columns=('Uniprot', 'Title', 'Scope')))
+    return the_proteins, tables
+
+
+PROTEINS = [('P1', 'Short neurotoxin', 'Naja naja', 'Binds the acetylcholine receptor.', 'A cobra toxin.'),
+            ('P2', 'Phospholipase A2', 'Naja naja', 'Hydrolyzes phospholipids.', 'Venom enzymes.'),
+            ('P3', 'Cardiotoxin', 'Naja atra', 'Lyses cardiomyocytes.', 'A cobra cytotoxin.')]
+
+
+def _hits(index, text):
+    return sorted({(accession, table, row) for table, accession, row, _ in index.search(text).values})
+
+
+def test_update_reindexes_only_changed_accessions(tmp_path):
+    index, indexed = build_index(*_query(PROTEINS))
+    assert indexed == 3
+    index.save(str(tmp_path))
+    changed = [PROTEINS[0], ('P2', 'Phospholipase A2', 'Naja naja', 'Hydrolyzes membranes.', 'Venom enzymes.'),
+               ('P4', 'Kunitz inhibitor', 'Dendroaspis', 'Blocks potassium channels.', 'A mamba toxin.')]
+    index, indexed = build_index(*_query(changed), SearchIndex.load(str(tmp_path)))
+    # P2 changed, P4 is new, P1 is kept as it is and P3 is dropped
+    assert indexed == 2
+    fresh, _ = build_index(*_query(changed))
+    for text in ('cobra', 'phospholip*', 'membranes', 'phospholipids', 'cardiotoxin', 'toxin OR enzymes',
+                 'naja -neurotoxin', 'potassium'):
+        assert _hits(index, text) == _hits(fresh, text), text
+    assert sorted(index.fingerprints) == ['P1', 'P2', 'P4']
+    assert len(index.documents) == len(fresh.documents)
+
+
+def test_unchanged_accessions_get_their_new_rows():
+    index, _ = build_index(*_query(PROTEINS))
+    # P1 moves from the first to the last row of every table
+    index, indexed = build_index(*_query(PROTEINS[1:] + PROTEINS[:1]), index)
+    assert indexed == 0
+    assert _hits(index, 'acetylcholine') == [('P1', 'comments', 2)]
+    assert _hits(index, 'neurotoxin') == [('P1', 'proteins', 2)]
+
+
+def test_indexes_saved_without_fingerprints_are_built_again(tmp_path):
+    index, _ = build_index(*_query(PROTEINS))
+    state = dict(index.__dict__)
+    for name in ('fingerprints', 'accession_documents', '_removed'):
+        del state[name]
+    old = SearchIndex.__new__(SearchIndex)
+    old.__dict__.update(state)
+    with open(tmp_path / 'search.pickle', 'wb') as index_file:
+        pickle.dump(old, index_file)
+    loaded = SearchIndex.load(str(tmp_path))
+    assert _hits(loaded, 'cobra') == _hits(index, 'cobra')
+    rebuilt, indexed = build_index(*_query(PROTEINS), loaded)
+    assert indexed == 3 and len(rebuilt.documents) == len(index.documents)
+
+
+def _documents(index, text):
+    return [index.documents[doc][3] for doc in index.query(text)]
+
+
+def test_boolean_queries():
+    index = SearchIndex()
+    for row, text in enumerate(['Alpha-neurotoxin of cobra', 'Cobra venom phospholipase', 'Mamba neurotoxin',
+                                'Phospholipid binding']):
+        index.add('comments', f'P{row}', row, text)
+    assert _documents(index, 'cobra') == ['Alpha-neurotoxin of cobra', 'Cobra venom phospholipase']
+    assert _documents(index, 'COBRA neurotoxin') == ['Alpha-neurotoxin of cobra']
+    assert _documents(index, 'cobra OR mamba') == _documents(index, 'cobra') + ['Mamba neurotoxin']
+    assert _documents(index, 'neurotoxin -cobra') == _documents(index, 'neurotoxin NOT cobra') == ['Mamba neurotoxin']
+    assert _documents(index, 'phospholip*') == ['Cobra venom phospholipase', 'Phospholipid binding']
+    assert _documents(index, 'phospholip* -venom OR mamba') == ['Mamba neurotoxin', 'Phospholipid binding']
+    # hyphenated words need all their pieces, as they were indexed
+    assert _documents(index, 'alpha-neurotoxin') == ['Alpha-neurotoxin of cobra']
+    assert _documents(index, '-cobra') == _documents(index, 'zebra') == _documents(index, 'zeb*') == []
+    assert _documents(index, '') == []
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+import time
+
+import pytest
+
+import furret.trace as trace
+
+MB = 1 << 20
+
+pytestmark = pytest.mark.skipif(not trace.current_rss(), reason='RSS is read from /proc')
+
+
+def _allocate(size, seconds):
+    block = b'x' * size  # written, so resident
+    time.sleep(seconds)
+    del block
+
+
+def _records(directory):
+    return {record['name']: record for record in trace.read_trace(directory)}
+
+
+def test_peak_rss_is_the_one_of_each_stage(tmp_path):
+    with trace.session(str(tmp_path), 'test'):
+        with trace.stage('allocating'):
+            _allocate(200 * MB, 0.3)
+        with trace.stage('quiet'):
+            time.sleep(0.2)
+    records = _records(str(tmp_path))
+    allocating, quiet = records['allocating'], records['quiet']
+    start = allocating['rss'] - allocating['rss_delta']
+    # the block is freed before the end of the stage: only the sampled peak sees it
+    assert allocating['stage_peak_rss'] - start >= 150 * MB
+    assert allocating['rss_delta'] < 50 * MB
+    assert quiet['stage_peak_rss'] < allocating['stage_peak_rss'] - 100 * MB
+    # the parent stage includes the peak of its children
+    assert records['test']['stage_peak_rss'] >= allocating['stage_peak_rss']
+
+
+def test_concurrent_stages_have_their_own_peak(tmp_path):
+    def worker():
+        with trace.stage('other thread'):
+            _allocate(200 * MB, 0.3)
+
+    with trace.session(str(tmp_path), 'test'):
+        with trace.stage('before'):
+            time.sleep(0.1)
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+    records = _records(str(tmp_path))
+    assert records['other thread']['stage_peak_rss'] >= records['before']['stage_peak_rss'] + 150 * MB
+
+
+def test_stage_fields_and_chrome_trace(tmp_path):
+    with trace.session(str(tmp_path), 'test'):
+        with trace.stage('work') as stage:
+            trace.add_items(3)
+            trace.add_bytes(10)
+            trace.count('workbooks written')
+            trace.count('workbooks written', 2)
+    record = _records(str(tmp_path))['work']
+    assert record['pid'] == os.getpid()
+    assert (record['items'], record['bytes']) == (3, 10)
+    assert record['args'] == {'workbooks written': 3}
+    assert record['stage_peak_rss'] >= record['rss'] > 0
+    assert stage.stage_peak_rss == record['stage_peak_rss']
+    with open(os.path.join(str(tmp_path), trace.CHROME_TRACE_FILE), 'rt') as chrome_file:
+        events = {event['name']: event for event in json.load(chrome_file)['traceEvents']}
+    assert events['work']['args']['stage_peak_rss'] == record['stage_peak_rss']
+    assert events['work']['args']['workbooks written'] == 3
+
+
+def test_sampler_stops_with_the_session(tmp_path):
+    with trace.session(str(tmp_path), 'test'):
+        with trace.stage('work'):
+            time.sleep(0.05)
+    assert not any(thread.name == 'trace RSS sampler' for thread in threading.enumerate())
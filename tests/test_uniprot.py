@@ -0,0 +1,68 @@
+import math
+import os
+
+import pytest
+
+import furret.protein as protein
+from furret import uniprot
+from furret.utilities import Link
+
+DATA = os.path.join(os.path.dirname(__file__), 'data')
+
+
+def _read(name):
+    with open(os.path.join(DATA, name), 'rt') as the_file:
+        return the_file.read()
+
+
+@pytest.fixture
+def proteins(monkeypatch):
+    # the keyword categories come from the network
+    monkeypatch.setattr(protein, 'keyword_categories', lambda: {'KW-0800': 'Molecular function'})
+    xml = protein.Protein(uniprot.parse(_read('uniprot_P60301.xml'), 'xml')[0])
+    json = protein.Protein(uniprot.parse(_read('uniprot_P60301.json'), 'json')[0])
+    return xml, json
+
+
+def _structures(a_protein):
+    return [(pdb.code, pdb.method, 'nan' if math.isnan(pdb.resolution) else pdb.resolution, repr(pdb.chains))
+            for pdb in a_protein.experimental_structures]
+
+
+def test_json_and_xml_give_the_same_protein(proteins):
+    xml, json = proteins
+    for field in ('accession', 'name', 'organism', 'protein_existence', 'sequence', 'precursor', 'fragment',
+                  'citations', 'comments', 'go', 'keywords'):
+        assert getattr(json, field) == getattr(xml, field), field
+    assert [vars(link) for link in json.links] == [vars(link) for link in xml.links]
+    assert _structures(json) == _structures(xml)
+    assert json.coverage == xml.coverage
+
+
+def test_citations_keep_titles_scopes_and_doi_only_references(proteins):
+    xml, json = proteins
+    assert [(c.pubmed, c.doi, c.title, c.scope) for c in json.citations] == [
+        ('5555199', '10.1016/0005-2795(71)90292-8',
+         'The amino acid sequence of a neurotoxin from the venom of Naja naja.', ['PROTEIN SEQUENCE', 'TOXIC DOSE']),
+        (None, '10.1016/j.toxicon.2012.01.001', 'Mass spectrometry of elapid venoms.', ['MASS SPECTROMETRY'])]
+
+
+def test_comments_pdb_and_links(proteins):
+    _, json = proteins
+    assert [c.type for c in json.comments] == ['function', 'tissue specificity', 'mass spectrometry', 'toxic dose',
+                                               'PTM', 'similarity']
+    assert [(pdb.code, pdb.method) for pdb in json.experimental_structures] == [('1ntn', 'X-ray'), ('2ntx', 'NMR')]
+    assert math.isnan(json.experimental_structures[1].resolution)
+    assert [(link.database, link.id, link.name) for link in json.links] == [
+        ('Gene3D', '2.10.60.10', 'CD59'), ('InterPro', 'IPR003571', 'Snake_3FTx'),
+        ('InterPro', 'IPR045860', 'Snake_toxin-like_sf'), ('Pfam', 'PF00087', 'Toxin_TOLIP'),
+        ('SUPFAM', 'SSF57302', 'Snake toxin-like'), ('PROSITE', 'PS00272', 'SNAKE_TOXIN')]
+
+
+def test_cross_reference_without_properties():
+    reference = uniprot.json_entry({'primaryAccession': 'P1', 'sequence': {'value': 'MK'},
+                                    'uniProtKBCrossReferences': [{'database': 'SMART', 'id': 'SM00001'}]})
+    element = reference['dbReference'][0]
+    assert element == {'@type': 'SMART', '@id': 'SM00001', 'property': []}
+    link = Link(database='SMART', data=element)
+    assert (link.id, link.name) == ('SM00001', '')
@@ -0,0 +1,135 @@
+import os
+import signal
+import sqlite3
+import stat
+import time
+
+import pytest
+
+from furret.meme import MemeJob
+from furret.worker import MAX_ATTEMPTS, QUEUE_FILE, WorkQueue, start_workers
+
+# writes what MEME would, logs its FASTA file; while the hold file exists it blocks (and then fails)
+STUB_MEME = '''#!/bin/sh
+if [ -f "{hold}" ]; then
+    while [ -f "{hold}" ]; do sleep 0.1; done
+    exit 1
+fi
+echo "$1" >> "{log}"
+echo "MEME version 5" > meme.txt
+echo "<html></html>" > meme.html
+'''
+
+
+@pytest.fixture
+def query(tmp_path):
+    """a query directory with 6 family FASTA files and a stub MEME executable"""
+    querydir = tmp_path / 'query'
+    jobs = []
+    for i in range(6):
+        family = querydir / 'Families' / 'Pfam' / f'PF{i}'
+        family.mkdir(parents=True)
+        fasta = family / f'Pfam_PF{i}.fasta'
+        fasta.write_text(f'>P{i}\nMKTLLLTLVV\n>Q{i}\nMKTLLLTLVA\n')
+        destination = querydir / 'Motives' / 'Pfam' / f'PF{i}'
+        destination.mkdir(parents=True)
+        jobs.append((str(fasta), str(destination)))
+    meme = tmp_path / 'meme.sh'
+    meme.write_text(STUB_MEME.format(hold=tmp_path / 'hold', log=tmp_path / 'meme.log'))
+    meme.chmod(meme.stat().st_mode | stat.S_IXUSR)
+    return querydir, [MemeJob(fasta, destination, str(meme)) for fasta, destination in jobs], tmp_path
+
+
+def _rows(querydir):
+    connection = sqlite3.connect(os.path.join(querydir, 'Motives', QUEUE_FILE))
+    try:
+        return {destination: (state, attempts) for destination, state, attempts
+                in connection.execute('SELECT destination, state, attempts FROM jobs')}
+    finally:
+        connection.close()
+
+
+def _logged(tmp_path):
+    log = tmp_path / 'meme.log'
+    return log.read_text().split() if log.exists() else []
+
+
+def test_workers_run_every_job_once(query):
+    querydir, jobs, tmp_path = query
+    queue = WorkQueue(str(querydir))
+    assert queue.submit(jobs) == len(jobs)
+    workers = start_workers(str(querydir), 3)
+    for worker in workers:
+        worker.join(60)
+    assert all(worker.exitcode == 0 for worker in workers)
+    assert queue.counts() == {'pending': 0, 'running': 0, 'done': len(jobs), 'failed': 0}
+    assert sorted(_logged(tmp_path)) == sorted(job.fasta_file for job in jobs)
+    assert all(os.path.isfile(os.path.join(job.destination_directory, 'meme.txt')) for job in jobs)
+    queue.close()
+
+
+def test_job_of_killed_worker_is_requeued(query):
+    querydir, jobs, tmp_path = query
+    hold = tmp_path / 'hold'
+    hold.touch()
+    queue = WorkQueue(str(querydir))
+    queue.submit(jobs[:1])
+    # this worker claims the job, then dies while MEME runs: its lease is not renewed anymore
+    victim = start_workers(str(querydir), 1, lease=1.0)[0]
+    end = time.time() + 30
+    while queue.counts()['running'] == 0:
+        assert time.time() < end, 'the job was never claimed'
+        time.sleep(0.1)
+    os.kill(victim.pid, signal.SIGKILL)
+    victim.join()
+    hold.unlink()
+    queue.submit(jobs[1:])
+    workers = start_workers(str(querydir), 2, lease=1.0)
+    for worker in workers:
+        worker.join(60)
+    rows = _rows(querydir)
+    killed = os.path.relpath(jobs[0].destination_directory, str(querydir))
+    assert rows[killed] == ('done', 2)
+    assert all(state == 'done' for state, _ in rows.values())
+    assert sorted(_logged(tmp_path)) == sorted(job.fasta_file for job in jobs)
+    queue.close()
+
+
+def test_lease_expiring_too_often_fails_the_job(query):
+    querydir, jobs, _ = query
+    queue = WorkQueue(str(querydir))
+    queue.submit(jobs[:1])
+    for attempt in range(MAX_ATTEMPTS):
+        # an already expired lease: as if every worker died right after claiming
+        assert queue.claim(f'worker {attempt}', lease=-1.0) is not None
+    assert queue.claim('last worker') is None
+    assert queue.counts()['failed'] == 1
+    state, attempts = _rows(querydir)[os.path.relpath(jobs[0].destination_directory, str(querydir))]
+    assert (state, attempts) == ('failed', MAX_ATTEMPTS)
+    queue.close()
+
+
+def test_only_the_owner_finishes_a_job(query):
+    querydir, jobs, _ = query
+    queue = WorkQueue(str(querydir))
+    queue.submit(jobs[:1])
+    job_id, _ = queue.claim('owner')
+    queue.finish(job_id, 'intruder')
+    assert not queue.heartbeat(job_id, 'intruder')
+    assert queue.counts()['running'] == 1
+    assert queue.heartbeat(job_id, 'owner')
+    queue.finish(job_id, 'owner')
+    assert queue.counts()['done'] == 1
+    queue.close()
+
+
+def test_requeued_job_is_not_finished_by_its_former_owner(query):
+    querydir, jobs, _ = query
+    queue = WorkQueue(str(querydir))
+    queue.submit(jobs[:1])
+    job_id, _ = queue.claim('slow', lease=-1.0)
+    assert queue.claim('fast') is not None
+    queue.finish(job_id, 'slow')
+    assert queue.counts()['running'] == 1
+    assert not queue.heartbeat(job_id, 'slow')
+    queue.close()